@@ -8,5 +8,13 @@ from ._astropy_init import *   # noqa
 
 __all__ = ['qa', 'main_cli']
 
-from . import qa
 from . import main_cli
+
+
+def __getattr__(name):
+    # qa pulls in matplotlib, so it is imported on first access
+    if name == 'qa':
+        import importlib
+        return importlib.import_module('.qa', __name__)
+    raise AttributeError(
+            "module {!r} has no attribute {!r}".format(__name__, name))
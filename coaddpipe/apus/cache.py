@@ -0,0 +1,284 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 21:40
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+cache.py
+
+The content-addressed cache of the task outputs, shared by the jobs.
+
+A job of a task that has ``cache`` set is keyed by the digests of the
+content of its inputs, in order, and of its parameters. The outputs of
+the job are stored as objects named by their digests, hard linked
+whenever possible, and a later job of the same key, e.g., in another job
+that shares the exposures, gets the outputs linked in instead of running
+the task.
+
+The job specific paths, e.g., the jobdir, are replaced with placeholders
+in the parameters and in the small input files like the configuration
+files, so they do not break the keys across jobs. The size of the cache
+is bounded by evicting the least recently used entries.
+"""
+
+import os
+import json
+import time
+import errno
+import shutil
+import sqlite3
+import threading
+import hashlib
+
+from .manifest import HashManifest, file_digest, flatten_files, params_digest
+
+
+CACHE_INDEX_FILE = 'index.sqlite'
+CACHE_DIGESTS_FILE = 'digests.sqlite'
+CACHE_OBJECTS_DIR = 'objects'
+
+# inputs smaller than this are hashed with the job specific paths replaced
+SMALL_FILE_SIZE = 1 << 16
+
+
+def _walk_files(files):
+    """Return the unique paths in the nested lists of files, in order.
+    Glob patterns are expanded in place."""
+    paths = []
+
+    def walk(f):
+        if isinstance(f, (list, tuple)):
+            for i in f:
+                walk(i)
+        elif isinstance(f, str):
+            for p in flatten_files(f):
+                if p not in paths:
+                    paths.append(p)
+    walk(files)
+    return paths
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        shutil.copy2(src, dst)
+
+
+class TaskCache(object):
+    """
+    The task output cache
+
+    Parameters
+    ----------
+    rootdir: str
+        The cache dir, typically in the workdir. It is created if not
+        exists.
+    max_size: int, optional
+        The maximum size of the objects in bytes. No limit if None.
+    replace: dict, optional
+        The job specific strings and their placeholders.
+
+    The connections are opened lazily in each process and thread, so the
+    cache can be passed to the tasks run in subprocesses.
+    """
+
+    def __init__(self, rootdir, max_size=None, replace=None):
+        self.rootdir = os.path.abspath(rootdir)
+        self.max_size = max_size
+        self.replace = dict(replace or {})
+        self.digests = HashManifest(
+                os.path.join(self.rootdir, CACHE_DIGESTS_FILE))
+        self._local = threading.local()
+
+    def __getstate__(self):
+        return {'rootdir': self.rootdir, 'max_size': self.max_size,
+                'replace': self.replace}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @property
+    def conn(self):
+        # one connection per process and thread, as the jobs are
+        # dispatched by the ruffus threads
+        local = self._local
+        if getattr(local, 'conn', None) is None or \
+                local.pid != os.getpid():
+            if not os.path.isdir(self.rootdir):
+                os.makedirs(self.rootdir, exist_ok=True)
+            local.conn = sqlite3.connect(
+                    os.path.join(self.rootdir, CACHE_INDEX_FILE), timeout=60.)
+            local.pid = os.getpid()
+            local.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY, task TEXT, outputs TEXT,
+                    atime REAL);
+                CREATE TABLE IF NOT EXISTS objects (
+                    digest TEXT PRIMARY KEY, size INTEGER, mtime INTEGER);
+                """)
+            local.conn.commit()
+        return local.conn
+
+    def close(self):
+        if getattr(self._local, 'conn', None) is not None:
+            self._local.conn.close()
+            self._local.conn = None
+        self.digests.close()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    @property
+    def size(self):
+        """The total size of the objects in bytes"""
+        return self.conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+
+    def _object_path(self, digest):
+        return os.path.join(
+                self.rootdir, CACHE_OBJECTS_DIR, digest[:2], digest)
+
+    def _normalize(self, s):
+        for k, v in sorted(self.replace.items(), key=lambda i: -len(i[0])):
+            s = s.replace(k, v)
+        return s
+
+    def params_key(self, task):
+        """Return the digest of the parameters of task, with the job
+        specific strings replaced"""
+        return params_digest(task, normalize=self._normalize)
+
+    def job_key(self, in_files, params):
+        """Return the key of the job of inputs in_files and parameter
+        digest params"""
+        paths = _walk_files(in_files)
+        large = [p for p in paths if os.path.isfile(p) and
+                 os.path.getsize(p) > SMALL_FILE_SIZE]
+        digests = self.digests.digest(large)
+        h = hashlib.sha1(params.encode('utf-8'))
+        for path in paths:
+            if path in digests:
+                digest = digests[path]
+            elif os.path.isfile(path):
+                with open(path, 'rb') as fo:
+                    content = fo.read()
+                for k, v in self.replace.items():
+                    content = content.replace(
+                            k.encode('utf-8'), v.encode('utf-8'))
+                digest = hashlib.sha1(content).hexdigest()
+            else:
+                digest = self._normalize(path)
+            h.update(digest.encode('utf-8'))
+        return h.hexdigest()
+
+    def fetch(self, key, out_files):
+        """
+        Link the cached outputs of key to out_files
+
+        Returns
+        -------
+        hit: bool
+            False if key is not in the cache or the objects are gone or
+            modified, in which case the entry is dropped.
+        """
+        row = self.conn.execute(
+                "SELECT outputs FROM entries WHERE key = ?", (key, )
+                ).fetchone()
+        if row is None:
+            return False
+        digests = json.loads(row[0])
+        if len(digests) != len(out_files):
+            return False
+        for digest in digests:
+            obj = self._object_path(digest)
+            stat = self.conn.execute(
+                    "SELECT size, mtime FROM objects WHERE digest = ?",
+                    (digest, )).fetchone()
+            try:
+                st = os.stat(obj)
+            except OSError:
+                st = None
+            if stat is None or st is None or \
+                    (st.st_size, st.st_mtime_ns) != tuple(stat):
+                with self.conn as conn:
+                    conn.execute("DELETE FROM entries WHERE key = ?", (key, ))
+                return False
+        for digest, out_file in zip(digests, out_files):
+            if os.path.lexists(out_file):
+                os.remove(out_file)
+            _link_or_copy(self._object_path(digest), out_file)
+        with self.conn as conn:
+            conn.execute("UPDATE entries SET atime = ? WHERE key = ?",
+                         (time.time(), key))
+        return True
+
+    def prepare(self, out_files):
+        """Remove the existing out_files, so that the task writes new
+        files instead of the cached objects they may be linked to"""
+        for out_file in out_files:
+            if os.path.lexists(out_file):
+                os.remove(out_file)
+
+    def store(self, key, task, out_files):
+        """Store out_files as the outputs of key"""
+        digests = []
+        rows = []
+        for out_file in out_files:
+            digest = file_digest(out_file)
+            obj = self._object_path(digest)
+            if not os.path.exists(obj):
+                if not os.path.isdir(os.path.dirname(obj)):
+                    os.makedirs(os.path.dirname(obj), exist_ok=True)
+                tmpname = "{}.{}.tmp".format(obj, os.getpid())
+                _link_or_copy(out_file, tmpname)
+                os.rename(tmpname, obj)
+            st = os.stat(obj)
+            digests.append(digest)
+            rows.append((digest, st.st_size, st.st_mtime_ns))
+        with self.conn as conn:
+            conn.executemany(
+                    "INSERT OR REPLACE INTO objects VALUES (?, ?, ?)", rows)
+            conn.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                    (key, task, json.dumps(digests), time.time()))
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the objects fit
+        in max_size, and return the number of entries removed. The most
+        recently used entry is kept."""
+        if self.max_size is None or self.size <= self.max_size:
+            return 0
+        entries = self.conn.execute(
+                "SELECT key, outputs FROM entries ORDER BY atime").fetchall()
+        refs = {}
+        for _, outputs in entries:
+            for digest in json.loads(outputs):
+                refs[digest] = refs.get(digest, 0) + 1
+        sizes = dict(self.conn.execute("SELECT digest, size FROM objects"))
+        total = sum(sizes.values())
+        nremoved = 0
+        for key, outputs in entries[:-1]:
+            if total <= self.max_size:
+                break
+            removed = []
+            for digest in json.loads(outputs):
+                refs[digest] -= 1
+                if refs[digest] == 0:
+                    removed.append(digest)
+                    total -= sizes.get(digest, 0)
+            with self.conn as conn:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key, ))
+                conn.executemany(
+                        "DELETE FROM objects WHERE digest = ?",
+                        [(d, ) for d in removed])
+            for digest in removed:
+                try:
+                    os.remove(self._object_path(digest))
+                except OSError:
+                    pass
+            nremoved += 1
+        return nremoved
@@ -10,6 +10,7 @@ common.py
 
 from functools import wraps
 import os
+import importlib
 
 
 def get_log_func(default_level='debug', **kwargs):
@@ -30,6 +31,54 @@ def get_log_func(default_level='debug', **kwargs):
     return logfunc
 
 
+class LazyFunc(object):
+    """
+    A reference to a function that is imported on first call
+
+    The reference is pickled by the names, so the module is only
+    imported in the process that runs the function.
+    """
+
+    def __init__(self, module, name):
+        self.__module__ = module
+        self.__name__ = name
+        self._func = None
+
+    def resolve(self):
+        if self._func is None:
+            self._func = getattr(
+                    importlib.import_module(self.__module__), self.__name__)
+        return self._func
+
+    @property
+    def __doc__(self):
+        return self.resolve().__doc__
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __getstate__(self):
+        return {'module': self.__module__, 'name': self.__name__}
+
+    def __setstate__(self, state):
+        self.__init__(state['module'], state['name'])
+
+    def __repr__(self):
+        return "<lazy {}.{}>".format(self.__module__, self.__name__)
+
+
+class LazyModule(object):
+    """A module whose attributes are `LazyFunc`"""
+
+    def __init__(self, module):
+        self._module = module
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return LazyFunc(self._module, name)
+
+
 def touch_file(out_file):
     with open(out_file, 'a'):
         os.utime(out_file, None)
@@ -12,9 +12,10 @@ core.py
 import os
 import re
 import sys
-import glob
 import time
 import logging
+import socket
+import threading
 import pickle
 from io import StringIO
 import subprocess
@@ -28,6 +29,13 @@ from . import utils
 from .utils import ensure_list, unwrap_if_len_one, ensure_args_as_list
 from . import astromatic as am
 from . import common
+from .registry import ProductRegistry, registry_glob
+from .manifest import HashManifest, job_params
+from .cache import TaskCache
+from .resources import ResourcePool
+from .schedule import DurationHistory, task_graph, downstream_lengths
+from .executor import JobExecutor, EXECUTOR_KINDS, default_executor_kind
+from .workqueue import WorkQueue
 
 import ruffus
 import ruffus.cmdline as cmdline
@@ -55,7 +63,12 @@ class ApusConfig(object):
     runtime = [
         ('env_overrides', {}),
         ('logger', None), ('logger_mutex', None),
-        ('log_file', '{jobkey:s}.log'), ('history_file', '{jobkey:s}.ruffus')
+        ('log_file', '{jobkey:s}.log'), ('history_file', '{jobkey:s}.ruffus'),
+        ('registry_file', ''), ('registry_reg', None),
+        ('manifest_file', ''),
+        ('task_cache_dir', ''), ('task_cache_size', None),
+        ('resources', None), ('durations_file', ''),
+        ('queue_file', ''), ('executor', 'ruffus'),
         ]
 
     def __init__(self, config=None, **kwargs):
@@ -117,6 +130,14 @@ def configure(config, args):
     parser.add_argument(
             '-l', '--list-tasks', action='store_true',
             help='list the task names and exit')
+    parser.add_argument(
+            '--plan', action='store_true',
+            help='print the jobs that would be rebuilt and why, and exit')
+    parser.add_argument(
+            '--executor', choices=['mixed', 'ruffus'], default=None,
+            help='ruffus: run all jobs in ruffus processes; mixed: dispatch '
+                 'with threads and run the jobs by the task executor kinds. '
+                 'Default to the executor of the config, or ruffus')
 
     parser.set_defaults(
             verbose=['0', ],
@@ -124,6 +145,10 @@ def configure(config, args):
             history_file=os.path.join(apusconf.logdir, apusconf.history_file)
             )
     option = parser.parse_args(args)
+    if option.executor is None:
+        option.executor = apusconf.executor
+    if option.executor not in ('mixed', 'ruffus'):
+        raise RuntimeError("unknown executor {0}".format(option.executor))
     # handle logger
     logger, logger_mutex = make_shared_logger_and_proxy(
             logger_factory, apusconf.jobkey, [option.log_file, option.verbose])
@@ -176,6 +201,67 @@ def bootstrap(config=None, option=None):
         sys.exit(0)
     # set up astromatic config
     config.am = am.AmConfig(**config.env_overrides)
+    # set up products registry
+    config.registry = None
+    if config.registry_file:
+        config.registry = ProductRegistry(
+                config.registry_file, reg=config.registry_reg)
+        nnew, nremoved = config.registry.sync(config.task_io_default_dir)
+        config.logger.info("products registry {}: + {}, - {}".format(
+            config.registry_file, nnew, nremoved))
+    # set up content-hash manifest
+    config.manifest = None
+    if config.manifest_file:
+        config.manifest = HashManifest(
+                config.manifest_file, readonly=option.plan)
+        config.logger.info("content-hash manifest {}".format(
+            config.manifest_file))
+    # set up task output cache shared by jobs
+    config.task_cache = None
+    if config.task_cache_dir:
+        config.task_cache = TaskCache(
+                config.task_cache_dir, max_size=config.task_cache_size,
+                replace={os.path.abspath(config.jobdir): '{jobdir}'})
+        config.logger.info("task cache {}".format(config.task_cache_dir))
+    # set up node resource budget
+    config.resource_pool = None
+    if config.resources is not None:
+        config.resource_pool = ResourcePool(
+                os.path.join(config.jobdir, '{}.{}.resources'.format(
+                    config.jobkey, socket.gethostname())),
+                **config.resources)
+        config.logger.info("resource budget {}".format(
+            config.resource_pool.budget))
+    # set up job durations history for the critical-path priorities
+    config.durations = None
+    config.downstream = {}
+    if config.durations_file:
+        config.durations = DurationHistory(config.durations_file)
+        config.downstream = downstream_lengths(
+                task_graph(config.tlist), config.durations.task_durations())
+        config.logger.info("job durations history {}".format(
+            config.durations_file))
+    if option.plan:
+        # the out-of-date jobs are printed with the reasons
+        option.just_print = True
+        option.verbose = ['4', ]
+    # set up executors of the jobs
+    config.job_executor = None
+    if option.executor == 'mixed' and not option.just_print:
+        option.use_threads = True
+        queue = None
+        if config.queue_file:
+            queue = WorkQueue(config.queue_file)
+            config.logger.info("publish remote jobs to work queue {}".format(
+                config.queue_file))
+        # the ready jobs are started in the order of the priorities
+        slots = option.jobs if config.durations is not None else None
+        config.job_executor = JobExecutor(
+                nprocs=option.jobs, queue=queue, slots=slots)
+    elif config.queue_file:
+        config.logger.warning(
+                "work queue {} is only used with the mixed executor".format(
+                    config.queue_file))
     build_pipeline(config)
     # handle redo-all
     if option.redo_all:
@@ -184,7 +270,17 @@ def bootstrap(config=None, option=None):
     if len(option.forced_tasks) > 0:
         for t in option.forced_tasks:
             config.logger.info("forced redo: {0}".format(utils.alert(t)))
-    cmdline.run(option, checksum_level=1)
+    if config.job_executor is None:
+        cmdline.run(option, checksum_level=1)
+        return
+    config.job_executor.start()
+    extra_options = {}
+    if config.job_executor.dispatch_threads is not None:
+        extra_options['multithread'] = config.job_executor.dispatch_threads
+    try:
+        cmdline.run(option, checksum_level=1, **extra_options)
+    finally:
+        config.job_executor.shutdown()
 
 
 def get_task_func(func):
@@ -323,7 +419,8 @@ def create_ruffus_task(pipe, config, task, **kwargs):
                 'check_if_uptodate': check_config_uptodate,
                 'diagdir': config.diagdir,
                 'prog': get_am_prog(task['func']),
-                'jobs_limit': 1
+                'jobs_limit': 1,
+                'executor': 'thread',
                 }
             create_ruffus_task(
                 pipe, config, pre_task, task_io_default_dir='')
@@ -451,6 +548,14 @@ def create_ruffus_task(pipe, config, task, **kwargs):
                if k not in context_exclude_task_keys}
     for key, defval in context_key_defaults.items():
         context[key] = task.get(key, defval)
+    context['executor'] = task.get(
+            'executor', default_executor_kind(task_func.__name__))
+    if context['executor'] not in EXECUTOR_KINDS:
+        raise RuntimeError("unknown executor kind {0} of task {1}".format(
+            context['executor'], task_name))
+    context['remote'] = task.get(
+            'remote', context['executor'] == 'process' or
+            task_func.__name__ in ('astromatic_task', 'subprocess_task'))
     if 'follows' in context.keys():
         # for cleaner debug info
         context['follows'] = unwrap_if_len_one(task_follows)
@@ -458,7 +563,16 @@ def create_ruffus_task(pipe, config, task, **kwargs):
             'task': context,
             'logger': config.logger,
             'logger_mutex': config.logger_mutex,
-            'am': config.am
+            'am': config.am,
+            'registry': getattr(config, 'registry', None),
+            'manifest': getattr(config, 'manifest', None),
+            'task_cache': getattr(config, 'task_cache', None)
+            if task.get('cache', False) else None,
+            'resource_pool': getattr(config, 'resource_pool', None),
+            'durations': getattr(config, 'durations', None),
+            'job_executor': getattr(config, 'job_executor', None),
+            'downstream': getattr(config, 'downstream', {}).get(
+                task_name, 0.),
             }
     task_extras.append(task_context)
     task_kwargs['extras'] = task_extras
@@ -475,6 +589,9 @@ def create_ruffus_task(pipe, config, task, **kwargs):
     # handle forced run
     if task.get('check_if_uptodate', None) is not None:
         ruffus_task.check_if_uptodate(task['check_if_uptodate'])
+    elif task_context['manifest'] is not None and \
+            task['pipe'] != 'originate':
+        ruffus_task.check_if_uptodate(check_hash_uptodate)
     return ruffus_task
 
 
@@ -580,6 +697,8 @@ def to_callable_task_args(conv_func):
         def wrapped_func(in_files, out_files, *extras):
             if len(extras) == 0:  # from originate, rename the variables
                 in_files, out_files, extras = [], in_files, out_files
+            # the extras are not hashed as inputs, see `job_params`
+            hash_inputs = list(in_files)
             in_files += extras[:-1]
             out_files, flag_file = get_flag_file(out_files)
             # flatten any third level list
@@ -603,11 +722,42 @@ def to_callable_task_args(conv_func):
                 pass
             context = copy(extras[-1])
             context['flag_file'] = flag_file
-            if conv_func is not None:
-                # copy task as well
-                context['task'] = dict(context['task'], func=conv_func(
-                        in_files, out_files, context))
-            return func(in_files, out_files, context)
+            context['hash_inputs'] = hash_inputs
+            context['params_digest'] = job_params(
+                    context['task'], hash_inputs, extras[:-1])
+            if context.get('task_cache', None) is not None:
+                context['cache_params'] = context['task_cache'].params_key(
+                        context['task'])
+            # the priority of the job in the job slots, the resource
+            # budget and the work queue
+            if 'priority' not in context:
+                priority = 0.
+                if context.get('durations', None) is not None:
+                    priority = context['durations'].priority(
+                            context['task']['name'], in_files, out_files,
+                            downstream=context['downstream'])
+                context['priority'] = priority
+            executor = context.get('job_executor', None)
+            if executor is not None:
+                executor.acquire_slot(context['priority'])
+            pool = context.get('resource_pool', None)
+            token = None
+            try:
+                # admit the job against the resource budget, once
+                if pool is not None and 'resources' not in context:
+                    token, context['resources'] = pool.acquire(
+                            context['task'].get('resources', None),
+                            priority=context['priority'])
+                if conv_func is not None:
+                    # copy task as well
+                    context['task'] = dict(context['task'], func=conv_func(
+                            in_files, out_files, context))
+                return func(in_files, out_files, context)
+            finally:
+                if token is not None:
+                    pool.release(token)
+                if executor is not None:
+                    executor.release_slot()
         return wrapped_func
     return wrapper
 
@@ -644,7 +794,8 @@ def _astromatic_callable(in_files, out_files, context):
     # get program
     prog = get_am_prog(task['func'])
     # split up inputs types
-    rectified_inputs = get_astromatic_inputs(in_files, task['in_keys'])
+    rectified_inputs = get_astromatic_inputs(
+            in_files, task['in_keys'], registry=context.get('registry', None))
     command = [amconf.get('{0}bin'.format(prog)), ]
     params = {}
     for key, val in rectified_inputs:
@@ -663,6 +814,8 @@ def _astromatic_callable(in_files, out_files, context):
         else:  # values should be concat by comma
             params[key] = ','.join(val)
     params.update(task.get('params', {}))
+    if context.get('resources', None) is not None:
+        params['NTHREADS'] = context['resources']['cpus']
     for key, val in params.items():
         command.extend(['-{0}'.format(key), "{0}".format(val)])
     # handle outkeys
@@ -684,7 +837,7 @@ def astromatic_task(in_files, out_files, context):
     return callable_task(in_files, out_files, context)
 
 
-def get_astromatic_inputs(inputs, in_keys):
+def get_astromatic_inputs(inputs, in_keys, registry=None):
     """identify the inputs by mapping to the in_keys"""
 
     # collate, no add_input: [(in1, in2, ...), ex1, ex2]
@@ -730,7 +883,7 @@ def get_astromatic_inputs(inputs, in_keys):
         else:
             val = unwrap_if_len_one(val)
             if isinstance(val, str) and re.search('[*?]', val) is not None:
-                val = tuple(glob.glob(val))
+                val = tuple(registry_glob(val, registry))
             ret_keys.append(key)
             ret_vals.append(val)
     # aggregate duplicated keys
@@ -754,6 +907,34 @@ def get_astromatic_inputs(inputs, in_keys):
 @ensure_args_as_list(0, 1)
 @to_callable_task_args(None)
 def callable_task(in_files, out_files, context):
+    """run the job by the executor kind of the task"""
+    executor = context.get('job_executor', None)
+    if executor is None:
+        return run_callable_task(in_files, out_files, context)
+    task = context['task']
+    if task['remote'] and executor.queue is not None:
+        # the logger proxies are not reachable from the other nodes
+        context = {k: v for k, v in context.items()
+                   if k not in ('logger', 'logger_mutex', 'job_executor')}
+        return executor.run_remote(
+                task['name'], run_remote_task, in_files, out_files, context,
+                priority=context.get('priority', 0.))
+    return executor.run(
+            task['executor'], run_callable_task,
+            in_files, out_files, context,
+            batch=(task['name'], task.get('batch', 1)))
+
+
+def run_remote_task(in_files, out_files, context):
+    """run the job of the callable task in a queue worker, with the logger
+    of the worker"""
+    logger = logging.getLogger('apus.worker')
+    context = dict(context, logger=logger, logger_mutex=threading.Lock())
+    return run_callable_task(in_files, out_files, context)
+
+
+def run_callable_task(in_files, out_files, context):
+    """run the job of the callable task"""
     log = common.get_log_func(**context)
     task = context['task']
     func = task['func']
@@ -772,13 +953,39 @@ def callable_task(in_files, out_files, context):
             task=task,
             am=context['am'],
             logger=context['logger'],
-            logger_mutex=context['logger_mutex'])
-    output = func(*args, **kwargs)
-    if task.get('after_func', None) is not None:
-        task['after_func'](*out_files)
+            logger_mutex=context['logger_mutex'],
+            registry=context.get('registry', None),
+            resources=context.get('resources', None))
+    cache = context.get('task_cache', None)
+    if cache is not None:
+        cache_key = cache.job_key(in_files, context['cache_params'])
+        if cache.fetch(cache_key, out_files):
+            log('debug', 'restored from task cache {}'.format(cache_key))
+            func = None
+        else:
+            cache.prepare(out_files)
+    if func is not None:
+        start = time.time()
+        output = func(*args, **kwargs)
+        if task.get('after_func', None) is not None:
+            task['after_func'](*out_files)
+        if context.get('durations', None) is not None:
+            context['durations'].record(
+                    task['name'], in_files, out_files, time.time() - start)
+        if cache is not None:
+            cache.store(cache_key, task['name'], out_files)
+    else:
+        output = 'restored'
+    if kwargs['registry'] is not None:
+        kwargs['registry'].register(out_files, task=task['name'])
     flag_file = context['flag_file']
     if flag_file is not None:
         common.touch_file(flag_file)
+    if context.get('manifest', None) is not None:
+        context['manifest'].record(
+                task['name'], context.get('hash_inputs', in_files),
+                out_files + ([flag_file] if flag_file else []),
+                context['params_digest'])
     if output or verbose:
         output = "finished silently" if not output else 'finished'
         log('debug', output)
@@ -884,8 +1091,27 @@ def check_config_uptodate(*args, **kwargs):
             return True, 'outparams list changed its content'
 
 
-def documented_subprocess_call(command, flag_file=None):
-    def call(*args, **kwargs):
+def check_hash_uptodate(*args, **kwargs):
+    """check the job against the content-hash manifest"""
+    in_files, out_files, extras = args[0], args[1], args[2:]
+    context = extras[-1]
+    return context['manifest'].check(
+            context['task']['name'], in_files, out_files,
+            job_params(context['task'], in_files, extras[:-1]))
+
+
+class SubprocessCall(object):
+    """Callable that runs command as subprocess, and logs the output.
+    Unlike a closure, it can be pickled to run in the other processes."""
+
+    def __init__(self, command, flag_file=None):
+        self.command = command
+        self.flag_file = flag_file
+        # quote items with string
+        self.__doc__ = 'subprocess: ' + ' '.join(
+                ['"{0}"'.format(c) if ' ' in c else c for c in command])
+
+    def __call__(self, *args, **kwargs):
         # handle scamp refcatalog suffix
         # if '-ASTREFCAT_NAME' in command:
         #     ikey = command.index('-ASTREFCAT_NAME') + 1
@@ -904,7 +1130,7 @@ def documented_subprocess_call(command, flag_file=None):
         #     fo.seek(0)
         #     output = fo.read()
         # output = subprocess.check_output(command)
-        proc = subprocess.Popen(command,
+        proc = subprocess.Popen(self.command,
                                 stdout=subprocess.PIPE,
                                 bufsize=1,
                                 # stderr=subprocess.PIPE
@@ -921,12 +1147,10 @@ def documented_subprocess_call(command, flag_file=None):
             #         proc.stderr.read(),
             #         proc.returncode)
             raise RuntimeError(err_msg)
-        if flag_file is not None:
-            common.touch_file(flag_file)
+        if self.flag_file is not None:
+            common.touch_file(self.flag_file)
         return has_output
-        # return output
-    # print(' '.join(command))
-    # quote items with string
-    call.__doc__ = 'subprocess: ' + ' '.join(
-            ['"{0}"'.format(c) if ' ' in c else c for c in command])
-    return call
+
+
+def documented_subprocess_call(command, flag_file=None):
+    return SubprocessCall(command, flag_file=flag_file)
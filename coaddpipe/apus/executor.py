@@ -0,0 +1,234 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 22:40
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+executor.py
+
+The per-task executors of the jobs.
+
+In the mixed mode, enabled by ``--executor mixed`` or the ``executor``
+entry of the config, ruffus dispatches the jobs with threads, and the job
+of each task runs according to the ``executor`` entry of the task dict:
+
+    * ``inline``: in the dispatching thread, one at a time, for the tasks
+      that are not thread-safe.
+    * ``thread``: in the dispatching thread, for the tasks that mostly
+      wait for the child processes or the file system, e.g., the
+      astromatic and the subprocess tasks, and the symlink tasks.
+    * ``process``: in a pool of forked worker processes, for the numeric
+      Python tasks that need the process isolation.
+
+The astromatic and subprocess tasks default to ``thread``, and the other
+tasks to ``process``.
+
+The ``process`` jobs of the tasks that set ``batch`` in the task dict
+are batched: the jobs of the same task dispatched within a short window
+are sent to one worker in a single call, up to ``batch`` jobs, with the
+context entries they share pickled once. This amortizes the per-job
+overhead of the tiny tasks.
+
+With a work queue, the remote jobs, i.e., those of the tasks that set
+``remote``, are run by the workers on the other nodes instead, see
+`workqueue`.
+
+With the job slots set, ruffus dispatches more threads than the slots,
+up to ``DISPATCH_LOOKAHEAD`` times, and the dispatched jobs wait for the
+slots, which are admitted in the order of the priorities of the jobs,
+e.g., the critical-path estimates of `schedule`. Without the mixed mode,
+the jobs run in the order ruffus dispatches them, and the priorities
+only order the jobs that wait for the resource budget or in the work
+queue.
+"""
+
+import heapq
+import itertools
+import threading
+import traceback
+import multiprocessing
+
+from .workqueue import RemoteTraceback
+
+
+EXECUTOR_KINDS = ('inline', 'thread', 'process')
+
+# seconds the first job of a batch waits for the others
+BATCH_WINDOW = 0.05
+
+# the dispatch threads per job slot
+DISPATCH_LOOKAHEAD = 4
+
+
+def default_executor_kind(task_func_name):
+    """Return the default executor kind of the apus task function"""
+    if task_func_name in ('astromatic_task', 'subprocess_task'):
+        return 'thread'
+    return 'process'
+
+
+def _run_batch(func, base, jobs):
+    """Run the batch of jobs of func in the worker. The job contexts are
+    the base context updated with the job entries."""
+    results = []
+    for in_files, out_files, entries in jobs:
+        try:
+            results.append((True, func(
+                in_files, out_files, dict(base, **entries)), None))
+        except Exception as e:
+            results.append((False, e, traceback.format_exc()))
+    return results
+
+
+class _Batch(object):
+
+    def __init__(self):
+        self.jobs = []
+        self.results = None
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class JobExecutor(object):
+    """
+    Run the jobs by the executor kinds
+
+    Parameters
+    ----------
+    nprocs: int
+        The number of worker processes. The jobs are run in the calling
+        process if less than 2.
+    queue: WorkQueue, optional
+        If set, the remote jobs are published to the queue and run by the
+        workers, see `run_remote`.
+    slots: int, optional
+        If set, the number of the jobs run at a time, admitted in the
+        order of priority, see `acquire_slot`.
+
+    The worker processes are forked at `start`, which should be called
+    before ruffus starts the dispatching threads. When pickled, e.g.,
+    sent to a ruffus worker process, the executor runs the jobs in place.
+    """
+
+    def __init__(self, nprocs=1, batch_window=BATCH_WINDOW, queue=None,
+                 slots=None):
+        self.nprocs = nprocs
+        self.batch_window = batch_window
+        self.queue = queue
+        self.slots = slots
+        self._pool = None
+        self._lock = threading.Lock()
+        self._batch_lock = threading.Lock()
+        self._batches = {}
+        self._slot_cond = threading.Condition()
+        self._slot_waiting = []
+        self._slot_seq = itertools.count()
+        self._slot_running = 0
+
+    def __getstate__(self):
+        return {'nprocs': 1}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def start(self):
+        if self.nprocs > 1 and self._pool is None:
+            self._pool = multiprocessing.get_context('fork').Pool(
+                    self.nprocs)
+        return self
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def acquire_slot(self, priority=0.):
+        """Wait for a slot to run the job. The waiting job of the highest
+        priority is admitted first, and those of the same priority in the
+        order they arrive. Returns immediately if slots is not set."""
+        if self.slots is None:
+            return
+        with self._slot_cond:
+            key = (-priority, next(self._slot_seq))
+            heapq.heappush(self._slot_waiting, key)
+            while self._slot_running >= self.slots or \
+                    self._slot_waiting[0] != key:
+                self._slot_cond.wait()
+            heapq.heappop(self._slot_waiting)
+            self._slot_running += 1
+            self._slot_cond.notify_all()
+
+    def release_slot(self):
+        if self.slots is None:
+            return
+        with self._slot_cond:
+            self._slot_running -= 1
+            self._slot_cond.notify_all()
+
+    @property
+    def dispatch_threads(self):
+        """The number of the ruffus dispatch threads, None to use the
+        number of jobs"""
+        if self.slots is None:
+            return None
+        return self.slots * DISPATCH_LOOKAHEAD
+
+    def run(self, kind, func, *args, batch=None):
+        """Run func with args by the executor kind, and return the
+        result. The exceptions are raised in the calling thread.
+
+        If batch is set as (key, size) and size > 1, the process job is
+        batched with the jobs of the same key, in which case the args
+        should be (in_files, out_files, context)."""
+        if kind not in EXECUTOR_KINDS:
+            raise ValueError("unknown executor kind {}".format(kind))
+        if kind == 'process' and self._pool is not None:
+            if batch is not None and batch[1] > 1:
+                return self._run_batched(batch, func, args)
+            return self._pool.apply(func, args)
+        if kind == 'inline':
+            with self._lock:
+                return func(*args)
+        return func(*args)
+
+    def run_remote(self, task, func, *args, priority=0.):
+        """Run func with args by the workers of the queue, and return the
+        result. The exceptions are raised in the calling thread."""
+        return self.queue.run(task, func, args, priority=priority)
+
+    def _run_batched(self, batch, func, args):
+        key, size = batch
+        with self._batch_lock:
+            current = self._batches.get(key, None)
+            leader = current is None
+            if leader:
+                current = self._batches[key] = _Batch()
+            index = len(current.jobs)
+            current.jobs.append(args)
+            if len(current.jobs) >= size:
+                current.full.set()
+                del self._batches[key]
+        if leader:
+            current.full.wait(self.batch_window)
+            with self._batch_lock:
+                if self._batches.get(key, None) is current:
+                    del self._batches[key]
+            base = current.jobs[0][2]
+            jobs = [(in_files, out_files, {
+                        k: v for k, v in context.items()
+                        if k not in base or base[k] is not v})
+                    for in_files, out_files, context in current.jobs]
+            try:
+                current.results = self._pool.apply(
+                        _run_batch, (func, base, jobs))
+            except Exception as e:
+                current.results = [
+                        (False, e, traceback.format_exc())] * len(jobs)
+            current.done.set()
+        else:
+            current.done.wait()
+        ok, result, tb = current.results[index]
+        if not ok:
+            raise result from RemoteTraceback(tb)
+        return result
@@ -0,0 +1,278 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 21:00
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+manifest.py
+
+The content-hash manifest of the jobs.
+
+When a job finishes, the digests of its input files, parameters and
+output files are recorded. A job is up to date if its outputs exist and
+the digests match the record, so touching or copying the files, or clock
+skew on network file systems, does not trigger reruns.
+
+The digests of the files are cached by path, size and mtime, so only the
+new or modified files are read, streamed in parallel threads.
+
+The extras of the tasks, typically the files shared by all the jobs,
+e.g., the jobfile, are not hashed as the inputs. A task can set
+``extras_digest`` to the function that returns the digest of the part
+of the extras the job depends on, which is recorded with the parameters,
+see `job_params`.
+"""
+
+import os
+import re
+import glob
+import json
+import sqlite3
+import threading
+import hashlib
+from multiprocessing import cpu_count
+from concurrent.futures import ThreadPoolExecutor
+
+
+# the task dict entries that determine the outputs besides the inputs
+PARAM_KEYS = ('func', 'kwargs', 'params', 'outparams', 'in_keys', 'out_keys')
+
+DIGEST_MISSING = 'missing'
+DIGEST_DIR = 'dir'
+
+
+def file_digest(path, blocksize=1 << 20):
+    """Return the SHA1 hex digest of the content of path"""
+    h = hashlib.sha1()
+    with open(path, 'rb') as fo:
+        for block in iter(lambda: fo.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _json_default(obj):
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj, key=repr)
+    if hasattr(obj, '__module__') and hasattr(obj, '__name__'):
+        return "{}.{}".format(obj.__module__, obj.__name__)
+    return repr(obj)
+
+
+def params_digest(task, normalize=None):
+    """Return the digest of the entries of the task dict that determine
+    the outputs. The kwargs listed in the ``volatile_kwargs`` entry, e.g.,
+    those only affect the logging or the QA, are excluded. If set,
+    normalize is applied to the serialized entries before hashing."""
+    params = {k: task[k] for k in PARAM_KEYS if k in task}
+    volatile = task.get('volatile_kwargs', ())
+    if volatile and 'kwargs' in params:
+        params['kwargs'] = {
+                k: v for k, v in params['kwargs'].items()
+                if k not in volatile}
+    params = json.dumps(params, sort_keys=True, default=_json_default)
+    if normalize is not None:
+        params = normalize(params)
+    return hashlib.sha1(params.encode('utf-8')).hexdigest()
+
+
+def job_params(task, in_files, extras):
+    """
+    Return the params of the job to be recorded in the manifest
+
+    This is the `params_digest` of the task, and the digest returned by
+    the ``extras_digest`` entry of the task if set, which is called as
+    ``extras_digest(inputs, extras, **kwargs)``, with the flattened
+    inputs and extras, and the task kwargs.
+    """
+    params = params_digest(task)
+    func = task.get('extras_digest', None)
+    if func is not None and extras:
+        params = "{}:{}".format(params, func(
+            flatten_files(in_files), flatten_files(extras),
+            **task.get('kwargs', {})))
+    return params
+
+
+def flatten_files(files):
+    """Return the sorted unique paths in the nested lists of files. Glob
+    patterns are expanded."""
+    paths = set()
+
+    def walk(f):
+        if isinstance(f, (list, tuple)):
+            for i in f:
+                walk(i)
+        elif isinstance(f, str):
+            if re.search(r'[*?\[]', f) is not None:
+                paths.update(os.path.abspath(p) for p in glob.glob(f))
+            else:
+                paths.add(os.path.abspath(f))
+    walk(files)
+    return sorted(paths)
+
+
+class HashManifest(object):
+    """
+    The SQLite manifest of the content hashes of the jobs
+
+    Parameters
+    ----------
+    dbfile: str
+        The database file. It is created if not exists.
+    nthreads: int, optional
+        The number of threads to compute the digests.
+    readonly: bool
+        If True, the jobs are not recorded, e.g., for a dry run.
+
+    The connections are opened lazily in each process and thread, so the
+    manifest can be passed to the tasks run in subprocesses.
+    """
+
+    def __init__(self, dbfile, nthreads=None, readonly=False):
+        self.dbfile = os.path.abspath(dbfile)
+        self.nthreads = nthreads
+        self.readonly = readonly
+        self._local = threading.local()
+
+    def __getstate__(self):
+        return {'dbfile': self.dbfile, 'nthreads': self.nthreads,
+                'readonly': self.readonly}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @property
+    def conn(self):
+        # one connection per process and thread, as the jobs are
+        # dispatched by the ruffus threads
+        local = self._local
+        if getattr(local, 'conn', None) is None or \
+                local.pid != os.getpid():
+            local.conn = sqlite3.connect(self.dbfile, timeout=60.)
+            local.pid = os.getpid()
+            local.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER,
+                    digest TEXT);
+                CREATE TABLE IF NOT EXISTS jobs (
+                    task TEXT, outputs TEXT, params TEXT, inputs TEXT,
+                    digests TEXT, PRIMARY KEY (task, outputs));
+                """)
+            local.conn.commit()
+        return local.conn
+
+    def close(self):
+        if getattr(self._local, 'conn', None) is not None:
+            self._local.conn.close()
+            self._local.conn = None
+
+    def digest(self, paths):
+        """
+        Return the dict of the digests of paths
+
+        The cached digest is used if the size and mtime of the file are
+        unchanged. Directories and missing files get the digests "dir"
+        and "missing".
+        """
+        result = {}
+        stats = {}
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                result[path] = DIGEST_MISSING
+                continue
+            if os.path.isdir(path):
+                result[path] = DIGEST_DIR
+            else:
+                stats[path] = (st.st_size, st.st_mtime_ns)
+        cached = {}
+        items = list(stats)
+        for i in range(0, len(items), 500):
+            chunk = items[i:i + 500]
+            for path, size, mtime, digest in self.conn.execute(
+                    "SELECT path, size, mtime, digest FROM files WHERE "
+                    "path IN ({})".format(','.join('?' * len(chunk))),
+                    chunk):
+                cached[path] = ((size, mtime), digest)
+        todo = []
+        for path, st in stats.items():
+            if path in cached and cached[path][0] == st:
+                result[path] = cached[path][1]
+            else:
+                todo.append(path)
+        if todo:
+            nthreads = self.nthreads or min(8, cpu_count())
+            with ThreadPoolExecutor(max_workers=nthreads) as executor:
+                digests = list(executor.map(file_digest, todo))
+            result.update(zip(todo, digests))
+            with self.conn as conn:
+                conn.executemany(
+                        "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                        [(p, ) + stats[p] + (d, )
+                         for p, d in zip(todo, digests)])
+        return result
+
+    def lookup(self, task, out_files):
+        """Return the record (params, inputs, outputs) of the job, in
+        which inputs and outputs are dicts of the digests"""
+        row = self.conn.execute(
+                "SELECT params, inputs, digests FROM jobs WHERE task = ? "
+                "AND outputs = ?",
+                (task, json.dumps(flatten_files(out_files)))).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]), json.loads(row[2])
+
+    def record(self, task, in_files, out_files, params):
+        """Record the digests of the job"""
+        if self.readonly:
+            return
+        outputs = flatten_files(out_files)
+        digests = self.digest(flatten_files(in_files) + outputs)
+        inputs = {p: d for p, d in digests.items() if p not in outputs}
+        with self.conn as conn:
+            conn.execute(
+                    "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?)",
+                    (task, json.dumps(outputs), params,
+                     json.dumps(inputs, sort_keys=True),
+                     json.dumps({p: digests[p] for p in outputs},
+                                sort_keys=True)))
+
+    def check(self, task, in_files, out_files, params):
+        """
+        Return whether the job needs update, and the reason
+
+        Jobs that have no record, e.g., run before the manifest is used,
+        are up to date if the outputs are newer than the inputs, and are
+        recorded.
+        """
+        inputs = flatten_files(in_files)
+        outputs = flatten_files(out_files)
+        for path in outputs:
+            if not os.path.exists(path):
+                return True, "missing file {}".format(path)
+        record = self.lookup(task, outputs)
+        if record is None:
+            mtimes = [os.path.getmtime(p) for p in inputs
+                      if os.path.isfile(p)]
+            oldest = min(os.path.getmtime(p) for p in outputs) \
+                if outputs else None
+            if oldest is None or (mtimes and max(mtimes) > oldest):
+                return True, "no hash record and inputs are newer"
+            self.record(task, inputs, outputs, params)
+            return False, "no hash record, outputs are newer"
+        old_params, old_inputs, old_outputs = record
+        if old_params != params:
+            return True, "parameters changed"
+        if sorted(old_inputs) != inputs:
+            return True, "inputs changed: {}".format(', '.join(sorted(
+                set(old_inputs).symmetric_difference(inputs))))
+        digests = self.digest(inputs + outputs)
+        changed = [p for p in inputs if digests[p] != old_inputs[p]]
+        if changed:
+            return True, "content changed: {}".format(', '.join(changed))
+        changed = [p for p in outputs if digests[p] != old_outputs.get(p)]
+        if changed:
+            return True, "output changed: {}".format(', '.join(changed))
+        return False, "content hashes match"
@@ -0,0 +1,238 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 15:40
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+registry.py
+
+The products registry.
+
+The products written by the tasks are recorded in a SQLite database,
+keyed by the fields parsed from the filenames (obsid, stage, group,
+chip), so the inputs can be resolved by indexed queries instead of
+globbing the task io dir.
+"""
+
+import os
+import re
+import glob
+import sqlite3
+import threading
+import fnmatch
+
+
+COLUMNS = [
+        ('path', 'TEXT PRIMARY KEY'),
+        ('name', 'TEXT'),
+        ('obsid', 'TEXT'),
+        ('stage', 'TEXT'),
+        ('grp', 'TEXT'),
+        ('chip', 'TEXT'),
+        ('task', 'TEXT'),
+        ('mtime', 'INTEGER'),
+        ]
+
+
+class ProductRegistry(object):
+    """
+    The SQLite registry of the products in a directory
+
+    Parameters
+    ----------
+    dbfile: str
+        The database file. It is created if not exists.
+    reg: str, optional
+        The regex to parse the filenames. The named groups ``obsid``,
+        ``imflag`` (the stage), ``ppflag`` (the group) and ``chip`` are
+        recorded if present.
+
+    The connections are opened lazily in each process and thread, so the
+    registry can be passed to the tasks run in subprocesses.
+    """
+
+    def __init__(self, dbfile, reg=None):
+        self.dbfile = os.path.abspath(dbfile)
+        self.reg = reg
+        self._local = threading.local()
+
+    def __getstate__(self):
+        return {'dbfile': self.dbfile, 'reg': self.reg}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @property
+    def conn(self):
+        # one connection per process and thread, as the jobs are
+        # dispatched by the ruffus threads
+        local = self._local
+        if getattr(local, 'conn', None) is None or \
+                local.pid != os.getpid():
+            local.conn = sqlite3.connect(self.dbfile, timeout=60.)
+            local.pid = os.getpid()
+            local.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS products ({})".format(
+                        ', '.join(' '.join(c) for c in COLUMNS)))
+            for cols in ['obsid', 'stage, grp', 'name']:
+                local.conn.execute(
+                        "CREATE INDEX IF NOT EXISTS products_{} ON products "
+                        "({})".format(cols.replace(', ', '_'), cols))
+            local.conn.commit()
+        return local.conn
+
+    def close(self):
+        if getattr(self._local, 'conn', None) is not None:
+            self._local.conn.close()
+            self._local.conn = None
+
+    def __len__(self):
+        return self.conn.execute(
+                "SELECT COUNT(*) FROM products").fetchone()[0]
+
+    def parse(self, filename):
+        """Return the dict of the recorded fields of filename"""
+        name = os.path.basename(filename)
+        parsed = {}
+        if self.reg is not None:
+            m = re.match(self.reg, name)
+            if m is not None:
+                parsed = m.groupdict()
+        return dict(
+                name=name,
+                obsid=parsed.get('obsid'),
+                stage=(parsed.get('imflag') or '').rstrip('_') or None,
+                grp=(parsed.get('ppflag') or '').rstrip('_') or None,
+                chip=parsed.get('chip'),
+                )
+
+    def _row(self, path, task=None, st=None):
+        if st is None:
+            st = os.lstat(path)
+        row = dict(self.parse(path), path=path, task=task,
+                   mtime=st.st_mtime_ns)
+        return tuple(row[c[0]] for c in COLUMNS)
+
+    def register(self, paths, task=None):
+        """
+        Record paths as products of task
+
+        Paths that do not exist are removed from the registry.
+        """
+        rows = []
+        missing = []
+        for path in paths:
+            path = os.path.abspath(path)
+            try:
+                rows.append(self._row(path, task=task))
+            except OSError:
+                missing.append((path, ))
+        with self.conn as conn:
+            conn.executemany(
+                    "INSERT OR REPLACE INTO products VALUES ({})".format(
+                        ','.join('?' * len(COLUMNS))), rows)
+            conn.executemany("DELETE FROM products WHERE path = ?", missing)
+
+    def remove(self, paths):
+        """Remove paths from the registry"""
+        with self.conn as conn:
+            conn.executemany(
+                    "DELETE FROM products WHERE path = ?",
+                    [(os.path.abspath(p), ) for p in paths])
+
+    def sync(self, dirname):
+        """
+        Reconcile the registry with the content of dirname
+
+        The directory is listed once; new or modified files are recorded
+        and the records of vanished files are removed.
+
+        Returns
+        -------
+        nnew, nremoved: int
+        """
+        dirname = os.path.abspath(dirname)
+        current = dict(self.conn.execute(
+                "SELECT path, mtime FROM products WHERE path GLOB ?",
+                (os.path.join(glob_escape(dirname), '*'), )))
+        rows = []
+        found = set()
+        with os.scandir(dirname) as it:
+            for d in it:
+                if d.is_dir(follow_symlinks=False):
+                    continue
+                found.add(d.path)
+                st = d.stat(follow_symlinks=False)
+                if current.get(d.path, None) != st.st_mtime_ns:
+                    rows.append(self._row(d.path, st=st))
+        stale = [(p, ) for p in current if p not in found and
+                 os.path.dirname(p) == dirname]
+        with self.conn as conn:
+            conn.executemany(
+                    "INSERT OR REPLACE INTO products VALUES ({})".format(
+                        ','.join('?' * len(COLUMNS))), rows)
+            conn.executemany("DELETE FROM products WHERE path = ?", stale)
+        return len(rows), len(stale)
+
+    def lookup(self, pattern=None, **kwargs):
+        """
+        Return the sorted paths of the products that match
+
+        Parameters
+        ----------
+        pattern: str, optional
+            The glob pattern. If it contains a directory, only the
+            products in that directory are matched, otherwise it is
+            matched against the basenames.
+        **kwargs:
+            Any of obsid, stage, grp, chip and task to match exactly.
+        """
+        where = []
+        args = []
+        for key in ['obsid', 'stage', 'grp', 'chip', 'task']:
+            if kwargs.get(key, None) is not None:
+                where.append("{} = ?".format(key))
+                args.append(kwargs[key])
+        if pattern is not None:
+            dirname, name = os.path.split(pattern)
+            if dirname:
+                where.append("path GLOB ?")
+                args.append(os.path.join(
+                    glob_escape(os.path.abspath(dirname)), '*'))
+            where.append("name GLOB ?")
+            args.append(name)
+        query = "SELECT path FROM products"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        paths = [p for p, in self.conn.execute(query, args)]
+        if pattern is not None:
+            # sqlite GLOB does not treat the separators specially
+            paths = [p for p in paths if fnmatch.fnmatchcase(
+                     os.path.basename(p), os.path.basename(pattern)) and (
+                     not os.path.dirname(pattern) or os.path.dirname(p) ==
+                     os.path.abspath(os.path.dirname(pattern)))]
+        return sorted(paths)
+
+
+def glob_escape(s):
+    """Escape the glob special chars in s for sqlite GLOB"""
+    return re.sub(r'([*?\[])', r'[\1]', s)
+
+
+def registry_glob(pattern, registry=None, **kwargs):
+    """
+    Return the sorted files that match pattern
+
+    The registry is queried if given, with kwargs to narrow down the
+    query. Files that are not recorded, e.g., side products of a task,
+    are looked up in the file system and recorded.
+    """
+    if registry is None:
+        return sorted(glob.glob(pattern))
+    paths = [p for p in registry.lookup(pattern, **kwargs)
+             if os.path.lexists(p)]
+    if not paths:
+        paths = sorted(glob.glob(pattern))
+        if paths:
+            registry.register(paths)
+    return paths
@@ -0,0 +1,219 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 22:00
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+resources.py
+
+The node resource budget shared by the jobs of the pipeline.
+
+The tasks declare the resources of their jobs in the ``resources`` entry
+of the task dict, e.g., ``{'cpus': 4, 'memory': 2000, 'io': 1}``, in
+which ``cpus`` is the number of threads wanted (0 for all of the
+budget), ``memory`` is the estimated peak memory in MB and ``io`` is
+the I/O weight. A job is admitted when the budget allows, and is granted
+as many threads as available up to the number wanted, but no fewer than
+``min_cpus``. The granted threads are passed to the astromatic programs
+as ``NTHREADS`` and to the tasks as the ``resources`` keyword argument.
+
+The ledger of the running and waiting jobs is a small JSON file guarded
+by a file lock, so the budget is shared by the worker processes and
+threads. The waiting jobs are admitted in the order of their priorities,
+e.g., the critical-path estimates of `schedule`. The jobs of dead
+processes are released automatically.
+"""
+
+import os
+import json
+import time
+import uuid
+import fcntl
+from contextlib import contextmanager
+from multiprocessing import cpu_count
+
+
+DEFAULT_REQUEST = {'cpus': 1, 'memory': 0, 'io': 0}
+DEFAULT_IO_BUDGET = 4
+
+
+def node_budget(cpus=None, memory=None, io=None):
+    """Return the budget dict of the node. The defaults are the number
+    of CPUs and 80% of the physical memory in MB."""
+    if cpus is None:
+        cpus = cpu_count()
+    if memory is None:
+        try:
+            memory = int(os.sysconf('SC_PHYS_PAGES') *
+                         os.sysconf('SC_PAGE_SIZE') * 0.8 / 1024 ** 2)
+        except (ValueError, OSError, AttributeError):
+            memory = 0
+    if io is None:
+        io = DEFAULT_IO_BUDGET
+    return {'cpus': int(cpus), 'memory': int(memory), 'io': int(io)}
+
+
+def granted_cpus(kwargs, default=None):
+    """Return the number of threads granted to the job from the task
+    keyword arguments, or default (the number of CPUs if None)"""
+    grant = kwargs.get('resources', None) or {}
+    if grant.get('cpus'):
+        return grant['cpus']
+    return cpu_count() if default is None else default
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class ResourcePool(object):
+    """
+    The resource budget of the node
+
+    Parameters
+    ----------
+    ledger_file: str
+        The file to record the running jobs.
+    cpus, memory, io: int, optional
+        The budget. See `node_budget` for the defaults. A zero memory
+        budget disables the memory accounting.
+    poll: float
+        The interval in seconds to retry the admission.
+    """
+
+    def __init__(self, ledger_file, cpus=None, memory=None, io=None,
+                 poll=0.2):
+        self.ledger_file = os.path.abspath(ledger_file)
+        self.budget = node_budget(cpus=cpus, memory=memory, io=io)
+        self.poll = poll
+
+    def __getstate__(self):
+        return dict(self.budget, ledger_file=self.ledger_file,
+                    poll=self.poll)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @contextmanager
+    def _ledger(self):
+        with open(self.ledger_file + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self.ledger_file, 'r') as fo:
+                        ledger = json.load(fo)
+                except (OSError, ValueError):
+                    ledger = {}
+                ledger = {
+                        key: {k: v for k, v in ledger.get(key, {}).items()
+                              if _pid_alive(v['pid'])}
+                        for key in ('running', 'waiting')}
+                yield ledger
+                tmpname = "{}.{}".format(self.ledger_file, os.getpid())
+                with open(tmpname, 'w') as fo:
+                    json.dump(ledger, fo)
+                os.rename(tmpname, self.ledger_file)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def usage(self):
+        """Return the dict of the resources in use"""
+        with self._ledger() as ledger:
+            return self._usage(ledger)
+
+    def _usage(self, ledger):
+        return {k: sum(v[k] for v in ledger['running'].values())
+                for k in self.budget}
+
+    def _try_grant(self, request, free, used):
+        cpus = request.get('cpus', DEFAULT_REQUEST['cpus'])
+        cpus = self.budget['cpus'] if cpus <= 0 else min(
+                cpus, self.budget['cpus'])
+        min_cpus = min(request.get('min_cpus', 1), cpus)
+        if free['cpus'] < min_cpus:
+            return None
+        # requests over the budget are admitted only on an idle node
+        grant = {'cpus': min(cpus, free['cpus'])}
+        for key in ('memory', 'io'):
+            value = request.get(key, DEFAULT_REQUEST[key])
+            if self.budget[key] > 0 and value > free[key] and used[key] > 0:
+                return None
+            grant[key] = value
+        return grant
+
+    def _schedule(self, ledger, token):
+        """Return the grant of token if it is admitted. The waiting jobs
+        are admitted in the order of priority, and the lower priority
+        jobs fill in the resources the higher ones do not fit in."""
+        used = self._usage(ledger)
+        free = {k: self.budget[k] - used[k] for k in self.budget}
+        # skip the waiting jobs that stopped polling
+        expire = time.time() - max(10 * self.poll, 5.)
+        waiting = sorted(
+                [i for i in ledger['waiting'].items()
+                 if i[0] == token or i[1]['seen'] > expire],
+                key=lambda i: (-i[1]['priority'], i[1]['since']))
+        for key, entry in waiting:
+            grant = self._try_grant(entry['request'], free, used)
+            if grant is None:
+                continue
+            if key == token:
+                return grant
+            for k in free:
+                free[k] -= grant[k]
+                used[k] += grant[k]
+        return None
+
+    def acquire(self, request=None, timeout=None, priority=0.):
+        """
+        Wait until the request is admitted
+
+        The waiting job of the highest priority that fits is admitted
+        first.
+
+        Returns
+        -------
+        token: str
+            The token to release the grant.
+        grant: dict
+            The granted cpus, memory and io.
+        """
+        request = dict(DEFAULT_REQUEST, **(request or {}))
+        token = uuid.uuid4().hex
+        start = time.time()
+        entry = {'request': request, 'priority': priority, 'since': start,
+                 'pid': os.getpid()}
+        while True:
+            timed_out = timeout is not None and time.time() - start > timeout
+            with self._ledger() as ledger:
+                ledger['waiting'][token] = dict(entry, seen=time.time())
+                grant = self._schedule(ledger, token)
+                if grant is not None or timed_out:
+                    del ledger['waiting'][token]
+                if grant is not None:
+                    ledger['running'][token] = dict(grant, pid=os.getpid())
+                    return token, grant
+            if timed_out:
+                raise TimeoutError(
+                        "unable to acquire resources {}".format(request))
+            time.sleep(self.poll)
+
+    def release(self, token):
+        with self._ledger() as ledger:
+            ledger['running'].pop(token, None)
+
+    @contextmanager
+    def reserve(self, request=None, timeout=None, priority=0.):
+        """Context manager that holds the grant of the request"""
+        token, grant = self.acquire(
+                request, timeout=timeout, priority=priority)
+        try:
+            yield grant
+        finally:
+            self.release(token)
@@ -0,0 +1,163 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 22:20
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+schedule.py
+
+The critical-path priorities of the jobs from the historical durations.
+
+The durations of the jobs are recorded per task and per job, the latter
+keyed by the basenames of the outputs so the records are shared by the
+jobs of different jobdirs. The priority of a job is its estimated
+duration plus the longest estimated path of the downstream tasks, i.e.,
+the upward rank in the list scheduling. Jobs of no history are
+estimated from the task history scaled by the input size, or from the
+input size alone.
+
+The priorities order the jobs that wait for the job slots of the mixed
+executor, see `executor`, the resource budget and the work queue.
+"""
+
+import os
+import time
+import sqlite3
+import threading
+
+from .manifest import flatten_files
+
+
+# the assumed throughput in bytes per second for jobs of no history
+DEFAULT_RATE = 50e6
+
+
+def task_graph(tlist):
+    """Return the dict of the downstream task names of the tasks, from
+    the task references in the inputs and the follows entries"""
+    names = [t['name'] for t in tlist]
+
+    def refs(value):
+        if isinstance(value, dict):
+            return [value['name']]
+        if isinstance(value, (list, tuple)):
+            return sum((refs(v) for v in value), [])
+        if isinstance(value, str) and value in names:
+            return [value]
+        return []
+    graph = {name: set() for name in names}
+    for task in tlist:
+        for key in ('in_', 'in2', 'add_inputs', 'replace_inputs', 'follows'):
+            for name in refs(task.get(key, None)):
+                if name in graph and name != task['name']:
+                    graph[name].add(task['name'])
+    return graph
+
+
+def downstream_lengths(graph, durations):
+    """Return the dict of the longest estimated path of the downstream
+    tasks, excluding the task itself"""
+    ranks = {}
+
+    def rank(name, visiting=()):
+        if name not in ranks:
+            if name in visiting:
+                return 0.
+            ranks[name] = durations.get(name, 0.) + downstream(
+                    name, visiting + (name, ))
+        return ranks[name]
+
+    def downstream(name, visiting=()):
+        return max([rank(n, visiting) for n in graph.get(name, ())] or [0.])
+    return {name: downstream(name) for name in graph}
+
+
+def _job_key(out_files):
+    return ','.join(sorted(
+        os.path.basename(p) for p in flatten_files(out_files)))
+
+
+def _input_size(in_files):
+    return sum(os.path.getsize(p) for p in flatten_files(in_files)
+               if os.path.isfile(p))
+
+
+class DurationHistory(object):
+    """
+    The SQLite history of the durations of the jobs
+
+    Parameters
+    ----------
+    dbfile: str
+        The database file. It is created if not exists.
+
+    The connections are opened lazily in each process and thread, so the
+    history can be passed to the tasks run in subprocesses.
+    """
+
+    def __init__(self, dbfile):
+        self.dbfile = os.path.abspath(dbfile)
+        self._local = threading.local()
+
+    def __getstate__(self):
+        return {'dbfile': self.dbfile}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @property
+    def conn(self):
+        # one connection per process and thread, as the jobs are
+        # dispatched by the ruffus threads
+        local = self._local
+        if getattr(local, 'conn', None) is None or \
+                local.pid != os.getpid():
+            local.conn = sqlite3.connect(self.dbfile, timeout=60.)
+            local.pid = os.getpid()
+            local.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS durations (
+                    task TEXT, job TEXT, duration REAL, size INTEGER,
+                    timestamp REAL, PRIMARY KEY (task, job));
+                """)
+            local.conn.commit()
+        return local.conn
+
+    def close(self):
+        if getattr(self._local, 'conn', None) is not None:
+            self._local.conn.close()
+            self._local.conn = None
+
+    def record(self, task, in_files, out_files, duration):
+        """Record the duration of the job in seconds"""
+        with self.conn as conn:
+            conn.execute(
+                    "INSERT OR REPLACE INTO durations VALUES (?, ?, ?, ?, ?)",
+                    (task, _job_key(out_files), duration,
+                     _input_size(in_files), time.time()))
+
+    def task_durations(self):
+        """Return the dict of the mean durations of the tasks"""
+        return dict(self.conn.execute(
+            "SELECT task, AVG(duration) FROM durations GROUP BY task"))
+
+    def estimate(self, task, in_files, out_files):
+        """Return the estimated duration of the job in seconds"""
+        row = self.conn.execute(
+                "SELECT duration FROM durations WHERE task = ? AND job = ?",
+                (task, _job_key(out_files))).fetchone()
+        if row is not None:
+            return row[0]
+        size = _input_size(in_files)
+        duration, rate_size = self.conn.execute(
+                "SELECT AVG(duration), AVG(size) FROM durations "
+                "WHERE task = ?", (task, )).fetchone()
+        if duration is None:
+            return size / DEFAULT_RATE
+        if rate_size and size:
+            return duration * size / rate_size
+        return duration
+
+    def priority(self, task, in_files, out_files, downstream=0.):
+        """Return the priority of the job, the estimated duration of the
+        job and the downstream tasks"""
+        return self.estimate(task, in_files, out_files) + downstream
@@ -0,0 +1,52 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 21:40
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+test_cache.py
+"""
+
+import os
+import pickle
+
+
+def test_task_cache(tmpdir):
+    from ..cache import TaskCache
+    task = {'name': 't', 'func': 'sex', 'params': {'BACK_SIZE': 64}}
+    keys = []
+    for job in ['job1', 'job2']:
+        jobdir = tmpdir.mkdir(job)
+        cache = pickle.loads(pickle.dumps(TaskCache(
+            str(tmpdir.join('cache')), max_size=15,
+            replace={str(jobdir): '{jobdir}'})))
+        # same content under different names, and jobdir in small files
+        with open(str(jobdir.join(job + '.fits')), 'w') as fo:
+            fo.write('image')
+        with open(str(jobdir.join('conf')), 'w') as fo:
+            fo.write('PARAMETERS_NAME {}/sex.param'.format(jobdir))
+        in_files = [str(jobdir.join(job + '.fits')), str(jobdir.join('conf'))]
+        params = cache.params_key(dict(task, kwargs={'d': str(jobdir)}))
+        keys.append(cache.job_key(in_files, params))
+        out_files = [str(jobdir.join(job + '.cat'))]
+        if job == 'job1':
+            assert not cache.fetch(keys[-1], out_files)
+            with open(out_files[0], 'w') as fo:
+                fo.write('catalog')
+            cache.store(keys[-1], 't', out_files)
+    assert keys[0] == keys[1]
+    assert cache.fetch(keys[1], out_files)
+    with open(out_files[0]) as fo:
+        assert fo.read() == 'catalog'
+    # evicted least recently used beyond the size limit
+    other = str(tmpdir.join('job2', 'other.cat'))
+    with open(other, 'w') as fo:
+        fo.write('other catalog')
+    cache.store('other', 't', [other])
+    assert len(cache) == 1 and not cache.fetch(keys[0], out_files)
+    # outputs modified in place invalidate the entry
+    cache.store(keys[0], 't', out_files)
+    with open(out_files[0], 'a') as fo:
+        fo.write('modified')
+    assert not cache.fetch(keys[0], out_files)
+    assert os.path.exists(out_files[0])
@@ -0,0 +1,181 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 22:40
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+test_executor.py
+"""
+
+import os
+import pickle
+import threading
+import time
+
+import pytest
+
+
+def test_job_executor():
+    from ..executor import JobExecutor, default_executor_kind
+    assert default_executor_kind('astromatic_task') == 'thread'
+    assert default_executor_kind('callable_task') == 'process'
+    executor = JobExecutor(nprocs=2).start()
+    try:
+        assert executor.run('process', os.getpid) != os.getpid()
+        assert executor.run('thread', os.getpid) == os.getpid()
+        assert executor.run('inline', max, 1, 2) == 2
+        with pytest.raises(ValueError):
+            executor.run('process', int, 'a')
+        with pytest.raises(ValueError):
+            executor.run('cluster', os.getpid)
+        # runs in place when sent to a worker process
+        copied = pickle.loads(pickle.dumps(executor))
+        assert copied.run('process', os.getpid) == os.getpid()
+    finally:
+        executor.shutdown()
+
+
+def _job(in_files, out_files, context):
+    if context['fail']:
+        raise ValueError(in_files)
+    return os.getpid(), in_files, out_files, context['shared']
+
+
+def test_batched_jobs():
+    from ..executor import JobExecutor
+    executor = JobExecutor(nprocs=2, batch_window=1.).start()
+    shared = {'large': list(range(1000))}
+    results = {}
+
+    def dispatch(i):
+        context = {'shared': shared, 'fail': i == 3}
+        try:
+            results[i] = executor.run(
+                    'process', _job, [i], [i + 10], context, batch=('t', 4))
+        except ValueError as e:
+            results[i] = e
+    threads = [threading.Thread(target=dispatch, args=(i, ))
+               for i in range(4)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+    finally:
+        executor.shutdown()
+    assert isinstance(results.pop(3), ValueError)
+    # all in one worker call
+    assert len({r[0] for r in results.values()}) == 1
+    for i, (_, in_files, out_files, context_shared) in results.items():
+        assert in_files == [i] and out_files == [i + 10]
+        assert context_shared == shared
+
+
+def _copy_job(in_file, out_file, **kwargs):
+    with open(in_file) as fi, open(out_file, 'w') as fo:
+        fo.write(fi.read())
+
+
+def test_thread_dispatch(tmpdir):
+    try:
+        from .. import core
+    except ImportError as e:
+        pytest.skip("apus core not importable: {}".format(e))
+    from ..registry import ProductRegistry
+    from ..manifest import HashManifest
+    from ..schedule import DurationHistory
+    jobdir = str(tmpdir)
+    # the mixed executor is opt in, by the config or the flag
+    conf = dict(jobkey='executor', jobdir=jobdir, logdir=jobdir)
+    assert core.configure(conf, [])[1].executor == 'ruffus'
+    conf['executor'] = 'mixed'
+    assert core.configure(conf, [])[1].executor == 'mixed'
+    assert core.configure(
+            conf, ['--executor', 'ruffus'])[1].executor == 'ruffus'
+    for i in range(2):
+        tmpdir.join('{}.txt'.format(i)).write(str(i))
+    t1 = dict(name='proc', func=_copy_job, pipe='transform',
+              in_=(os.path.join(jobdir, '*.txt'), r'(?P<n>.+)\.txt'),
+              out='{basename[0]}.p')
+    t2 = dict(name='thr', func=_copy_job, pipe='transform',
+              executor='thread',
+              in_=(t1, r'(?P<n>.+)\.p'), out='{basename[0]}.t')
+    files = {k: os.path.join(jobdir, 'job.' + k) for k in (
+        'registry', 'manifest', 'durations')}
+    # the shared objects are used in the dispatch threads
+    core.bootstrap(dict(
+        jobkey='thread_dispatch', jobdir=jobdir, logdir=jobdir,
+        tlist=[t1, t2], resources={},
+        registry_file=files['registry'], manifest_file=files['manifest'],
+        durations_file=files['durations'], executor='mixed'),
+        ['-j', '2'])
+    for i in range(2):
+        assert tmpdir.join('{}.t'.format(i)).read() == str(i)
+    assert len(ProductRegistry(files['registry'])) >= 4
+    assert HashManifest(files['manifest']).lookup(
+            'thr', [os.path.join(jobdir, '0.t')]) is not None
+    assert set(DurationHistory(files['durations']).task_durations()) == \
+        {'proc', 'thr'}
+
+
+def test_job_slots():
+    from ..executor import JobExecutor
+    executor = JobExecutor(slots=1)
+    order = []
+
+    def job(priority):
+        executor.acquire_slot(priority)
+        order.append(priority)
+        executor.release_slot()
+    executor.acquire_slot()
+    threads = [threading.Thread(target=job, args=(p, )) for p in (1, 3, 2)]
+    for thread in threads:
+        thread.start()
+    while len(executor._slot_waiting) < 3:
+        time.sleep(0.01)
+    executor.release_slot()
+    for thread in threads:
+        thread.join(10)
+    assert order == [3, 2, 1]
+
+
+def _order_job(in_file, out_file, **kwargs):
+    with open(out_file, 'w') as fo:
+        fo.write(os.path.basename(out_file))
+    with open(os.path.join(os.path.dirname(out_file), 'order.log'),
+              'a') as fo:
+        fo.write(os.path.basename(out_file)[0])
+        first = fo.tell() == 1
+    # the others are dispatched while the first job runs
+    if first:
+        time.sleep(1.)
+
+
+def test_priority_dispatch(tmpdir):
+    try:
+        from .. import core
+    except ImportError as e:
+        pytest.skip("apus core not importable: {}".format(e))
+    from ..schedule import DurationHistory
+    jobdir = str(tmpdir)
+    durations_file = os.path.join(jobdir, 'job.durations')
+    history = DurationHistory(durations_file)
+    # the jobs within the lookahead of the dispatch threads
+    for i in range(4):
+        tmpdir.join('{}.txt'.format(i)).write(str(i))
+        history.record('order', [], [os.path.join(
+            jobdir, '{}.o'.format(i))], float(i))
+    history.close()
+    task = dict(name='order', func=_order_job, pipe='transform',
+                executor='thread',
+                in_=(os.path.join(jobdir, '*.txt'), r'(?P<n>.+)\.txt'),
+                out='{basename[0]}.o')
+    # the jobs waiting for the one slot run by the priorities, not in
+    # the order of the ruffus dispatch
+    core.bootstrap(dict(
+        jobkey='priority_dispatch', jobdir=jobdir, logdir=jobdir,
+        tlist=[task], durations_file=durations_file, executor='mixed'),
+        ['-j', '1'])
+    order = tmpdir.join('order.log').read()
+    assert sorted(order) == list('0123')
+    assert list(order[1:]) == sorted(order[1:], reverse=True)
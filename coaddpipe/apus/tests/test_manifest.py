@@ -0,0 +1,82 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 21:20
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+test_manifest.py
+"""
+
+import os
+import pickle
+
+
+def test_manifest(tmpdir):
+    from ..manifest import HashManifest, params_digest
+    in_file = str(tmpdir.join('a.txt'))
+    out_file = str(tmpdir.join('a.out'))
+    for f in [in_file, out_file]:
+        with open(f, 'w') as fo:
+            fo.write('a')
+    task = {'name': 't', 'func': 'cp', 'kwargs': {'x': 1, 'log': 2},
+            'volatile_kwargs': ['log']}
+    params = params_digest(task)
+    assert params == params_digest(dict(task, kwargs={'x': 1, 'log': 3}))
+    assert params != params_digest(dict(task, kwargs={'x': 2, 'log': 2}))
+    manifest = pickle.loads(pickle.dumps(
+        HashManifest(str(tmpdir.join('manifest.sqlite')))))
+    # adopt the outputs newer than the inputs
+    os.utime(in_file, (0, 0))
+    assert not manifest.check('t', [in_file], out_file, params)[0]
+    # touch does not trigger update
+    os.utime(in_file, None)
+    assert manifest.check('t', [(in_file, )], [out_file], params) == (
+            False, "content hashes match")
+    assert manifest.check('t', [in_file], out_file, 'other') == (
+            True, "parameters changed")
+    with open(in_file, 'w') as fo:
+        fo.write('b')
+    needs_update, reason = manifest.check('t', [in_file], out_file, params)
+    assert needs_update and reason.startswith('content changed')
+    manifest.record('t', [in_file], out_file, params)
+    assert not manifest.check('t', [in_file], out_file, params)[0]
+    os.remove(out_file)
+    assert manifest.check('t', [in_file], out_file, params)[0]
+
+
+def _line_digest(inputs, extras, line=0):
+    with open(extras[0]) as fo:
+        return fo.read().split('\n')[line]
+
+
+def test_extras_digest(tmpdir):
+    from ..manifest import HashManifest, job_params
+    in_file = str(tmpdir.join('a.txt'))
+    out_file = str(tmpdir.join('a.out'))
+    jobfile = str(tmpdir.join('job.txt'))
+    for f, content in [(in_file, 'a'), (out_file, 'a'),
+                       (jobfile, 'row0\nrow1')]:
+        with open(f, 'w') as fo:
+            fo.write(content)
+    manifest = HashManifest(str(tmpdir.join('manifest.sqlite')))
+    task = {'name': 't', 'func': 'cp', 'kwargs': {'line': 0}}
+    manifest.record('t', [in_file], out_file,
+                    job_params(task, [in_file], [jobfile]))
+
+    def check():
+        return manifest.check('t', [in_file], out_file, job_params(
+            task, [in_file], [jobfile]))[0]
+    # the extras are not hashed unless the task opts in
+    with open(jobfile, 'w') as fo:
+        fo.write('row0\nrow1 edited')
+    assert not check()
+    task['extras_digest'] = _line_digest
+    manifest.record('t', [in_file], out_file,
+                    job_params(task, [in_file], [jobfile]))
+    # the edit of the other row does not make the job stale
+    with open(jobfile, 'w') as fo:
+        fo.write('row0\nrow1 edited again')
+    assert not check()
+    with open(jobfile, 'w') as fo:
+        fo.write('row0 edited\nrow1 edited again')
+    assert check()
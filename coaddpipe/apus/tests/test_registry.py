@@ -0,0 +1,50 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 16:05
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+test_registry.py
+"""
+
+import os
+import pickle
+
+
+def test_registry(tmpdir):
+    from ..registry import ProductRegistry, registry_glob
+    reg = r'(?P<ppflag>[^_/]+_)?(?P<imflag>[^_/]+)_(?P<obsid>obs\d+)_.+$'
+    jobdir = str(tmpdir.mkdir('job'))
+
+    def create(name):
+        name = os.path.join(jobdir, name)
+        open(name, 'w').close()
+        return name
+
+    create('orig_obs1_a.fits')
+    create('orig_obs2_a.fits')
+    registry = ProductRegistry(str(tmpdir.join('products.sqlite')), reg=reg)
+    assert registry.sync(jobdir) == (2, 0)
+    assert registry.sync(jobdir) == (0, 0)
+
+    hdr = create('phot0_masked_obs1_a.hdr_phot')
+    registry.register([hdr], task='get flxscale')
+    pattern = os.path.join(jobdir, 'phot[0-9]*_*obs1*.hdr_phot')
+    assert registry.lookup(pattern, obsid='obs1') == [hdr]
+    assert registry.lookup(grp='phot0', stage='masked') == [hdr]
+    assert registry.lookup(task='get flxscale') == [hdr]
+    assert registry.lookup(pattern, obsid='obs2') == []
+
+    # pickled registry works in another process
+    registry = pickle.loads(pickle.dumps(registry))
+    os.remove(os.path.join(jobdir, 'orig_obs2_a.fits'))
+    assert registry.sync(jobdir) == (0, 1)
+    assert len(registry) == 2
+
+    # files not recorded are found on the file system
+    hdr2 = create('phot1_masked_obs2_a.hdr_phot')
+    pattern = os.path.join(jobdir, 'phot[0-9]*_*obs2*.hdr_phot')
+    assert registry_glob(pattern, registry, obsid='obs2') == [hdr2]
+    assert registry.lookup(pattern) == [hdr2]
+    os.remove(hdr2)
+    assert registry_glob(pattern, registry, obsid='obs2') == []
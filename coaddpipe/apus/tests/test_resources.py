@@ -0,0 +1,45 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 22:00
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+test_resources.py
+"""
+
+import pickle
+import threading
+
+import pytest
+
+
+def test_resource_pool(tmpdir):
+    from ..resources import ResourcePool, granted_cpus
+    pool = pickle.loads(pickle.dumps(ResourcePool(
+        str(tmpdir.join('job.resources')), cpus=4, memory=1000, io=2,
+        poll=0.01)))
+    token1, grant1 = pool.acquire({'cpus': 3, 'memory': 600})
+    assert grant1 == {'cpus': 3, 'memory': 600, 'io': 0}
+    # granted the remaining threads, and all of them for cpus 0
+    token2, grant2 = pool.acquire({'cpus': 0, 'io': 1})
+    assert grant2['cpus'] == 1 and granted_cpus({'resources': grant2}) == 1
+    assert pool.usage() == {'cpus': 4, 'memory': 600, 'io': 1}
+    with pytest.raises(TimeoutError):
+        pool.acquire({'memory': 10}, timeout=0.05)
+    pool.release(token2)
+    with pytest.raises(TimeoutError):
+        pool.acquire({'memory': 600}, timeout=0.05)
+    # waits until admitted
+    granted = []
+
+    def worker():
+        with pool.reserve({'cpus': 2, 'min_cpus': 2, 'memory': 2000}) as g:
+            granted.append(g)
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join(0.1)
+    assert not granted
+    pool.release(token1)
+    thread.join(5)
+    assert granted == [{'cpus': 2, 'memory': 2000, 'io': 0}]
+    assert pool.usage() == {'cpus': 0, 'memory': 0, 'io': 0}
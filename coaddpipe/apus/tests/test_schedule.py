@@ -0,0 +1,62 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 22:20
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+test_schedule.py
+"""
+
+import os
+
+
+def test_critical_path(tmpdir):
+    from ..schedule import DurationHistory, task_graph, downstream_lengths
+    t1 = {'name': 'mask', 'in_': ('*.fits', r'.+')}
+    t2 = {'name': 'ftemp', 'in_': (t1, r'.+')}
+    t3 = {'name': 'photcat', 'in_': ('*.fits', r'.+'), 'follows': ['mask']}
+    t4 = {'name': 'mosaic', 'in_': (t3, r'.+'), 'follows': t2}
+    graph = task_graph([t1, t2, t3, t4])
+    assert graph == {'mask': {'ftemp', 'photcat'}, 'ftemp': {'mosaic'},
+                     'photcat': {'mosaic'}, 'mosaic': set()}
+    durations = {'mask': 1., 'ftemp': 20., 'photcat': 5., 'mosaic': 10.}
+    assert downstream_lengths(graph, durations) == {
+            'mask': 30., 'ftemp': 10., 'photcat': 10., 'mosaic': 0.}
+
+    history = DurationHistory(str(tmpdir.join('durations.sqlite')))
+    in_files = []
+    for name, size in [('a.fits', 1000), ('b.fits', 3000)]:
+        in_files.append(str(tmpdir.join(name)))
+        with open(in_files[-1], 'wb') as fo:
+            fo.write(os.urandom(size))
+    # from input size without history, scaled with task history
+    assert history.estimate('mask', in_files[0], 'a.out') == 1000 / 50e6
+    history.record('mask', in_files[0], str(tmpdir.join('a.out')), 2.)
+    assert history.estimate('mask', in_files[0], 'a.out') == 2.
+    assert history.estimate('mask', in_files[1], 'b.out') == 6.
+    assert history.priority(
+            'mask', in_files[1], 'b.out', downstream=30.) == 36.
+    assert history.task_durations() == {'mask': 2.}
+
+
+def test_priority_admission(tmpdir):
+    from ..resources import ResourcePool
+    pool = ResourcePool(str(tmpdir.join('job.resources')), cpus=2)
+    token, _ = pool.acquire({'cpus': 2})
+    with pool._ledger() as ledger:
+        for key, priority in [('low', 1.), ('high', 10.), ('wide', 20.)]:
+            ledger['waiting'][key] = {
+                    'request': {'cpus': 1, 'min_cpus': 1,
+                                'memory': 0, 'io': 0},
+                    'priority': priority, 'since': 0., 'seen': 1e20,
+                    'pid': os.getpid()}
+        ledger['waiting']['wide']['request'].update(cpus=2, min_cpus=2)
+    pool.release(token)
+    with pool._ledger() as ledger:
+        # wide does not fit after high, low fills in the remaining cpu
+        assert pool._schedule(ledger, 'low') is None
+        assert pool._schedule(ledger, 'wide') == {
+                'cpus': 2, 'memory': 0, 'io': 0}
+        del ledger['waiting']['wide']
+        assert pool._schedule(ledger, 'high')['cpus'] == 1
+        assert pool._schedule(ledger, 'low')['cpus'] == 1
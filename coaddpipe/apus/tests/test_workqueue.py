@@ -0,0 +1,57 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 23:00
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+test_workqueue.py
+"""
+
+import os
+import time
+import multiprocessing
+
+import pytest
+
+
+def _job(x):
+    if x < 0:
+        raise ValueError(x)
+    return x * 2, os.getpid()
+
+
+def test_work_queue(tmpdir):
+    from ..workqueue import WorkQueue, work
+    queue = WorkQueue(str(tmpdir.join('queue.sqlite')), lease=0.2,
+                      poll=0.01, max_attempts=2)
+    low = queue.submit('t', _job, (1, ))
+    high = queue.submit('t', _job, (2, ), priority=10.)
+    job_id, func, args = queue.claim('a')
+    assert job_id == high and func(*args)[0] == 4
+    assert queue.renew(job_id, 'a')
+    # the lease expires and the job is claimed again, by b
+    time.sleep(0.3)
+    assert queue.claim('b')[0] == high
+    assert not queue.renew(high, 'a')
+    queue.complete(high, 'a', 'stale')
+    queue.complete(high, 'b', (4, 0))
+    assert queue.wait(high) == (4, 0)
+    assert queue.claim('b')[0] == low
+    # failed after max_attempts expired leases
+    time.sleep(0.3)
+    assert queue.claim('c')[0] == low
+    time.sleep(0.3)
+    assert queue.claim('c') is None
+    with pytest.raises(RuntimeError):
+        queue.wait(low)
+    # run by a worker process
+    worker = multiprocessing.get_context('fork').Process(
+            target=work, args=(queue, ), kwargs={'max_idle': 1.})
+    worker.start()
+    assert queue.run('t', _job, (3, )) == (6, worker.pid)
+    with pytest.raises(ValueError):
+        queue.run('t', _job, (-1, ))
+    worker.join(10)
+    assert queue.counts() == {'done': 2, 'failed': 2}
+    queue.purge()
+    assert queue.counts() == {}
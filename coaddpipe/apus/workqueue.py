@@ -0,0 +1,254 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 23:00
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+workqueue.py
+
+The file-backed work queue to run the jobs on multiple nodes.
+
+The coordinator, i.e., the apus run that resolves the DAG, publishes the
+ready jobs as pickled (func, args) to a SQLite database on the shared
+file system, and waits for the results. The workers, e.g., started by
+``coaddpipe worker`` on the other nodes, claim the jobs with leases,
+run them, and report the results or the errors. The leases are renewed
+while the jobs run, so the jobs of dead workers are claimed again once
+their leases expire, up to ``max_attempts`` times.
+"""
+
+import os
+import time
+import pickle
+import socket
+import sqlite3
+import threading
+import traceback
+
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class RemoteTraceback(Exception):
+
+    def __init__(self, tb):
+        self.tb = tb
+
+    def __str__(self):
+        return self.tb
+
+
+def worker_name():
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+class WorkQueue(object):
+    """
+    The SQLite work queue
+
+    Parameters
+    ----------
+    dbfile: str
+        The database file on the file system shared by the nodes. It is
+        created if not exists.
+    lease: float
+        The seconds a claim is valid without renewal.
+    poll: float
+        The interval in seconds to poll for the jobs or the results.
+    max_attempts: int
+        The number of claims of a job before it is failed.
+
+    The connection is opened lazily in each process, so the queue can be
+    passed to the subprocesses.
+    """
+
+    def __init__(self, dbfile, lease=300., poll=1., max_attempts=3):
+        self.dbfile = os.path.abspath(dbfile)
+        self.lease = lease
+        self.poll = poll
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+
+    def __getstate__(self):
+        return {'dbfile': self.dbfile, 'lease': self.lease,
+                'poll': self.poll, 'max_attempts': self.max_attempts}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @property
+    def conn(self):
+        # one connection per process and thread, as the coordinator
+        # waits for the jobs in the ruffus threads
+        local = self._local
+        if getattr(local, 'conn', None) is None or \
+                local.pid != os.getpid():
+            local.conn = sqlite3.connect(
+                    self.dbfile, timeout=60., isolation_level=None)
+            local.pid = os.getpid()
+            local.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT, task TEXT,
+                    payload BLOB, priority REAL, state TEXT, worker TEXT,
+                    lease REAL, attempts INTEGER, result BLOB, error TEXT,
+                    submitted REAL, finished REAL);
+                CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+                """)
+        return local.conn
+
+    def close(self):
+        if getattr(self._local, 'conn', None) is not None:
+            self._local.conn.close()
+            self._local.conn = None
+
+    def submit(self, task, func, args, priority=0.):
+        """Publish the job of func with args, and return the job id"""
+        payload = pickle.dumps((func, args), protocol=pickle.HIGHEST_PROTOCOL)
+        cursor = self.conn.execute(
+                "INSERT INTO jobs (task, payload, priority, state, attempts, "
+                "submitted) VALUES (?, ?, ?, ?, 0, ?)",
+                (task, payload, priority, QUEUED, time.time()))
+        return cursor.lastrowid
+
+    def claim(self, worker):
+        """
+        Claim the queued job of the highest priority, or the running job
+        of which the lease expired
+
+        Returns
+        -------
+        job: tuple or None
+            (id, func, args) of the claimed job.
+        """
+        now = time.time()
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                    "UPDATE jobs SET state = ?, error = ?, finished = ? "
+                    "WHERE state = ? AND lease < ? AND attempts >= ?",
+                    (FAILED, "lease expired {} times".format(
+                        self.max_attempts), now, RUNNING, now,
+                     self.max_attempts))
+            row = conn.execute(
+                    "SELECT id, payload FROM jobs WHERE state = ? OR "
+                    "(state = ? AND lease < ?) ORDER BY priority DESC, id "
+                    "LIMIT 1", (QUEUED, RUNNING, now)).fetchone()
+            if row is not None:
+                conn.execute(
+                        "UPDATE jobs SET state = ?, worker = ?, lease = ?, "
+                        "attempts = attempts + 1 WHERE id = ?",
+                        (RUNNING, worker, now + self.lease, row[0]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        func, args = pickle.loads(row[1])
+        return row[0], func, args
+
+    def renew(self, job_id, worker):
+        """Extend the lease, and return False if the job is lost"""
+        cursor = self.conn.execute(
+                "UPDATE jobs SET lease = ? WHERE id = ? AND worker = ? "
+                "AND state = ?",
+                (time.time() + self.lease, job_id, worker, RUNNING))
+        return cursor.rowcount > 0
+
+    def complete(self, job_id, worker, result):
+        self.conn.execute(
+                "UPDATE jobs SET state = ?, result = ?, finished = ? "
+                "WHERE id = ? AND worker = ? AND state = ?",
+                (DONE, pickle.dumps(result), time.time(), job_id, worker,
+                 RUNNING))
+
+    def fail(self, job_id, worker, error, tb):
+        try:
+            result = pickle.dumps(error)
+        except Exception:
+            result = pickle.dumps(RuntimeError(repr(error)))
+        self.conn.execute(
+                "UPDATE jobs SET state = ?, result = ?, error = ?, "
+                "finished = ? WHERE id = ? AND worker = ? AND state = ?",
+                (FAILED, result, tb, time.time(), job_id, worker, RUNNING))
+
+    def wait(self, job_id, timeout=None):
+        """Wait for the job, and return the result or raise the error"""
+        start = time.time()
+        while True:
+            state, result, error = self.conn.execute(
+                    "SELECT state, result, error FROM jobs WHERE id = ?",
+                    (job_id, )).fetchone()
+            if state == DONE:
+                return pickle.loads(result)
+            if state == FAILED:
+                error = RemoteTraceback(error or '')
+                if result is None:
+                    raise RuntimeError("job {} failed".format(job_id)) \
+                        from error
+                raise pickle.loads(result) from error
+            if timeout is not None and time.time() - start > timeout:
+                raise TimeoutError("job {} not finished".format(job_id))
+            time.sleep(self.poll)
+
+    def run(self, task, func, args, priority=0.):
+        """Submit the job and wait for the result"""
+        return self.wait(self.submit(task, func, args, priority=priority))
+
+    def counts(self):
+        """Return the dict of the numbers of the jobs in the states"""
+        return dict(self.conn.execute(
+            "SELECT state, COUNT(*) FROM jobs GROUP BY state"))
+
+    def purge(self):
+        """Remove the finished jobs"""
+        self.conn.execute(
+                "DELETE FROM jobs WHERE state IN (?, ?)", (DONE, FAILED))
+
+
+def work(queue, name=None, max_idle=None, max_jobs=None, logger=None):
+    """
+    Claim and run the jobs of queue until idle for max_idle seconds, or
+    max_jobs jobs are done, and return the number of jobs done
+
+    The lease of the running job is renewed in a background thread.
+    """
+    name = name or worker_name()
+    njobs = 0
+    idle_since = time.time()
+    while max_jobs is None or njobs < max_jobs:
+        job = queue.claim(name)
+        if job is None:
+            if max_idle is not None and time.time() - idle_since > max_idle:
+                break
+            time.sleep(queue.poll)
+            continue
+        job_id, func, args = job
+        if logger is not None:
+            logger.info("{} run job {}".format(name, job_id))
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(queue.lease / 3.):
+                if not queue.renew(job_id, name):
+                    break
+        thread = threading.Thread(target=heartbeat, daemon=True)
+        thread.start()
+        try:
+            result = func(*args)
+        except Exception as e:
+            if logger is not None:
+                logger.error("{} job {} failed: {}".format(name, job_id, e))
+            queue.fail(job_id, name, e, traceback.format_exc())
+        else:
+            queue.complete(job_id, name, result)
+        finally:
+            stop.set()
+            thread.join()
+        njobs += 1
+        idle_since = time.time()
+    return njobs
@@ -0,0 +1,339 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 13:00
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+archive_index.py
+
+A SQLite index of the data archive, to select job inputs by instrument,
+filter, sky position and time.
+
+The archive is crawled with parallel `os.scandir`, the files are matched
+against ``reg_arch``, and the headers of the images are read with the
+raw header reader in `~coaddpipe.header_index`. Companion files (masks,
+weight maps) are indexed by their filenames and selected together with
+the image of the same OBSID.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+import os
+import re
+import sqlite3
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import cpu_count
+
+import numpy as np
+
+from .header_index import try_read_headers
+
+
+COLUMNS = [
+        ('path', 'TEXT PRIMARY KEY'),
+        ('size', 'INTEGER'),
+        ('mtime', 'INTEGER'),
+        ('obsid', 'TEXT'),
+        ('imflag', 'TEXT'),
+        ('instru', 'TEXT'),
+        ('band', 'TEXT'),
+        ('filter', 'TEXT'),
+        ('object', 'TEXT'),
+        ('ra', 'REAL'),
+        ('dec', 'REAL'),
+        ('mjd', 'REAL'),
+        ('exptime', 'REAL'),
+        ]
+
+# header keys to look for, in order of preference
+HEADER_KEYS = {
+        'ra': ['CENTRA', 'CRVAL1', 'RA'],
+        'dec': ['CENTDEC', 'CRVAL2', 'DEC'],
+        'mjd': ['MJD-OBS', ],
+        'exptime': ['EXPTIME', 'EXPMEAS'],
+        'filter': ['FILTER', ],
+        'object': ['OBJECT', ],
+        }
+
+
+def _default_nthreads():
+    return min(32, cpu_count() * 4)
+
+
+def crawl(roots, reg_arch, nthreads=None):
+    """
+    Return the files in roots whose basenames match reg_arch
+
+    The directories are scanned concurrently with threads.
+
+    Returns
+    -------
+    entries: list
+        List of (path, stat, groupdict) of the matched files.
+    """
+    if nthreads is None:
+        nthreads = _default_nthreads()
+    reg_arch = re.compile(reg_arch)
+
+    def scan(path):
+        files = []
+        dirs = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=True):
+                        dirs.append(entry.path)
+                        continue
+                    m = re.match(reg_arch, entry.name)
+                    if m is not None:
+                        files.append((
+                            os.path.abspath(entry.path),
+                            entry.stat(follow_symlinks=True),
+                            m.groupdict()))
+        except OSError:
+            pass
+        return files, dirs
+
+    entries = []
+    visited = set()
+    with ThreadPoolExecutor(max_workers=nthreads) as executor:
+        pending = set()
+        for root in roots:
+            root = os.path.realpath(root)
+            if root not in visited:
+                visited.add(root)
+                pending.add(executor.submit(scan, root))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, dirs = future.result()
+                entries.extend(files)
+                for d in dirs:
+                    real = os.path.realpath(d)
+                    if real not in visited:
+                        visited.add(real)
+                        pending.add(executor.submit(scan, d))
+    return sorted(entries, key=lambda e: e[0])
+
+
+def _get_value(headers, keys, convert=None):
+    # return the first value that can be converted
+    for key in keys:
+        for header in headers:
+            if key not in header:
+                continue
+            if convert is None:
+                return header[key]
+            try:
+                return convert(header[key])
+            except (TypeError, ValueError):
+                continue
+    return None
+
+
+class ArchiveIndex(object):
+    """
+    The SQLite index of the archive
+
+    Parameters
+    ----------
+    dbfile: str
+        The database file. It is created if not exists.
+    """
+
+    def __init__(self, dbfile):
+        self.logger = logging.getLogger("archive_index")
+        self.dbfile = dbfile
+        self.conn = sqlite3.connect(dbfile)
+        self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS images ({})".format(
+                    ', '.join(' '.join(c) for c in COLUMNS)))
+        for cols in ['instru, band', 'obsid', 'mjd', 'dec']:
+            self.conn.execute(
+                    "CREATE INDEX IF NOT EXISTS images_{} ON images "
+                    "({})".format(cols.replace(', ', '_'), cols))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def update(self, roots, reg_arch, nthreads=None, prune=True):
+        """
+        Crawl roots and update the index
+
+        Parameters
+        ----------
+        roots: list
+            The directories of the archive.
+        reg_arch: str
+            The regex to parse the filenames in the archive.
+        nthreads: int, optional
+            The number of threads for crawling and reading headers.
+        prune: bool
+            If True, entries under roots that are no longer found are
+            removed.
+
+        Returns
+        -------
+        nnew, nremoved: int
+            The number of entries added or updated, and removed.
+        """
+        if nthreads is None:
+            nthreads = _default_nthreads()
+        entries = crawl(roots, reg_arch, nthreads=nthreads)
+        self.logger.info("{} files found in {}".format(
+            len(entries), ', '.join(roots)))
+        current = dict(
+                (path, (size, mtime)) for path, size, mtime in
+                self.conn.execute("SELECT path, size, mtime FROM images"))
+        todo = [
+                e for e in entries
+                if current.get(e[0], None) != (e[1].st_size, e[1].st_mtime_ns)
+                ]
+        # only images need the headers
+        with ThreadPoolExecutor(max_workers=nthreads) as executor:
+            headers = list(executor.map(
+                lambda e: try_read_headers(e[0])
+                if 'image' in (e[2].get('imflag') or '') else [],
+                todo))
+        rows = []
+        for (path, st, parsed), hdrs in zip(todo, headers):
+            if hdrs is None:
+                self.logger.warning("corrupted: {}".format(path))
+                continue
+            row = dict(
+                    path=path, size=st.st_size, mtime=st.st_mtime_ns,
+                    obsid=parsed.get('obsid'),
+                    imflag=(parsed.get('imflag') or '').rstrip('_'),
+                    instru=parsed.get('instru'),
+                    band=parsed.get('band'),
+                    object=parsed.get('object'))
+            for key, keys in HEADER_KEYS.items():
+                value = _get_value(
+                        hdrs, keys,
+                        convert=float if key in (
+                            'ra', 'dec', 'mjd', 'exptime') else None)
+                if value is not None:
+                    row[key] = value
+            rows.append(tuple(row.get(c[0], None) for c in COLUMNS))
+        self.conn.executemany(
+                "INSERT OR REPLACE INTO images VALUES ({})".format(
+                    ','.join('?' * len(COLUMNS))), rows)
+        nremoved = 0
+        if prune:
+            found = set(e[0] for e in entries)
+            prefixes = tuple(
+                    os.path.join(os.path.realpath(r), '') for r in roots)
+            stale = [
+                    (p, ) for p in current
+                    if p not in found and p.startswith(prefixes)]
+            self.conn.executemany("DELETE FROM images WHERE path = ?", stale)
+            nremoved = len(stale)
+        self.conn.commit()
+        return len(rows), nremoved
+
+    def query(self, instru=None, band=None, filter=None, object=None,
+              cone=None, mjd=None, companions=True):
+        """
+        Return the paths of the images that satisfy the conditions
+
+        Parameters
+        ----------
+        instru, band, object: str, optional
+            Match the values parsed from the filenames.
+        filter: str, optional
+            Match the FILTER header keyword, with SQL LIKE pattern.
+        cone: tuple, optional
+            (ra, dec, radius) in degree.
+        mjd: tuple, optional
+            (min, max) of the MJD. Either can be None.
+        companions: bool
+            If True, all files that have the same OBSID as the selected
+            images are returned as well.
+
+        Returns
+        -------
+        paths: list
+            The sorted paths.
+        """
+        where = ["imflag LIKE '%image%'"]
+        args = []
+        for col, value in [
+                ('instru', instru), ('band', band), ('object', object)]:
+            if value is not None:
+                where.append("{} = ?".format(col))
+                args.append(value)
+        if filter is not None:
+            where.append("filter LIKE ?")
+            args.append(filter)
+        if mjd is not None:
+            lo, hi = mjd
+            if lo is not None:
+                where.append("mjd >= ?")
+                args.append(lo)
+            if hi is not None:
+                where.append("mjd <= ?")
+                args.append(hi)
+        if cone is not None:
+            ra0, dec0, radius = cone
+            where.append("dec BETWEEN ? AND ?")
+            args.extend([dec0 - radius, dec0 + radius])
+        rows = self.conn.execute(
+                "SELECT path, obsid, ra, dec FROM images WHERE {}".format(
+                    ' AND '.join(where)), args).fetchall()
+        if cone is not None and rows:
+            ra, dec = np.radians(
+                    np.array([r[2:] for r in rows], dtype='d')).T
+            ra0, dec0 = np.radians(cone[:2])
+            cossep = np.sin(dec) * np.sin(dec0) + np.cos(dec) * np.cos(
+                    dec0) * np.cos(ra - ra0)
+            keep = cossep >= np.cos(np.radians(cone[2]))
+            rows = [r for r, k in zip(rows, keep) if k]
+        paths = set(r[0] for r in rows)
+        if companions:
+            obsids = sorted(set(r[1] for r in rows))
+            for i in range(0, len(obsids), 500):
+                chunk = obsids[i:i + 500]
+                paths.update(p for p, in self.conn.execute(
+                    "SELECT path FROM images WHERE obsid IN ({})".format(
+                        ','.join('?' * len(chunk))), chunk))
+        return sorted(paths)
+
+
+def parse_query(terms):
+    """
+    Parse the list of "key=value" query terms into keyword arguments of
+    `ArchiveIndex.query`
+
+    cone takes "ra,dec,radius" and mjd takes "min,max", in which either of
+    min and max can be empty.
+    """
+    kwargs = {}
+    for term in terms:
+        key, sep, value = term.partition('=')
+        key = key.strip().lower()
+        if not sep or not value:
+            raise ValueError("invalid query term {}".format(term))
+        if key == 'cone':
+            cone = tuple(map(float, value.split(',')))
+            if len(cone) != 3:
+                raise ValueError("cone requires ra,dec,radius")
+            kwargs['cone'] = cone
+        elif key == 'mjd':
+            lo, _, hi = value.partition(',')
+            kwargs['mjd'] = tuple(
+                    float(v) if v.strip() else None for v in (lo, hi))
+        elif key in ('instru', 'band', 'filter', 'object'):
+            kwargs[key] = value
+        else:
+            raise ValueError("unknown query key {}".format(key))
+    return kwargs
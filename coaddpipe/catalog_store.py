@@ -0,0 +1,417 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 20:10
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+catalog_store.py
+
+A HEALPix partitioned store of the coadd catalogs, for cone, box and
+band-merged queries across fields.
+
+The sources of each catalog are split by the HEALPix pixels in the
+NESTED scheme, and each part is written as a column-addressable ``.npz``
+chunk to ``hpx<order>/<pix>/<catalog>.npz`` in the store dir. The
+chunks and their bounding caps are indexed in ``catalog_store.sqlite``,
+so a query only reads the chunks that overlap the region, and only the
+columns requested.
+
+Catalogs are ingested incrementally. A catalog that has changed since it
+was ingested replaces all of its chunks.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+import os
+import re
+import sqlite3
+import logging
+
+import numpy as np
+
+from .apus.common import get_log_func
+
+
+CATALOG_STORE_INDEX = 'catalog_store.sqlite'
+
+DEFAULT_ORDER = 6  # nside 64, pixels of ~0.9 deg
+
+RA_COL, DEC_COL = 'ALPHA_J2000', 'DELTA_J2000'
+
+MERGE_COLUMNS = ('MAG_AUTO', 'MAGERR_AUTO')
+
+
+def ang2pix_nest(order, ra, dec):
+    """
+    Return the HEALPix pixel indices in the NESTED scheme
+
+    Parameters
+    ----------
+    order: int
+        The HEALPix order, i.e., nside = 2 ** order.
+    ra, dec: array
+        The coordinates in degree.
+    """
+    nside = 1 << order
+    ra = np.atleast_1d(np.asarray(ra, dtype='d'))
+    dec = np.atleast_1d(np.asarray(dec, dtype='d'))
+    z = np.sin(np.radians(dec))
+    za = np.abs(z)
+    tt = np.mod(np.radians(ra), 2. * np.pi) / (0.5 * np.pi)
+    tt = np.where(tt >= 4., 0., tt)
+    face = np.empty(ra.shape, dtype='i8')
+    ix = np.empty(ra.shape, dtype='i8')
+    iy = np.empty(ra.shape, dtype='i8')
+    # equatorial region
+    eq = za <= 2. / 3.
+    t1 = nside * (0.5 + tt[eq])
+    t2 = nside * z[eq] * 0.75
+    jp = (t1 - t2).astype('i8')
+    jm = (t1 + t2).astype('i8')
+    ifp, ifm = jp >> order, jm >> order
+    face[eq] = np.where(
+            ifp == ifm, ifp | 4, np.where(ifp < ifm, ifp, ifm + 8))
+    ix[eq] = jm & (nside - 1)
+    iy[eq] = nside - (jp & (nside - 1)) - 1
+    # polar caps
+    po = ~eq
+    ntt = np.minimum(3, tt[po].astype('i8'))
+    tp = tt[po] - ntt
+    tmp = nside * np.sqrt(3. * (1. - za[po]))
+    jp = np.minimum((tp * tmp).astype('i8'), nside - 1)
+    jm = np.minimum(((1. - tp) * tmp).astype('i8'), nside - 1)
+    north = z[po] >= 0
+    face[po] = np.where(north, ntt, ntt + 8)
+    ix[po] = np.where(north, nside - jm - 1, jp)
+    iy[po] = np.where(north, nside - jp - 1, jm)
+    # interleave the bits of ix and iy
+    pix = np.zeros(ra.shape, dtype='i8')
+    for b in range(order):
+        pix |= ((ix >> b) & 1) << (2 * b)
+        pix |= ((iy >> b) & 1) << (2 * b + 1)
+    return face * nside * nside + pix
+
+
+def _unit_vector(ra, dec):
+    ra, dec = np.radians(ra), np.radians(dec)
+    return np.stack([
+        np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)],
+        axis=-1)
+
+
+def _bounding_cap(xyz):
+    """Return the center unit vector and the radius in degree of the cap
+    that encloses the unit vectors"""
+    center = xyz.mean(axis=0)
+    center /= np.linalg.norm(center)
+    cossep = np.clip(xyz.dot(center), -1., 1.)
+    return center, float(np.degrees(np.arccos(cossep.min())))
+
+
+def get_chunk_path(rootdir, order, pix, name):
+    """Return the path of the chunk of catalog name in pixel pix"""
+    return os.path.join(
+            rootdir, 'hpx{}'.format(order), str(pix),
+            "{}.npz".format(name.replace(os.sep, '__')))
+
+
+def get_catalog_name(path):
+    """Return the name of the catalog in the store, which is the catalog
+    filename without extension, prefixed by the name of its jobdir"""
+    dirname, basename = os.path.split(os.path.abspath(path))
+    return "{}/{}".format(os.path.basename(dirname), basename.split('.')[0])
+
+
+class CatalogStore(object):
+    """
+    The HEALPix partitioned catalog store
+
+    Parameters
+    ----------
+    rootdir: str
+        The store dir. It is created if not exists.
+    order: int
+        The HEALPix order of the partitions. It is fixed when the store is
+        created.
+    """
+
+    def __init__(self, rootdir, order=DEFAULT_ORDER):
+        self.logger = logging.getLogger("catalog_store")
+        self.rootdir = rootdir
+        if not os.path.isdir(rootdir):
+            os.makedirs(rootdir, exist_ok=True)
+        self.conn = sqlite3.connect(
+                os.path.join(rootdir, CATALOG_STORE_INDEX), timeout=60)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS catalogs (
+                name TEXT PRIMARY KEY, path TEXT, size INTEGER,
+                mtime INTEGER, band TEXT, nrows INTEGER);
+            CREATE TABLE IF NOT EXISTS chunks (
+                name TEXT, pix INTEGER, nrows INTEGER,
+                x REAL, y REAL, z REAL, radius REAL,
+                PRIMARY KEY (name, pix));
+            CREATE INDEX IF NOT EXISTS chunks_pix ON chunks (pix);
+            """)
+        self.conn.execute(
+                "INSERT OR IGNORE INTO meta VALUES ('order', ?)",
+                (str(order), ))
+        self.conn.commit()
+        self.order = int(self.conn.execute(
+            "SELECT value FROM meta WHERE key = 'order'").fetchone()[0])
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.conn.execute(
+                "SELECT COALESCE(SUM(nrows), 0) FROM catalogs").fetchone()[0]
+
+    @property
+    def bands(self):
+        return [b for b, in self.conn.execute(
+            "SELECT DISTINCT band FROM catalogs ORDER BY band")]
+
+    def ingest(self, cat_files, reg_mosaic, force=False):
+        """
+        Ingest the catalogs that are new or changed
+
+        Parameters
+        ----------
+        cat_files: list
+            The ASCII catalogs with commented header, e.g., the output of
+            the "get msccat" task.
+        reg_mosaic: str
+            The regex to parse the band from the catalog filenames.
+        force: bool
+            If True, the catalogs are ingested even if not changed.
+
+        Returns
+        -------
+        names: list
+            The names of the ingested catalogs.
+        """
+        from astropy.table import Table
+        current = dict(
+                (name, (size, mtime)) for name, size, mtime in
+                self.conn.execute("SELECT name, size, mtime FROM catalogs"))
+        names = []
+        for path in cat_files:
+            name = get_catalog_name(path)
+            st = os.stat(path)
+            if not force and current.get(name, None) == (
+                    st.st_size, st.st_mtime_ns):
+                continue
+            band = re.match(
+                    reg_mosaic, os.path.basename(path)).group('band')
+            tbl = Table.read(path, format='ascii.commented_header')
+            self._write_catalog(name, path, st, band, tbl)
+            names.append(name)
+            self.logger.info("ingest {} sources of band {} from {}".format(
+                len(tbl), band, path))
+        return names
+
+    def _write_catalog(self, name, path, st, band, tbl):
+        columns = {
+                c: np.asarray(tbl[c]) for c in tbl.colnames
+                if tbl[c].dtype.kind in 'biuf'}
+        ra, dec = columns[RA_COL], columns[DEC_COL]
+        pix = ang2pix_nest(self.order, ra, dec)
+        xyz = _unit_vector(ra, dec)
+        order = np.argsort(pix, kind='stable')
+        upix, starts = np.unique(pix[order], return_index=True)
+        old = set(p for p, in self.conn.execute(
+            "SELECT pix FROM chunks WHERE name = ?", (name, )))
+        rows = []
+        for p, idx in zip(upix, np.split(order, starts[1:])):
+            chunk_path = get_chunk_path(self.rootdir, self.order, p, name)
+            if not os.path.isdir(os.path.dirname(chunk_path)):
+                os.makedirs(os.path.dirname(chunk_path), exist_ok=True)
+            tmpname = "{}.{}.tmp.npz".format(chunk_path[:-4], os.getpid())
+            np.savez(tmpname, **{c: v[idx] for c, v in columns.items()})
+            os.rename(tmpname, chunk_path)
+            center, radius = _bounding_cap(xyz[idx])
+            rows.append((name, int(p), len(idx)) + tuple(center) + (radius, ))
+        for p in old - set(int(p) for p in upix):
+            os.remove(get_chunk_path(self.rootdir, self.order, p, name))
+        with self.conn:
+            self.conn.execute("DELETE FROM chunks WHERE name = ?", (name, ))
+            self.conn.executemany(
+                    "INSERT INTO chunks VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self.conn.execute(
+                    "INSERT OR REPLACE INTO catalogs VALUES "
+                    "(?, ?, ?, ?, ?, ?)",
+                    (name, os.path.abspath(path), st.st_size,
+                     st.st_mtime_ns, band, len(tbl)))
+
+    def _select_chunks(self, xyz0, radius, bands=None):
+        """Return (name, band, pix) of the chunks whose caps overlap the
+        cap at unit vector xyz0 of radius in degree"""
+        sql = ("SELECT c.name, g.band, c.pix, c.x, c.y, c.z, c.radius "
+               "FROM chunks c JOIN catalogs g ON c.name = g.name")
+        args = []
+        if bands is not None:
+            sql += " WHERE g.band IN ({})".format(','.join('?' * len(bands)))
+            args.extend(bands)
+        rows = self.conn.execute(sql + " ORDER BY c.name, c.pix", args
+                                 ).fetchall()
+        if not rows:
+            return []
+        xyz = np.array([r[3:6] for r in rows], dtype='d')
+        sep = np.degrees(np.arccos(np.clip(xyz.dot(xyz0), -1., 1.)))
+        keep = sep <= radius + np.array([r[6] for r in rows]) + 1e-9
+        return [r[:3] for r, k in zip(rows, keep) if k]
+
+    def _read(self, chunks, columns, select):
+        from astropy.table import Table
+        parts = []
+        for name, band, pix in chunks:
+            with np.load(get_chunk_path(
+                    self.rootdir, self.order, pix, name)) as npz:
+                ra, dec = npz[RA_COL], npz[DEC_COL]
+                m = select(ra, dec)
+                if not m.any():
+                    continue
+                cols = columns if columns is not None else [
+                        c for c in npz.files if c not in (RA_COL, DEC_COL)]
+                part = Table()
+                part['ra'] = ra[m]
+                part['dec'] = dec[m]
+                part['band'] = np.full(m.sum(), band)
+                part['catalog'] = np.full(m.sum(), name)
+                for c in cols:
+                    part[c] = npz[c][m]
+                parts.append(part)
+        if not parts:
+            return Table(names=['ra', 'dec', 'band', 'catalog'],
+                         dtype=['f8', 'f8', 'U1', 'U1'])
+        if len(parts) == 1:
+            return parts[0]
+        from astropy.table import vstack
+        return vstack(parts, join_type='outer')
+
+    def cone(self, ra, dec, radius, bands=None, columns=None):
+        """
+        Return the sources within radius in degree of (ra, dec)
+
+        Parameters
+        ----------
+        bands: list, optional
+            The bands to return. All bands are returned if None.
+        columns: list, optional
+            The catalog columns to return. All columns are returned if
+            None.
+
+        Returns
+        -------
+        tbl: `~astropy.table.Table`
+            The sources with columns ra, dec, band, catalog and the
+            requested columns.
+        """
+        xyz0 = _unit_vector(ra, dec)
+        cosrad = np.cos(np.radians(radius))
+        return self._read(
+                self._select_chunks(xyz0, radius, bands=bands), columns,
+                lambda r, d: _unit_vector(r, d).dot(xyz0) >= cosrad)
+
+    def box(self, ra_min, ra_max, dec_min, dec_max, bands=None,
+            columns=None):
+        """
+        Return the sources in the box of ra and dec, in degree
+
+        The box wraps around RA 0 if ra_min is larger than ra_max. See
+        `cone` for the other parameters.
+        """
+        span = (ra_max - ra_min) % 360.
+        ra_c = ra_min + span / 2.
+        dec_c = (dec_min + dec_max) / 2.
+        xyz0 = _unit_vector(ra_c, dec_c)
+        corners = _unit_vector(
+                np.array([ra_min, ra_min, ra_max, ra_max, ra_c, ra_c]),
+                np.array([dec_min, dec_max, dec_min, dec_max,
+                          dec_min, dec_max]))
+        radius = np.degrees(np.arccos(np.clip(
+            corners.dot(xyz0), -1., 1.))).max()
+        if span > 180.:
+            radius = 180.
+
+        def select(r, d):
+            return ((r - ra_min) % 360. <= span) & (
+                    d >= dec_min) & (d <= dec_max)
+        return self._read(
+                self._select_chunks(xyz0, radius, bands=bands), columns,
+                select)
+
+    def merged(self, ra, dec, radius, bands=None, columns=MERGE_COLUMNS,
+               match_radius=1.):
+        """
+        Return the sources within the cone merged across bands
+
+        The detections are matched to the objects within match_radius in
+        arcsec, band by band. Each object takes at most one detection of
+        each band, the closest, and the unmatched detections become new
+        objects.
+
+        Returns
+        -------
+        tbl: `~astropy.table.Table`
+            The objects with columns ra, dec and ``<column>_<band>`` of
+            the requested columns, which are NaN if not detected.
+        """
+        from scipy.spatial import cKDTree
+        from astropy.table import Table
+        if bands is None:
+            bands = self.bands
+        tbl = self.cone(ra, dec, radius, bands=bands, columns=columns)
+        chord = 2. * np.sin(np.radians(match_radius / 3600.) / 2.)
+        pos = np.empty((0, 3), dtype='d')
+        values = {}
+        for band in bands:
+            sub = tbl[tbl['band'] == band]
+            xyz = _unit_vector(np.asarray(sub['ra']), np.asarray(sub['dec']))
+            ind = np.full(len(sub), -1, dtype='i8')
+            if len(pos) and len(sub):
+                dist, i = cKDTree(pos).query(xyz, distance_upper_bound=chord)
+                # each object takes the closest detection
+                taken = set()
+                for j in np.argsort(dist, kind='stable'):
+                    if not np.isfinite(dist[j]):
+                        break
+                    if i[j] not in taken:
+                        ind[j] = i[j]
+                        taken.add(i[j])
+            new = ind < 0
+            ind[new] = len(pos) + np.arange(new.sum())
+            pos = np.concatenate([pos, xyz[new]])
+            for c in columns:
+                v = np.full(len(pos), np.nan)
+                v[ind] = np.asarray(sub[c], dtype='d')
+                values[(c, band)] = v
+        out = Table()
+        out['ra'] = np.mod(np.degrees(np.arctan2(pos[:, 1], pos[:, 0])), 360.)
+        out['dec'] = np.degrees(np.arcsin(np.clip(pos[:, 2], -1., 1.)))
+        for band in bands:
+            for c in columns:
+                v = values[(c, band)]
+                out['{}_{}'.format(c, band)] = np.concatenate([
+                    v, np.full(len(pos) - len(v), np.nan)])
+        return out
+
+
+def ingest_task(*args, **kwargs):
+    """Ingest the catalog to the store in kwargs and write the ingested
+    catalog name to out_file"""
+    cat_file, out_file = args
+    log = get_log_func(default_level='debug', **kwargs)
+    with CatalogStore(kwargs['catalog_store']) as store:
+        store.ingest([cat_file], kwargs['reg_mosaic'])
+        log("{} sources in catalog store {}".format(
+            len(store), kwargs['catalog_store']))
+    with open(out_file, 'w') as fo:
+        fo.write("{}\n".format(get_catalog_name(cat_file)))
@@ -16,23 +16,25 @@ import logging
 from datetime import datetime
 import shutil
 from shutilwhich import which
-from astropy.io.misc import yaml
-from astropy.io import fits
-from astropy.table import Table, Column, unique
-from multiprocessing import Pool, cpu_count
-from functools import partial
 from io import StringIO
 
-
-from . import qa
-from . import pipeline
-from .apus import core as apuscore
+# astropy, the pipeline and apus (ruffus) are imported in the functions
+# that need them, to keep the command line interface fast to start
 from .apus.common import touch_file
+from .header_index import HeaderIndex
+from .archive_index import ArchiveIndex, parse_query
+from .jobdir_layout import write_jobdir_layout
+from .qa_queue import QA_MODES
 
 
 APP_NAME = 'CoaddPipe'
 EXEC_NAME = APP_NAME.lower()
 DEFAULT_CONFIG_FILE = 'coaddpipe.yaml'
+HEADER_INDEX_FILE = 'header_index.sqlite'
+ARCHIVE_INDEX_FILE = 'archive_index.sqlite'
+PRODUCTS_REGISTRY_FILE = 'products.sqlite'
+MANIFEST_FILE = 'manifest.sqlite'
+DURATIONS_FILE = 'durations.sqlite'
 
 
 def setup_workdir(workdir=".", overwrite_dir=False, backup_config=True):
@@ -257,6 +259,15 @@ fmt_grp: '{{ppflag}}{{grpid}}_{{imflag}}_{base_fmt:s}.fits'
 
 # environ
 workdir: {workdir}
+jobdir_layout: flat  # flat or sharded, for the previews and sidecars
+qa_mode: deferred  # inline, deferred or off, for the QA plots
+qa_pyramid: []  # binnings of the tiled previews, e.g., [1, 4, 16, 64]
+catalog_store: null  # dir of the HEALPix store of the coadd catalogs
+uptodate_check: hash  # hash or mtime, to decide whether to rebuild
+task_cache: null  # dir of the task outputs cache shared by the jobs
+task_cache_size: 50  # GiB, least recently used outputs are evicted
+resources: {{}}  # node budget of cpus, memory (MB) and io, default to node
+work_queue: null  # file of the queue of the jobs run by coaddpipe workers
 tmpdir: {tmpdir}
 logdir: {logdir}
 astromatic_prefix: {astromatic_prefix}
@@ -322,41 +333,124 @@ funpack_cmd: {funpack_cmd}
         fo.write(config)
 
 
-def _qa_worker(image, config):
-    """Create a QA summary for given input image"""
-    headers = config['qa_headers']
+def _qa_worker(image, config, headers=None):
+    """Create a QA summary for given input image
+
+    headers are the [primary, first extension] header dicts of the
+    image, as returned by `~coaddpipe.header_index.HeaderIndex`. The
+    image is opened when they are not given.
+    """
+    from astropy.io import fits
+    qa_headers = config['qa_headers']
     values = []
-    try:
+    if headers is None:
         with fits.open(image, memmap=True) as hdulist:
-            instru = hdulist[0].header['INSTRUME'].lower()
-            for key in headers[instru]:
-                try:
-                    val = hdulist[0].header[key]
-                except KeyError:
-                    val = hdulist[1].header[key]
-                except KeyError:
-                    val = ""
-                if key == "OBJECT":
-                    # escape name
-                    val = re.sub(r'\s+', '_', val.strip())
-                values.append(val)
-            # QA image
-            # preview = qa.create_preview(hdulist=hdulist)
-            # preview.save()
-            # mask guide ota
-            # values.insert(0, ','.join(map(str, preview.mask_chips)))
-            values.insert(0, ','.join(map(str, [])))
-            # append filename
-            values.append(image)
-        keys = ['mask_chips', ] + headers[instru] + ['filename', ]
-        return keys, values
-    except Exception as e:
-        raise e
+            headers = [hdu.header for hdu in hdulist[:2]]
+    if not headers:
         return None, None
+    instru = headers[0]['INSTRUME'].lower()
+    for key in qa_headers[instru]:
+        for header in headers:
+            if key in header:
+                val = header[key]
+                break
+        else:
+            val = ""
+        if key == "OBJECT":
+            # escape name
+            val = re.sub(r'\s+', '_', val.strip())
+        values.append(val)
+    # QA image
+    # preview = qa.create_preview(hdulist=hdulist)
+    # preview.save()
+    # mask guide ota
+    # values.insert(0, ','.join(map(str, preview.mask_chips)))
+    values.insert(0, ','.join(map(str, [])))
+    # append filename
+    values.append(image)
+    keys = ['mask_chips', ] + qa_headers[instru] + ['filename', ]
+    return keys, values
+
+
+GROUP_KEYS = [
+        ('fcomb', "FILTER"), ('fsub', 'FILTER'),
+        ('phot', 'FILTER'),
+        ('mosaic', 'OBJECT')]
+
+
+def assign_groups(qa_tbl, existing=None):
+    """Prepend the group columns to qa_tbl
+
+    The group ids are the indices of the unique values of the group keys.
+    If `existing` job table is given, keys found in it get the group id
+    most commonly assigned to them there, and new keys are given new
+    group ids.
+    """
+    from astropy.table import Column, unique
+    for i, (group, group_key) in enumerate(GROUP_KEYS):
+        colname = group + "_group"
+        keys = [str(k) for k in qa_tbl[group_key]]
+        if existing is None:
+            unique_keys = list(unique(qa_tbl[[group_key]])[group_key])
+            unique_keys = [str(k) for k in unique_keys]
+            col = Column([unique_keys.index(k) for k in keys])
+        else:
+            votes = {}
+            for k, g in zip(existing[group_key], existing[colname]):
+                votes.setdefault(str(k), []).append(int(g))
+            key_groups = {
+                    k: max(sorted(set(v)), key=v.count)
+                    for k, v in votes.items()}
+            next_group = max(
+                    [int(g) for g in existing[colname]] + [-1]) + 1
+            col = []
+            for k in keys:
+                if k not in key_groups:
+                    key_groups[k] = next_group
+                    next_group += 1
+                col.append(key_groups[k])
+            col = Column(col, dtype=int)
+        qa_tbl.add_column(col, index=i + 1, name=colname)  # after numid
+    return qa_tbl
+
+
+def read_job_table(jobfile):
+    """Read the job table with all columns as strings"""
+    from astropy.table import Table, Column
+    tbl = Table.read(jobfile, format='ascii.commented_header')
+    cols = []
+    for c in tbl.colnames:
+        col = tbl[c]
+        mask = getattr(col, 'mask', None)
+        if mask is None:
+            mask = [False] * len(col)
+        cols.append(Column(
+            ["" if m else str(v) for v, m in zip(col, mask)], name=c,
+            dtype=str))
+    return Table(cols)
+
+
+def write_job_table(tbl, filename):
+    """Write the job table in the format that can be edited by user"""
+
+    def quote(x):
+        x = str(x)
+        if ' ' in x or x == "":
+            return "\"{}\"".format(x)
+        else:
+            return x
+    _fo = StringIO()
+    tbl.write(_fo, format='ascii.fixed_width', delimiter=" ",
+              formats={c: quote for c in tbl.colnames})
+    with open(filename, 'w') as fo:
+        fo.write('#' + _fo.getvalue()[1:])
 
 
 def init_job(config_file, jobkey, images,
-             overwrite_dir=False, backup_jobfile=True, dirs_only=False):
+             overwrite_dir=False, backup_jobfile=True, dirs_only=False,
+             append=False):
+    from astropy.io.misc import yaml
+    from astropy.table import Table, Column, vstack
     logger = logging.getLogger(jobkey + ".init")
 
     # load config file
@@ -372,8 +466,18 @@ def init_job(config_file, jobkey, images,
     # create or get input dir
     workdir = config['workdir']
     jindir = os.path.join(workdir, jobkey + ".in")
+    jobfile = os.path.join(workdir, '{}.txt'.format(jobkey))
     logger.info("initialize inputs of job {}".format(jobkey))
-    if os.path.exists(jindir):
+    if append:
+        if not os.path.exists(jobfile):
+            raise RuntimeError(
+                "job file {} does not exist. Run init without --append "
+                "first".format(jobfile))
+        if not os.path.exists(jindir):
+            os.makedirs(jindir)
+            logger.info("create job inputs dir {}".format(jindir))
+        logger.info("append to job {}".format(jobfile))
+    elif os.path.exists(jindir):
         if overwrite_dir:
             logger.warning("overwrite existing job inputs dir {}".format(
                 jindir))
@@ -386,21 +490,29 @@ def init_job(config_file, jobkey, images,
         logger.info("create job inputs dir {}".format(jindir))
 
     if not dirs_only:
-        # purge any existing good links that matches the linked name regex
-        reg_orig = re.compile(config['reg_orig'])
-        for filename in os.listdir(jindir):
-            filename = os.path.join(jindir, filename)
-            if os.path.islink(filename) and re.match(
-                    reg_orig, os.path.basename(filename)):
-                logger.warning("x {}".format(filename))
-                os.unlink(filename)
-                # remove preview files if any
-                previewname = filename.rsplit(".fz", 1)[0].rsplit(
-                        ".fits", 1)[0] + '.png'
-                if os.path.exists(previewname) and not os.path.islink(
-                        previewname):
-                    logger.warning("x {}".format(previewname))
-                    os.remove(previewname)
+        if append:
+            job_tbl = read_job_table(jobfile)
+            job_files = set(
+                    os.path.realpath(f) for f in job_tbl['filename'])
+        else:
+            job_tbl = None
+            job_files = set()
+            # purge any existing good links that matches the linked name
+            # regex
+            reg_orig = re.compile(config['reg_orig'])
+            for filename in os.listdir(jindir):
+                filename = os.path.join(jindir, filename)
+                if os.path.islink(filename) and re.match(
+                        reg_orig, os.path.basename(filename)):
+                    logger.warning("x {}".format(filename))
+                    os.unlink(filename)
+                    # remove preview files if any
+                    previewname = filename.rsplit(".fz", 1)[0].rsplit(
+                            ".fits", 1)[0] + '.png'
+                    if os.path.exists(previewname) and not os.path.islink(
+                            previewname):
+                        logger.warning("x {}".format(previewname))
+                        os.remove(previewname)
 
         # link over to job-in dir
         reg_arch = re.compile(config['reg_arch'])
@@ -415,8 +527,18 @@ def init_job(config_file, jobkey, images,
             parsed_filename = parsed_filename.groupdict()
             linkname = config['fmt_orig'].format(**parsed_filename)
             link = os.path.join(jindir, linkname)
-            logger.info("{} -> {}".format(imagebase, link))
-            os.symlink(os.path.abspath(image), link)
+            if append and os.path.lexists(link):
+                if os.path.realpath(link) != os.path.realpath(image):
+                    logger.warning(
+                        "skip {}, {} exists and links to another "
+                        "file".format(image, link))
+                    continue
+                if os.path.realpath(link) in job_files:
+                    logger.debug("skip existing {}".format(image))
+                    continue
+            else:
+                logger.info("{} -> {}".format(imagebase, link))
+                os.symlink(os.path.abspath(image), link)
             linked.append(link)  # update to the link path
             parsed_filenames.append(parsed_filename)
         images = linked
@@ -425,58 +547,58 @@ def init_job(config_file, jobkey, images,
         # run QA
         qa_images = [
                 i for i, p in zip(images, parsed_filenames)
-                if 'image' in p['imflag']]
-        # pool = Pool(1)
-        pool = Pool(cpu_count())
-        qa_rets = pool.map_async(
-                partial(_qa_worker,  config=config),
-                qa_images).get(9999999)
-        # qa_rets = []
-        # for image in qa_images:
-        #     qa_rets.append(_qa_worker(image, config=config))
+                if 'image' in p['imflag'] and
+                os.path.realpath(i) not in job_files]
+        if append and not qa_images:
+            logger.warning("no new input images to append")
+            return
+        # the headers are read from the header index in workdir
+        with HeaderIndex(os.path.join(
+                workdir, HEADER_INDEX_FILE)) as index:
+            qa_headers = index.get_headers(qa_images)
+        qa_rets = [
+                _qa_worker(image, config, headers=headers)
+                for image, headers in zip(qa_images, qa_headers)]
         qa_keys = []
         qa_vals = []
         for i, (k, v) in enumerate(qa_rets):
             if k is None:
-                logger.warning("corrupted: {}".format(images[i]))
+                logger.warning("corrupted: {}".format(qa_images[i]))
             else:
                 qa_keys.append(k)
                 qa_vals.append(v)
+        if not qa_keys:
+            raise RuntimeError(
+                "no valid input images to initialize job {}".format(jobkey))
         # tabulate QA results
         qa_tbl = Table(
                 rows=qa_vals, names=qa_keys[0],
                 )
         # prepend grouping table
-        qa_tbl.add_column(Column(range(len(qa_tbl)), name='numid'), index=0)
-        for i, (group, group_key) in enumerate([
-                ('fcomb', "FILTER"), ('fsub', 'FILTER'),
-                ('phot', 'FILTER'),
-                ('mosaic', 'OBJECT')]):
-            colname = group + "_group"
-            keys = qa_tbl[group_key]
-            unique_keys = list(unique(qa_tbl[[group_key]])[group_key])
-            col = Column([unique_keys.index(k) for k in keys])
-            qa_tbl.add_column(col, index=i + 1, name=colname)  # after numid
+        if job_tbl is None:
+            numid0 = 0
+        else:
+            numid0 = max([int(i) for i in job_tbl['numid']] + [-1]) + 1
+        qa_tbl.add_column(Column(
+            range(numid0, numid0 + len(qa_tbl)), name='numid'), index=0)
+        qa_tbl = assign_groups(qa_tbl, existing=job_tbl)
+        if job_tbl is not None:
+            logger.info("summary of appended input images\n{}".format(
+                "\n".join(qa_tbl.pformat(max_lines=-1, max_width=-1))))
+            qa_tbl = Table(
+                    [Column([str(v) for v in qa_tbl[c]], name=c, dtype=str)
+                     for c in qa_tbl.colnames])
+            # the columns missing in either table, e.g., those added to
+            # the job file by the user, are left empty
+            qa_tbl = vstack(
+                    [job_tbl, qa_tbl], join_type='outer').filled('')
 
         logger.info("summary of input images\n{}".format(
             "\n".join(qa_tbl.pformat(max_lines=-1, max_width=-1))))
         # save the table
         tblname = os.path.join(jindir, '{}.txt.in'.format(jobkey))
-
-        def quote(x):
-            x = str(x)
-            if ' ' in x or x == "":
-                return "\"{}\"".format(x)
-            else:
-                return x
-        _fo = StringIO()
-        qa_tbl.write(_fo, format='ascii.fixed_width', delimiter=" ",
-                     formats={c: quote for c in qa_tbl.colnames})
-        with open(tblname, 'w') as fo:
-            fo.write('#' + _fo.getvalue()[1:])
+        write_job_table(qa_tbl, tblname)
         # copy table to work_dir for the next step
-        jobfile = os.path.join(workdir, '{}.txt'.format(jobkey))
-
         if os.path.exists(jobfile):
             if backup_jobfile:
                 time_fmt = "%b-%d-%Y_%H-%M-%S"
@@ -534,17 +656,133 @@ details.""")
     # jobconfig =
 
 
-def run_pipeline(config_file, jobfile, apus_args=None):
+def _load_config(config_file, logger):
+    # the astropy loader imports astropy.coordinates and astropy.table,
+    # so it is only used for the configs that have the astropy tags
+    import yaml
+    with open(config_file, 'r') as fo:
+        logger.info("use config file {}".format(config_file))
+        try:
+            config = yaml.safe_load(fo)
+        except yaml.constructor.ConstructorError:
+            from astropy.io.misc import yaml as astropy_yaml
+            fo.seek(0)
+            config = astropy_yaml.load(fo)
+    return config
+
+
+def index_archive(config_file, roots, prune=True):
+    """
+    Build or update the archive index in workdir from the files in roots
+    """
+    logger = logging.getLogger("index")
+    config = _load_config(config_file, logger)
+    dbfile = os.path.join(config['workdir'], ARCHIVE_INDEX_FILE)
+    with ArchiveIndex(dbfile) as index:
+        nnew, nremoved = index.update(
+                [os.path.abspath(r) for r in roots], config['reg_arch'],
+                prune=prune)
+        logger.info(
+            "{} entries updated, {} removed, {} entries in {}".format(
+                nnew, nremoved, len(index), dbfile))
+
+
+def query_archive(config_file, terms):
+    """
+    Return the files in the archive index that match the query terms
+    """
+    logger = logging.getLogger("query")
+    config = _load_config(config_file, logger)
+    dbfile = os.path.join(config['workdir'], ARCHIVE_INDEX_FILE)
+    if not os.path.exists(dbfile):
+        raise RuntimeError(
+            "no archive index found in workdir. Run `{} index` first".format(
+                EXEC_NAME))
+    with ArchiveIndex(dbfile) as index:
+        paths = index.query(**parse_query(terms))
+    logger.info("{} files selected by query {}".format(
+        len(paths), ' '.join(terms)))
+    return paths
+
+
+def serve_cutouts(config_file, jobfiles=None, host='127.0.0.1', port=8800,
+                  cache_size=256):
+    """
+    Serve the cutouts of the products in the jobdirs of jobfiles, or of
+    all the jobdirs in workdir if no jobfile is given
+    """
+    from .cutout import (
+            scan_products, ProductIndex, TileCache, CutoutService,
+            CutoutServer)
+    logger = logging.getLogger("serve")
+    config = _load_config(config_file, logger)
+    workdir = config['workdir']
+    if jobfiles:
+        dirs = [os.path.join(
+            workdir, os.path.splitext(os.path.basename(f))[0])
+            for f in jobfiles]
+    else:
+        dirs = sorted(
+                os.path.join(workdir, d) for d in os.listdir(workdir)
+                if os.path.isdir(os.path.join(workdir, d)))
+    dirs = [d for d in dirs if os.path.isdir(d)]
+    index = ProductIndex(scan_products(
+        dirs, config['reg_mosaic_fits'], config['reg_inputs']))
+    logger.info("{} products indexed in {} dirs".format(len(index), len(dirs)))
+    service = CutoutService(index, cache=TileCache(maxsize=cache_size))
+    server = CutoutServer((host, port), service)
+    logger.info("serve cutouts at http://{}:{}/cutout".format(
+        *server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("stop serving")
+    finally:
+        server.server_close()
+        service.cache.close()
+
+
+def run_worker(config_file, nworkers=1, max_idle=None):
+    """
+    Run nworkers processes to claim and run the jobs of the work queue
+    in workdir, until idle for max_idle seconds
+    """
+    import multiprocessing
+    from .apus.workqueue import WorkQueue, work
+    logger = logging.getLogger("worker")
+    config = _load_config(config_file, logger)
+    if not config.get('work_queue', None):
+        raise ValueError("no work_queue specified in {}".format(config_file))
+    queue = WorkQueue(os.path.join(config['workdir'], config['work_queue']))
+    logger.info("work on queue {} with {} workers".format(
+        queue.dbfile, nworkers))
+    kwargs = dict(max_idle=max_idle, logger=logger)
+    if nworkers == 1:
+        njobs = work(queue, **kwargs)
+        logger.info("{} jobs done".format(njobs))
+        return
+    workers = [multiprocessing.Process(
+                target=work, args=(queue, ), kwargs=kwargs)
+               for _ in range(nworkers)]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+    logger.info("jobs in queue: {}".format(queue.counts()))
+
+
+def run_pipeline(config_file, jobfile, apus_args=None, qa_mode=None):
+    from . import pipeline
     jobkey = os.path.splitext(os.path.basename(jobfile))[0]
     logger = logging.getLogger(jobkey)
     logger.info("run pipeline {}".format(jobkey))
 
     # load config file
-    with open(config_file, 'r') as fo:
-        logger.info("use config file {}".format(config_file))
-        # logger.info("\n\n{}\n".format(fo.read()))
-        fo.seek(0)
-        config = yaml.load(fo)
+    config = _load_config(config_file, logger)
 
     # create jobdir
     workdir = config['workdir']
@@ -557,10 +795,40 @@ def run_pipeline(config_file, jobfile, apus_args=None):
 
     config['jobdir'] = jobdir
     config['jobfile'] = jobfile
+    layout = config.get('jobdir_layout', 'flat')
+    if layout not in ('flat', 'sharded'):
+        raise ValueError("unknown jobdir layout {}".format(layout))
+    write_jobdir_layout(
+            jobdir, sharded=layout == 'sharded', reg=config['reg_inputs'])
+    logger.info("use {} jobdir layout".format(layout))
+    if qa_mode is not None:
+        config['qa_mode'] = qa_mode
+    config.setdefault('qa_mode', 'deferred')
+    config.setdefault('qa_pyramid', [])
+    config.setdefault('catalog_store', None)
+    config.setdefault('uptodate_check', 'hash')
+    config.setdefault('task_cache', None)
+    config.setdefault('task_cache_size', 50)
+    config.setdefault('resources', {})
+    config.setdefault('work_queue', None)
+    config.setdefault('executor', 'ruffus')
+    if config['uptodate_check'] not in ('hash', 'mtime'):
+        raise ValueError("unknown up-to-date check {}".format(
+            config['uptodate_check']))
+    if config['qa_mode'] not in QA_MODES:
+        raise ValueError("unknown QA mode {}".format(config['qa_mode']))
+    logger.info("use {} QA mode".format(config['qa_mode']))
     config['jobkey'] = jobkey
     config['skymask_dir'] = jobdir + ".skymask"
     config['bpmask_dir'] = jobdir + ".bpmask"
 
+    tlist = pipeline.get_tlist(config)
+    if apus_args and any(a in ('-l', '--list-tasks') for a in apus_args):
+        # list the tasks without importing apus and ruffus
+        for task in tlist:
+            print(task['name'])
+        return
+    from .apus import core as apuscore
     logger.info("arguments passed to Apus {}".format(apus_args))
     logger.propagate = False
     # call apus
@@ -569,10 +837,23 @@ def run_pipeline(config_file, jobfile, apus_args=None):
                 jobkey=jobkey,
                 jobdir=jobdir,
                 logdir=config['logdir'],
+                registry_file=os.path.join(jobdir, PRODUCTS_REGISTRY_FILE),
+                registry_reg=config['reg_inputs'],
+                manifest_file=os.path.join(jobdir, MANIFEST_FILE)
+                if config['uptodate_check'] == 'hash' else '',
+                task_cache_dir=os.path.join(workdir, config['task_cache'])
+                if config['task_cache'] else '',
+                task_cache_size=int(config['task_cache_size'] * 1024 ** 3)
+                if config['task_cache_size'] else None,
+                resources=config['resources'],
+                durations_file=os.path.join(workdir, DURATIONS_FILE),
+                queue_file=os.path.join(workdir, config['work_queue'])
+                if config['work_queue'] else '',
+                executor=config['executor'],
                 env_overrides={
                     'path_prefix': config['astromatic_prefix'],
                     'tmpdir': config['tmpdir']},
-                tlist=pipeline.get_tlist(config),
+                tlist=tlist,
                 ),
             apus_args
             )
@@ -0,0 +1,376 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 19:30
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+cutout.py
+
+The cutout service of the coadds and the exposures.
+
+The products in the jobdirs, i.e., the coadds named by ``reg_mosaic_fits``
+and the exposures named by ``reg_inputs``, are indexed by the sky
+footprints of their extensions. The science chips of the exposures are
+enumerated with the instrument layouts.
+
+A cutout at (ra, dec) is read from the product that covers the position.
+The data are read through memmap in square tiles, which are kept in a
+LRU cache, so the cutouts of a hot region do not touch the files.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+import os
+import re
+import io
+import json
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+from astropy.io import fits
+from astropy.wcs import WCS
+from astropy.wcs.utils import proj_plane_pixel_scales
+
+from .instruments import get_layout
+from .stats import zscale
+from .png import encode_png, gray_from_normalized
+
+
+EXPOSURE_IMFLAGS = ('fsub', )
+
+Product = namedtuple(
+        'Product', ['path', 'kind', 'ext', 'chip', 'shape', 'wcs',
+                    'center', 'radius'])
+"""An extension that cutouts are made from.
+
+kind is "coadd" or "exposure"; center is the (ra, dec) of the center and
+radius the distance in degree to the farthest corner.
+"""
+
+
+def _unit_vector(ra, dec):
+    ra, dec = np.radians(ra), np.radians(dec)
+    return np.array([
+        np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)])
+
+
+def _separation(ra1, dec1, ra2, dec2):
+    cossep = np.clip(np.dot(
+        _unit_vector(ra1, dec1).T, _unit_vector(ra2, dec2)), -1., 1.)
+    return np.degrees(np.arccos(cossep))
+
+
+def make_product(path, kind, ext, chip, header):
+    """Return the `Product` of the extension with header"""
+    wcs = WCS(header)
+    ny, nx = header['NAXIS2'], header['NAXIS1']
+    (ra, dec), = wcs.all_pix2world([[(nx - 1) / 2., (ny - 1) / 2.]], 0)
+    corners = wcs.all_pix2world(
+            [[0, 0], [nx - 1, 0], [0, ny - 1], [nx - 1, ny - 1]], 0)
+    radius = np.max(_separation(corners[:, 0], corners[:, 1], ra, dec))
+    return Product(path, kind, ext, chip, (ny, nx), wcs,
+                   (float(ra), float(dec)), float(radius))
+
+
+def scan_products(dirs, reg_mosaic_fits, reg_inputs,
+                  imflags=EXPOSURE_IMFLAGS):
+    """
+    Return the products in dirs
+
+    Symbolic links, e.g., the grouped inputs, are skipped so each product
+    is indexed once.
+    """
+    logger = logging.getLogger("cutout")
+    products = []
+    for dirname in dirs:
+        with os.scandir(dirname) as it:
+            names = sorted(d.name for d in it if d.is_file(
+                follow_symlinks=False))
+        for name in names:
+            path = os.path.abspath(os.path.join(dirname, name))
+            if re.match(reg_mosaic_fits, name) is not None:
+                kind = 'coadd'
+            else:
+                m = re.match(reg_inputs, name)
+                if m is None or m.group('ppflag') or \
+                        m.group('imflag') not in imflags or \
+                        m.group('ext') != 'fits':
+                    continue
+                kind = 'exposure'
+            try:
+                with fits.open(path, memmap=True) as hdulist:
+                    if kind == 'coadd':
+                        exts = [(0, None, hdulist[0])]
+                    else:
+                        exts = get_layout(hdulist).enumerate(hdulist)
+                    for ext, chip, hdu in exts:
+                        products.append(make_product(
+                            path, kind, ext, chip, hdu.header))
+            except Exception as e:
+                logger.warning("skip {}: {}".format(path, e))
+    return products
+
+
+class ProductIndex(object):
+    """
+    The index of the sky footprints of the products
+    """
+
+    def __init__(self, products):
+        self.products = list(products)
+        if self.products:
+            self._centers = _unit_vector(*np.array(
+                [p.center for p in self.products]).T)
+            self._radii = np.array([p.radius for p in self.products])
+
+    def __len__(self):
+        return len(self.products)
+
+    def locate(self, ra, dec, kind=None):
+        """
+        Return the list of (product, x, y) that cover (ra, dec), in which
+        x and y are the zero-based pixel coordinates. The coadds come
+        first, and the products whose centers are closer come first.
+        """
+        if not self.products:
+            return []
+        sep = np.degrees(np.arccos(np.clip(np.dot(
+            _unit_vector(ra, dec), self._centers), -1., 1.)))
+        result = []
+        for i in np.argsort(sep):
+            if sep[i] > self._radii[i]:
+                continue
+            p = self.products[i]
+            if kind is not None and p.kind != kind:
+                continue
+            (x, y), = p.wcs.all_world2pix([[ra, dec]], 0)
+            ny, nx = p.shape
+            if -0.5 <= x < nx - 0.5 and -0.5 <= y < ny - 0.5:
+                result.append((p, float(x), float(y)))
+        result.sort(key=lambda r: r[0].kind != 'coadd')
+        return result
+
+
+class TileCache(object):
+    """
+    The LRU cache of the tiles of the products
+
+    Parameters
+    ----------
+    maxsize: int
+        The number of tiles kept.
+    tile_size: int
+        The size of the square tiles.
+    maxfiles: int
+        The number of files kept open.
+    """
+
+    def __init__(self, maxsize=256, tile_size=256, maxfiles=16):
+        self.maxsize = maxsize
+        self.tile_size = tile_size
+        self.maxfiles = maxfiles
+        self.hits = 0
+        self.misses = 0
+        self._tiles = OrderedDict()
+        self._files = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_data(self, path, ext):
+        hdulist = self._files.pop(path, None)
+        if hdulist is None:
+            hdulist = fits.open(path, memmap=True)
+            while len(self._files) >= self.maxfiles:
+                _, old = self._files.popitem(last=False)
+                old.close()
+        self._files[path] = hdulist
+        return hdulist[ext].data
+
+    def get(self, path, ext, ty, tx):
+        """Return the tile (ty, tx) of the extension"""
+        key = (path, ext, ty, tx)
+        with self._lock:
+            tile = self._tiles.pop(key, None)
+            if tile is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                s = self.tile_size
+                # only the rows of the tile are read
+                tile = np.array(
+                        self._get_data(path, ext)[
+                            ty * s:(ty + 1) * s, tx * s:(tx + 1) * s],
+                        dtype='f4')
+                while len(self._tiles) >= self.maxsize:
+                    self._tiles.popitem(last=False)
+            self._tiles[key] = tile
+        return tile
+
+    def read(self, path, ext, shape, y0, y1, x0, x1):
+        """Return the data in [y0:y1, x0:x1] of the extension with the
+        given shape. The pixels outside of the extension are NaN."""
+        out = np.full((y1 - y0, x1 - x0), np.nan, dtype='f4')
+        ny, nx = shape
+        cy0, cy1 = max(y0, 0), min(y1, ny)
+        cx0, cx1 = max(x0, 0), min(x1, nx)
+        if cy1 <= cy0 or cx1 <= cx0:
+            return out
+        s = self.tile_size
+        for ty in range(cy0 // s, (cy1 - 1) // s + 1):
+            for tx in range(cx0 // s, (cx1 - 1) // s + 1):
+                tile = self.get(path, ext, ty, tx)
+                ty0, tx0 = ty * s, tx * s
+                sy0, sy1 = max(cy0, ty0), min(cy1, ty0 + tile.shape[0])
+                sx0, sx1 = max(cx0, tx0), min(cx1, tx0 + tile.shape[1])
+                out[sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0] = tile[
+                        sy0 - ty0:sy1 - ty0, sx0 - tx0:sx1 - tx0]
+        return out
+
+    def close(self):
+        with self._lock:
+            for hdulist in self._files.values():
+                hdulist.close()
+            self._files.clear()
+            self._tiles.clear()
+
+
+class CutoutService(object):
+    """
+    Make cutouts from the indexed products
+
+    Parameters
+    ----------
+    index: `ProductIndex`
+        The products.
+    cache: `TileCache`, optional
+        The tile cache. A default one is created if not given.
+    max_size: int
+        The maximum size of the cutouts in pixels.
+    """
+
+    def __init__(self, index, cache=None, max_size=4096):
+        self.index = index
+        self.cache = cache if cache is not None else TileCache()
+        self.max_size = max_size
+
+    def cutout(self, ra, dec, size, kind=None):
+        """
+        Return the cutout centered at (ra, dec)
+
+        Parameters
+        ----------
+        ra, dec: float
+            The center in degree.
+        size: float
+            The size of the square cutout in arcsec.
+        kind: str, optional
+            "coadd" or "exposure" to restrict the products used.
+
+        Returns
+        -------
+        product: `Product`
+            The product the cutout is made from, None if no product
+            covers the position.
+        hdu: `~astropy.io.fits.PrimaryHDU`
+            The cutout with the WCS.
+        """
+        found = self.index.locate(ra, dec, kind=kind)
+        if not found:
+            return None, None
+        product, x, y = found[0]
+        scale = np.mean(proj_plane_pixel_scales(product.wcs.celestial))
+        npix = int(np.round(size / 3600. / scale))
+        if npix < 1 or npix > self.max_size:
+            raise ValueError("cutout size {} pix out of range [1, {}]".format(
+                npix, self.max_size))
+        x0 = int(np.floor(x + 0.5)) - npix // 2
+        y0 = int(np.floor(y + 0.5)) - npix // 2
+        data = self.cache.read(
+                product.path, product.ext, product.shape,
+                y0, y0 + npix, x0, x0 + npix)
+        header = product.wcs.to_header(relax=True)
+        header['CRPIX1'] -= x0
+        header['CRPIX2'] -= y0
+        header['ORIGFILE'] = os.path.basename(product.path)
+        header['ORIGEXT'] = product.ext
+        if product.chip is not None:
+            header['ORIGCHIP'] = product.chip
+        return product, fits.PrimaryHDU(data=data, header=header)
+
+
+def encode_cutout(hdu, fmt='fits'):
+    """Return the bytes and the content type of the cutout"""
+    if fmt == 'fits':
+        buf = io.BytesIO()
+        hdu.writeto(buf)
+        return buf.getvalue(), 'application/fits'
+    elif fmt == 'png':
+        vmin, vmax = zscale(hdu.data)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            gray = gray_from_normalized((hdu.data - vmin) / (vmax - vmin))
+        return encode_png(gray[::-1]), 'image/png'
+    raise ValueError("unknown format {}".format(fmt))
+
+
+class CutoutHandler(BaseHTTPRequestHandler):
+    """
+    The HTTP handler of the cutout service
+
+    GET /cutout?ra=<deg>&dec=<deg>&size=<arcsec>[&kind=coadd|exposure]
+        [&fmt=fits|png]
+    GET /products
+    """
+
+    def _send(self, code, body, content_type='text/plain'):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        service = self.server.service
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if url.path == '/products':
+            body = json.dumps([dict(
+                path=p.path, kind=p.kind, ext=p.ext, chip=p.chip,
+                center=p.center, radius=p.radius)
+                for p in service.index.products])
+            self._send(200, body, 'application/json')
+        elif url.path == '/cutout':
+            try:
+                ra, dec, size = (
+                        float(query[k]) for k in ('ra', 'dec', 'size'))
+                product, hdu = service.cutout(
+                        ra, dec, size, kind=query.get('kind', None))
+                if product is None:
+                    self._send(404, "no product covers {} {}".format(
+                        ra, dec))
+                    return
+                body, content_type = encode_cutout(
+                        hdu, fmt=query.get('fmt', 'fits'))
+            except (KeyError, ValueError) as e:
+                self._send(400, "invalid request: {}".format(e))
+                return
+            self._send(200, body, content_type)
+        else:
+            self._send(404, "unknown path {}".format(url.path))
+
+    def log_message(self, fmt, *args):
+        logging.getLogger("cutout").info(fmt % args)
+
+
+class CutoutServer(ThreadingMixIn, HTTPServer):
+    """The threaded HTTP server of the `CutoutService`"""
+
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        HTTPServer.__init__(self, address, CutoutHandler)
+        self.service = service
@@ -0,0 +1,278 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 12:05
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+header_index.py
+
+A persistent cache of FITS headers.
+
+Only the header blocks of the primary and the first extension are read
+with a minimal card parser, so no data unit is touched. The parsed
+headers are kept in a SQLite database keyed by path, size and mtime.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+import os
+import re
+import json
+import sqlite3
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
+
+
+BLOCK_SIZE = 2880
+CARD_SIZE = 80
+
+_re_float = re.compile(
+        r'^[+-]?(\d+\.?\d*|\.\d+)([eEdD][+-]?\d+)?$')
+_re_int = re.compile(r'^[+-]?\d+$')
+
+
+def parse_card_value(raw):
+    """Return the python value of the value field of a card"""
+    raw = raw.strip()
+    if raw.startswith("'"):
+        # string, '' is an escaped quote
+        value = []
+        i = 1
+        while i < len(raw):
+            c = raw[i]
+            if c == "'":
+                if raw[i + 1:i + 2] == "'":
+                    value.append("'")
+                    i += 2
+                    continue
+                break
+            value.append(c)
+            i += 1
+        return ''.join(value).rstrip()
+    # strip the comment
+    raw = raw.split('/', 1)[0].strip()
+    if raw == 'T':
+        return True
+    if raw == 'F':
+        return False
+    if _re_int.match(raw):
+        return int(raw)
+    if _re_float.match(raw):
+        return float(raw.replace('D', 'E').replace('d', 'e'))
+    return raw
+
+
+def parse_header_block(buf):
+    """
+    Parse the cards in buf
+
+    Returns
+    -------
+    header: dict
+        The keys and values. Commentary cards are ignored and only the
+        first occurrence of a key is kept.
+    end: bool
+        True if the END card is found.
+    """
+    header = {}
+    last = None
+    for i in range(0, len(buf) - CARD_SIZE + 1, CARD_SIZE):
+        card = buf[i:i + CARD_SIZE].decode('ascii', 'replace')
+        key = card[:8].rstrip()
+        if key == 'END':
+            return header, True
+        if key == 'CONTINUE':
+            # long string convention
+            value = header.get(last, None)
+            if isinstance(value, str) and value.endswith('&'):
+                header[last] = value[:-1] + parse_card_value(card[8:])
+            continue
+        if key == 'HIERARCH':
+            key, _, raw = card[9:].partition('=')
+            key = key.strip()
+        elif card[8:10] == '= ':
+            raw = card[10:]
+        else:
+            continue
+        if key and key not in header:
+            header[key] = parse_card_value(raw)
+            last = key
+        else:
+            last = None
+    return header, False
+
+
+def _has_end_card(buf):
+    for i in range(0, len(buf), CARD_SIZE):
+        if buf[i:i + 8] == b'END     ':
+            return True
+    return False
+
+
+def read_headers(filename, nhdu=2):
+    """
+    Read the headers of the first nhdu HDUs of filename
+
+    Only the header blocks are read; the data units are skipped
+    according to the structural keywords.
+
+    Returns
+    -------
+    headers: list
+        The list of dict, one per HDU found.
+    """
+    headers = []
+    with open(filename, 'rb') as fo:
+        while len(headers) < nhdu:
+            blocks = []
+            while True:
+                buf = fo.read(BLOCK_SIZE)
+                if len(buf) < BLOCK_SIZE:
+                    if not headers:
+                        raise ValueError(
+                                "not a FITS file {}".format(filename))
+                    if not blocks:
+                        return headers
+                    raise ValueError(
+                            "truncated header in {}".format(filename))
+                blocks.append(buf)
+                if _has_end_card(buf):
+                    break
+            header, _ = parse_header_block(b''.join(blocks))
+            if not headers and header.get('SIMPLE') is not True:
+                raise ValueError("not a FITS file {}".format(filename))
+            headers.append(header)
+            # skip the data unit
+            naxis = header.get('NAXIS', 0)
+            size = 0
+            if naxis > 0:
+                size = 1
+                for i in range(1, naxis + 1):
+                    size *= header.get('NAXIS{}'.format(i), 0)
+            size = abs(header.get('BITPIX', 8)) // 8 * header.get(
+                    'GCOUNT', 1) * (header.get('PCOUNT', 0) + size)
+            fo.seek(-(-size // BLOCK_SIZE) * BLOCK_SIZE, os.SEEK_CUR)
+    return headers
+
+
+def _plain_value(value):
+    """Return the header value read by astropy as the plain python value
+    that `parse_card_value` returns for the card"""
+    from astropy.io.fits.card import Undefined
+    if value is None or isinstance(value, Undefined):
+        return ''
+    if hasattr(value, 'item'):
+        # numpy scalars
+        value = value.item()
+    if isinstance(value, complex):
+        return "({!r}, {!r})".format(value.real, value.imag)
+    if isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def try_read_headers(filename, nhdu=2):
+    """Same as `read_headers` but falls back to astropy, and returns None
+    if the file cannot be read"""
+    try:
+        return read_headers(filename, nhdu=nhdu)
+    except (ValueError, OSError):
+        # fall back to astropy, e.g., for gzipped files
+        from astropy.io import fits
+        try:
+            with fits.open(filename, memmap=True) as hdulist:
+                return [dict(
+                    (k, _plain_value(v)) for k, v in hdu.header.items()
+                    if k not in ('COMMENT', 'HISTORY', ''))
+                    for hdu in hdulist[:nhdu]]
+        except Exception:
+            return None
+
+
+class HeaderIndex(object):
+    """
+    A SQLite backed cache of the headers of FITS files
+
+    Parameters
+    ----------
+    dbfile: str
+        The database file. It is created if not exists.
+    nhdu: int
+        The number of HDUs to read for each file.
+    """
+
+    def __init__(self, dbfile, nhdu=2):
+        self.logger = logging.getLogger("header_index")
+        self.dbfile = dbfile
+        self.nhdu = nhdu
+        self.conn = sqlite3.connect(dbfile)
+        self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS headers ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, "
+                "nhdu INTEGER, headers TEXT)")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_headers(self, filenames, nthreads=None):
+        """
+        Return the headers of filenames
+
+        Entries not in the cache or outdated are read concurrently with
+        threads, and are written to the cache.
+
+        Returns
+        -------
+        headers: list
+            The list of headers (list of dicts) of each file. The item is
+            None if the file cannot be read.
+        """
+        paths = [os.path.realpath(f) for f in filenames]
+        stats = [os.stat(p) for p in paths]
+        cached = {}
+        cur = self.conn.cursor()
+        for i in range(0, len(paths), 500):
+            chunk = paths[i:i + 500]
+            cur.execute(
+                    "SELECT path, size, mtime, nhdu, headers FROM headers "
+                    "WHERE path IN ({})".format(','.join('?' * len(chunk))),
+                    chunk)
+            for path, size, mtime, nhdu, headers in cur.fetchall():
+                cached[path] = (size, mtime, nhdu, headers)
+        result = [None] * len(paths)
+        missing = []
+        for i, (p, st) in enumerate(zip(paths, stats)):
+            entry = cached.get(p, None)
+            if entry is not None and entry[:3] == (
+                    st.st_size, st.st_mtime_ns, self.nhdu):
+                result[i] = json.loads(entry[3])
+            else:
+                missing.append(i)
+        self.logger.info("{}/{} headers found in index {}".format(
+            len(paths) - len(missing), len(paths), self.dbfile))
+        if missing:
+            if nthreads is None:
+                nthreads = min(32, cpu_count() * 4)
+            with ThreadPoolExecutor(max_workers=nthreads) as executor:
+                headers = list(executor.map(
+                    lambda i: try_read_headers(paths[i], self.nhdu),
+                    missing))
+            rows = []
+            for i, h in zip(missing, headers):
+                result[i] = h
+                if h is not None:
+                    rows.append((
+                        paths[i], stats[i].st_size, stats[i].st_mtime_ns,
+                        self.nhdu, json.dumps(h)))
+            self.conn.executemany(
+                    "INSERT OR REPLACE INTO headers VALUES (?, ?, ?, ?, ?)",
+                    rows)
+            self.conn.commit()
+        return result
@@ -50,6 +50,7 @@ class FocalPlaneTilesMixin(object):
             xbin.append(rect[0])
         ybin = []
         for t in range(self.NTY):
+            rect = self.tile_rect(0, t)
             ybin.append(rect[1])
         return xbin, ybin
 
@@ -0,0 +1,127 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 16:30
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+jobdir_layout.py
+
+The layout of the side products in the jobdir.
+
+In the default flat layout, side products (previews, stats sidecars,
+associated extensions) are written aside the products. In the sharded
+layout they are written to ``<jobdir>/<kind>/<shard>/``, in which the
+shard is a hash of the OBSID, so the jobdir itself only holds the
+products that the pipeline tasks select by globbing.
+
+The layout is stored in the jobdir so that the tasks, which only know
+the filenames, can resolve the side products.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+import os
+import re
+import json
+import zlib
+
+
+LAYOUT_FILE = '.layout.json'
+
+SIDE_PRODUCT_KINDS = ('preview', 'stats', 'assoc')
+
+_layout_cache = {}
+
+
+def write_jobdir_layout(jobdir, sharded=False, nshards=256, reg=None):
+    """
+    Write the layout of jobdir
+
+    Parameters
+    ----------
+    jobdir: str
+        The jobdir.
+    sharded: bool
+        If True, the side products are sharded.
+    nshards: int
+        The number of shards per kind of side products.
+    reg: str, optional
+        The regex to parse the OBSID from the filenames. Files that do
+        not match are sharded by their names.
+    """
+    layout = dict(sharded=bool(sharded), nshards=int(nshards), reg=reg)
+    filename = os.path.join(jobdir, LAYOUT_FILE)
+    tmpname = filename + '.tmp'
+    with open(tmpname, 'w') as fo:
+        json.dump(layout, fo)
+    os.rename(tmpname, filename)
+    _layout_cache.pop(os.path.realpath(jobdir), None)
+    return layout
+
+
+def read_jobdir_layout(dirname):
+    """Return the layout dict of dirname, None if it is flat"""
+    dirname = os.path.realpath(dirname)
+    if dirname not in _layout_cache:
+        filename = os.path.join(dirname, LAYOUT_FILE)
+        layout = None
+        if os.path.exists(filename):
+            with open(filename, 'r') as fo:
+                layout = json.load(fo)
+            if not layout.get('sharded', False):
+                layout = None
+        _layout_cache[dirname] = layout
+    return _layout_cache[dirname]
+
+
+def get_shard(name, nshards, reg=None):
+    """Return the shard of the file name"""
+    key = name
+    if reg is not None:
+        m = re.match(reg, name)
+        if m is not None and m.groupdict().get('obsid'):
+            key = m.group('obsid')
+    return _shard_of(key, nshards)
+
+
+def _shard_of(key, nshards):
+    width = len('{:x}'.format(max(nshards - 1, 1)))
+    return '{:0{}x}'.format(
+            zlib.crc32(key.encode('utf-8')) % nshards, width)
+
+
+def side_product_path(path, kind, create=False):
+    """
+    Return the path of the side product
+
+    Parameters
+    ----------
+    path: str
+        The path of the side product in the flat layout.
+    kind: str
+        One of `SIDE_PRODUCT_KINDS`.
+    create: bool
+        If True, the shard directory is created.
+    """
+    if kind not in SIDE_PRODUCT_KINDS:
+        raise ValueError("unknown side product kind {}".format(kind))
+    dirname, name = os.path.split(path)
+    layout = read_jobdir_layout(dirname or '.')
+    if layout is None:
+        return path
+    shard_dir = os.path.join(
+            dirname, kind,
+            get_shard(name, layout['nshards'], reg=layout.get('reg')))
+    if create and not os.path.isdir(shard_dir):
+        os.makedirs(shard_dir, exist_ok=True)
+    return os.path.join(shard_dir, name)
+
+
+def side_product_dirs(jobdir, obsid):
+    """Return the existing shard directories that hold the side products
+    of obsid, empty if jobdir is flat"""
+    layout = read_jobdir_layout(jobdir)
+    if layout is None:
+        return []
+    shard = _shard_of(obsid, layout['nshards'])
+    dirs = [os.path.join(jobdir, kind, shard) for kind in SIDE_PRODUCT_KINDS]
+    return [d for d in dirs if os.path.isdir(d)]
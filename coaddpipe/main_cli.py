@@ -19,7 +19,7 @@ def main(args=None):
     from .utils import PathType, RecursiveHelpAction
     from . import core
     from .core import EXEC_NAME, DEFAULT_CONFIG_FILE
-    from .version import version
+    from . import __version__ as version
 
     parser = argparse.ArgumentParser(
         add_help=False,
@@ -82,6 +82,11 @@ A pipeline to co-add astronomical images (v{})""".format(version)
             help="overwrite  existing job file without bakcup in case "
                  "a forced init is requested"
             )
+    append_arg = parser_init.add_argument(
+            "-a", "--append", action="store_true",
+            help="append the new input images to the existing job. "
+                 "Existing entries in the job file are kept as is",
+            )
 
     config_file_arg = parser_init.add_argument(
             "-c", "--config-file", type=PathType(exists=True, type='file'),
@@ -107,6 +112,14 @@ A pipeline to co-add astronomical images (v{})""".format(version)
             "-d", "--dirs-only", action='store_true',
             help="if specified, only the job directories are created",
             )
+    query_arg = inputs_group.add_argument(
+            "-q", "--query", metavar="KEY=VALUE",
+            action="append",
+            help="select the input images from the archive index. Valid "
+                 "keys are instru, band, filter, object, "
+                 "cone=<ra>,<dec>,<radius> and mjd=<min>,<max>, all in "
+                 "degree or days. Repeat for multiple terms",
+            )
 
     def f_init(option):
         # parse the input file list if specified
@@ -126,7 +139,12 @@ A pipeline to co-add astronomical images (v{})""".format(version)
                                 input_list_arg,
                                 "invalid image path in image list: {}".format(
                                     image))
+        elif option.query is not None:
+            images = None
         elif option.dirs_only:
+            if option.append:
+                raise argparse.ArgumentError(
+                        append_arg, "not allowed with --dirs-only")
             images = []
         else:
             raise  # not possible
@@ -141,6 +159,16 @@ A pipeline to co-add astronomical images (v{})""".format(version)
                         "as workdir")
         else:
             config_file = option.config_file
+        if images is None:
+            try:
+                images = core.query_archive(
+                        os.path.abspath(config_file), option.query)
+            except ValueError as e:
+                raise argparse.ArgumentError(query_arg, str(e))
+            if not images:
+                raise argparse.ArgumentError(
+                        query_arg, "no inputs matched query {}".format(
+                            ' '.join(option.query)))
         # infer the jobkey if possible
         if not option.jobkey:
             if option.input_list is None:
@@ -154,9 +182,46 @@ A pipeline to co-add astronomical images (v{})""".format(version)
         core.init_job(os.path.abspath(config_file), jobkey, images,
                       overwrite_dir=option.force,
                       backup_jobfile=not option.overwrite,
-                      dirs_only=option.dirs_only)
+                      dirs_only=option.dirs_only,
+                      append=option.append)
     parser_init.set_defaults(func=f_init)
 
+    # create the parser for the "index" command
+    parser_index = subparsers.add_parser(
+            "index", help="index the data archive")
+    parser_index.add_argument(
+            "dirs", type=PathType(exists=True, type="dir"),
+            metavar="ARCHIVE_DIR", nargs='+',
+            help="the dirs to look for data files, recursively",
+            )
+    parser_index.add_argument(
+            "-k", "--keep", action="store_true",
+            help="keep the entries of files that are no longer found",
+            )
+    index_config_file_arg = parser_index.add_argument(
+            "-c", "--config-file", type=PathType(exists=True, type='file'),
+            metavar="CONFIG_FILE",
+            nargs=None,
+            help="the config file to use. If omitted, look into the current "
+                 "directory for one",
+            )
+
+    def f_index(option):
+        if option.config_file is None:
+            config_file = DEFAULT_CONFIG_FILE
+            if not os.path.exists(config_file):
+                raise argparse.ArgumentError(
+                        index_config_file_arg,
+                        "no valid config file found. Either specify one via "
+                        " -c or run the command in a dir that has been setup "
+                        "as workdir")
+        else:
+            config_file = option.config_file
+        core.index_archive(
+                os.path.abspath(config_file), option.dirs,
+                prune=not option.keep)
+    parser_index.set_defaults(func=f_index)
+
     # create the parser for the "run" command
     parser_run = subparsers.add_parser("run", help="run the pipeline")
     parser_run.add_argument(
@@ -166,6 +231,9 @@ A pipeline to co-add astronomical images (v{})""".format(version)
             help="the ASCII table generated from the init step containing "
                  "info of the inputs for the pipeline",
             )
+    parser_run.add_argument(
+            '--no-qa', action='store_true',
+            help="skip the QA plots")
     parser_run.add_argument(
             '-a', '--apus-args', nargs=argparse.REMAINDER, default=[],
             help="the arguments that get passed to apus")
@@ -191,9 +259,88 @@ A pipeline to co-add astronomical images (v{})""".format(version)
             config_file = option.config_file
         core.run_pipeline(
                 os.path.abspath(config_file),
-                option.jobfile, apus_args=option.apus_args)
+                option.jobfile, apus_args=option.apus_args,
+                qa_mode='off' if option.no_qa else None)
     parser_run.set_defaults(func=f_run)
 
+    # create the parser for the "serve" command
+    parser_serve = subparsers.add_parser(
+            "serve", help="serve cutouts of the products")
+    parser_serve.add_argument(
+            "jobfiles",
+            type=PathType(exists=True, type='file'),
+            metavar="INPUT_TABLE", nargs='*',
+            help="the jobs whose products are served. If omitted, serve "
+                 "all the jobdirs in workdir",
+            )
+    parser_serve.add_argument(
+            '--host', default='127.0.0.1',
+            help="the address to listen on")
+    parser_serve.add_argument(
+            '-p', '--port', type=int, default=8800,
+            help="the port to listen on")
+    parser_serve.add_argument(
+            '--cache-size', type=int, default=256,
+            help="the number of 256x256 tiles kept in memory")
+    serve_config_file_arg = parser_serve.add_argument(
+            "-c", "--config-file", type=PathType(exists=True, type='file'),
+            metavar="CONFIG_FILE",
+            nargs=None,
+            help="the config file to use. If omitted, look into the current "
+                 "directory for one",
+            )
+
+    def f_serve(option):
+        if option.config_file is None:
+            config_file = DEFAULT_CONFIG_FILE
+            if not os.path.exists(config_file):
+                raise argparse.ArgumentError(
+                        serve_config_file_arg,
+                        "no valid config file found. Either specify one via "
+                        " -c or run the command in a dir that has been setup "
+                        "as workdir")
+        else:
+            config_file = option.config_file
+        core.serve_cutouts(
+                os.path.abspath(config_file), option.jobfiles,
+                host=option.host, port=option.port,
+                cache_size=option.cache_size)
+    parser_serve.set_defaults(func=f_serve)
+
+    # create the parser for the "worker" command
+    parser_worker = subparsers.add_parser(
+            "worker", help="run the jobs published to the work queue")
+    parser_worker.add_argument(
+            '-j', '--jobs', type=int, default=1,
+            help="the number of worker processes")
+    parser_worker.add_argument(
+            '--max-idle', type=float, default=None,
+            help="exit after idle for this many seconds. If omitted, run "
+                 "until interrupted")
+    worker_config_file_arg = parser_worker.add_argument(
+            "-c", "--config-file", type=PathType(exists=True, type='file'),
+            metavar="CONFIG_FILE",
+            nargs=None,
+            help="the config file to use. If omitted, look into the current "
+                 "directory for one",
+            )
+
+    def f_worker(option):
+        if option.config_file is None:
+            config_file = DEFAULT_CONFIG_FILE
+            if not os.path.exists(config_file):
+                raise argparse.ArgumentError(
+                        worker_config_file_arg,
+                        "no valid config file found. Either specify one via "
+                        " -c or run the command in a dir that has been setup "
+                        "as workdir")
+        else:
+            config_file = option.config_file
+        core.run_worker(
+                os.path.abspath(config_file), nworkers=option.jobs,
+                max_idle=option.max_idle)
+    parser_worker.set_defaults(func=f_worker)
+
     # create an example command to print out example workflow
     parser_example = subparsers.add_parser(
             "example",
@@ -17,25 +17,32 @@ import sys
 
 def get_tlist(config):
 
-    from . import prep_grouping
-    from . import prep_masking
-    from . import prep_get_refcat
-    from . import sky_mask_objects
-    from . import sky_combine
-    from . import sky_subtract
-    from . import phot_calib
-    from . import phot_mosaic
+    from ..apus.common import LazyModule
+    from ..qa_queue import get_queue_dir, render_qa, check_qa_queue
+    # the stage modules are imported by the tasks on first call
+    prep_grouping = LazyModule(__name__ + '.prep_grouping')
+    prep_masking = LazyModule(__name__ + '.prep_masking')
+    prep_get_refcat = LazyModule(__name__ + '.prep_get_refcat')
+    sky_mask_objects = LazyModule(__name__ + '.sky_mask_objects')
+    sky_combine = LazyModule(__name__ + '.sky_combine')
+    sky_subtract = LazyModule(__name__ + '.sky_subtract')
+    phot_calib = LazyModule(__name__ + '.phot_calib')
+    phot_mosaic = LazyModule(__name__ + '.phot_mosaic')
+    qa = LazyModule(__name__.rsplit('.', 1)[0] + '.qa')
+    catalog_store = LazyModule(__name__.rsplit('.', 1)[0] + '.catalog_store')
 
     t00 = dict(
         name='select images',
         func=prep_masking.select_images,
         pipe='transform',
+        executor='thread',
         in_=os.path.abspath(config['jobfile']),
         extras=config['jobdir'],
         out=config['jobkey'] + '.checker',
         jobs_limit=1,
         kwargs={
             "reg_orig": config['reg_orig'],
+            "reg_inputs": config['reg_inputs'],
             "fmt_inputs": config['fmt_inputs'],
             }
             )
@@ -43,8 +50,10 @@ def get_tlist(config):
         name='apply mask',
         func=prep_masking.main,
         pipe='transform',
+        resources={'memory': 1500, 'io': 1},
         in_=(config['sel_inputs'], config['reg_inputs']),
         extras=os.path.abspath(config['jobfile']),
+        extras_digest=prep_masking.entry_digest,
         # add_inputs=[
         #     os.path.abspath(config['jobfile']),
         #     t00],
@@ -62,10 +71,12 @@ def get_tlist(config):
         name='get refcats',
         func=prep_get_refcat.main,
         pipe='collate',
+        executor='thread',
         in_=(t01, config['reg_inputs']),
         out='refcat_{object[0]}.cat',
         kwargs={
             "stilts_cmd": config['stilts_cmd'],
+            "catalog_store": config['catalog_store'],
             },
         jobs_limit=1
             )
@@ -81,6 +92,7 @@ def get_tlist(config):
         name='select fcomb',
         func=prep_grouping.main,
         pipe='transform',
+        executor='thread',
         in_=os.path.abspath(config['jobfile']),
         extras=config['jobdir'],
         out=config['jobkey'] + '.fcomb_group',
@@ -97,6 +109,7 @@ def get_tlist(config):
         name='get objmask',
         func='sex',
         pipe='transform',
+        resources={'cpus': 4, 'memory': 2000},
         in_=(config['sel_fcomb'], config['reg_inputs']),
         out_keys=['CATALOG_NAME', 'CHECKIMAGE_NAME'],
         out=[fmtname(config['fmt_objcat']),
@@ -115,6 +128,7 @@ def get_tlist(config):
         name='mask objects',
         func=sky_mask_objects.main,
         pipe='transform',
+        resources={'memory': 1500},
         in_=(config['sel_fcomb'], config['reg_inputs']),
         add_inputs=fmtname(config['fmt_objmask']),
         out=fmtname(config['fmt_sky']),
@@ -127,6 +141,7 @@ def get_tlist(config):
         name='create ftemp',
         func=sky_combine.main,
         pipe='collate',
+        resources={'cpus': 0, 'memory': 4000, 'io': 2},
         in_=(t22, config['reg_inputs']),
         out=fmtname(config['fmt_fcomb']),
         jobs_limit=1,
@@ -135,6 +150,7 @@ def get_tlist(config):
         name='smooth ftemp',
         func=sky_combine.smooth,
         pipe='transform',
+        resources={'cpus': 0, 'memory': 2000},
         in_=(t23, config['reg_fcomb']),
         out=fmtname(config['fmt_fsmooth']),
         jobs_limit=1,
@@ -144,6 +160,7 @@ def get_tlist(config):
         name='select fsub',
         func=prep_grouping.main,
         pipe='transform',
+        executor='thread',
         in_=os.path.abspath(config['jobfile']),
         extras=config['jobdir'],
         out=config['jobkey'] + '.fsub_group',
@@ -160,6 +177,7 @@ def get_tlist(config):
         name='subtract ftemp',
         func=sky_subtract.main,
         pipe='transform',
+        resources={'memory': 1500, 'io': 1},
         in_=(config['sel_fsub'], config['reg_grp']),
         add_inputs=fmtname(config['fmt_fsub_fsmooth']),
         out=fmtname(config['fmt_fsub']),
@@ -170,6 +188,7 @@ def get_tlist(config):
         name='select phot',
         func=prep_grouping.main,
         pipe='transform',
+        executor='thread',
         in_=os.path.abspath(config['jobfile']),
         extras=config['jobdir'],
         out=config['jobkey'] + '.phot_group',
@@ -187,6 +206,7 @@ def get_tlist(config):
         name='get photcat',
         func='sex',
         pipe='transform',
+        resources={'cpus': 4, 'memory': 2000},
         in_=(config['sel_phot'], config['reg_inputs']),
         out=fmtname(config['fmt_photcat']),
         params={'CATALOG_TYPE': 'ASCII_HEAD',
@@ -203,11 +223,13 @@ def get_tlist(config):
         outparams=['MAG_APER(8)', 'MAGERR_APER(8)', 'FLUX_MAX',
                    'AWIN_IMAGE', 'BWIN_IMAGE', 'ELONGATION'],
         follows=t40,
+        cache=True,
             )
     t42 = dict(
         name='cleanup photcat',
         func=phot_calib.cleanup,
         pipe='transform',
+        batch=16,
         in_=(t41, config['reg_inputs']),
         add_inputs="{basename[0]}.fits",
         out=fmtname(config['fmt_photcat_cleaned']),
@@ -219,6 +241,7 @@ def get_tlist(config):
         name='match refcat',
         func=phot_calib.match_refcat,
         pipe='transform',
+        executor='thread',
         in_=(t41, config['reg_inputs']),
         replace_inputs=[t42['out'], t10['out'], '{basename[0]}.fits'],
         out=fmtname(config['fmt_photcat_matched']),
@@ -226,7 +249,8 @@ def get_tlist(config):
         kwargs={
             'reg_inputs': config['reg_inputs'],
             'stilts_cmd': config['stilts_cmd'],
-            }
+            },
+        cache=True,
             )
     t44 = dict(
         name='get flxscale',
@@ -247,6 +271,7 @@ def get_tlist(config):
         name='select mosaic',
         func=prep_grouping.main,
         pipe='transform',
+        executor='thread',
         in_=os.path.abspath(config['jobfile']),
         extras=config['jobdir'],
         out=config['jobkey'] + '.mosaic_group',
@@ -264,6 +289,7 @@ def get_tlist(config):
         name='get calhdr',
         func=phot_mosaic.get_header,
         pipe='transform',
+        executor='thread',
         in_=(config['sel_mosaic'], config['reg_inputs']),
         extras=config['jobdir'],
         out="{{basename[0]}}.{}".format(config['phot_hdr_suffix']),
@@ -277,6 +303,7 @@ def get_tlist(config):
         name='create mschdr',
         func='swarp',
         pipe='collate',
+        resources={'cpus': 2},
         in_=(t51, config['reg_grp']),
         add_inputs='{basename[0]}.fits',
         in_keys=[('dummy', 'in')],
@@ -295,6 +322,7 @@ def get_tlist(config):
         name='create mosaic',
         func='swarp',
         pipe='collate',
+        resources={'cpus': 0, 'memory': 8000, 'io': 2},
         in_=(t51, config['reg_grp']),
         add_inputs=[
             '{basename[0]}.fits', fmtname(config['fmt_mosaic_hdr']),
@@ -333,6 +361,7 @@ def get_tlist(config):
         name='get msccat',
         func='sex',
         pipe='transform',
+        resources={'cpus': 4, 'memory': 4000},
         in_=(t52, config['reg_mosaic_fits']),
         # add_inputs='{basename[0]}.wht.fits',
         in_keys=[['in', 'WEIGHT_IMAGE'], ],
@@ -352,11 +381,13 @@ def get_tlist(config):
                 },
         outparams=['MAG_APER(8)', 'MAGERR_APER(8)'],
         after_func=phot_mosaic.sex_to_ascii,
+        cache=True,
             )
     t55 = dict(
         name='match refcat2',
         func=phot_mosaic.match_refcat,
         pipe='transform',
+        executor='thread',
         in_=(t54, config['reg_mosaic']),
         add_inputs=['{basename[0]}.fits', t15],
         out=fmtname(config['fmt_msccat_matched']),
@@ -375,6 +406,56 @@ def get_tlist(config):
             t40, t41, t42, t43, t44,      # phot calib
             t50, t51, t520, t52, t54, t55       # mosaic
             ]
+    # QA plots are deferred to the final task by default
+    qa_kwargs = {
+            'qa_mode': config['qa_mode'] or 'deferred',
+            'qa_queue': get_queue_dir(config['jobdir']),
+            'qa_pyramid': list(config['qa_pyramid'] or []),
+            }
+    for t in [t01, t22, t23, t24, t31, t44, t55]:
+        t['kwargs'] = dict(t.get('kwargs', {}), **qa_kwargs)
+        # changing the QA settings does not rebuild the products
+        t['volatile_kwargs'] = list(qa_kwargs)
+    if qa_kwargs['qa_pyramid'] and qa_kwargs['qa_mode'] != 'off':
+        # the mosaic pyramids are built off the critical path by a leaf
+        # task
+        t53 = dict(
+            name='create mscpyramid',
+            func=qa.pyramid_task,
+            pipe='transform',
+            in_=(t52, config['reg_mosaic_fits']),
+            out='{basename[0]}.pyramid/pyramid.json',
+            kwargs=qa_kwargs,
+            jobs_limit=1,
+                )
+        tlist.insert(tlist.index(t54), t53)
+    if config['catalog_store']:
+        # the coadd catalogs are ingested as they are done
+        t56 = dict(
+            name='ingest msccat',
+            func=catalog_store.ingest_task,
+            pipe='transform',
+            in_=(t54, config['reg_mosaic']),
+            out='{basename[0]}.ingested',
+            kwargs={
+                'catalog_store': config['catalog_store'],
+                'reg_mosaic': config['reg_mosaic'],
+                },
+            jobs_limit=1,
+                )
+        tlist.insert(tlist.index(t55) + 1, t56)
+    if qa_kwargs['qa_mode'] == 'deferred':
+        t60 = dict(
+            name='render qa',
+            func=render_qa,
+            pipe='originate',
+            out=config['jobkey'] + '.qa_rendered',
+            kwargs=qa_kwargs,
+            follows=list(tlist),
+            check_if_uptodate=check_qa_queue,
+            jobs_limit=1,
+                )
+        tlist.append(t60)
     return tlist
 
 
@@ -0,0 +1,194 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 15:00
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+jobtable.py
+
+The compiled job table.
+
+The ASCII jobfile is parsed once and compiled to a structured numpy
+array saved aside the jobfile, together with an open addressing hash
+index of the OBSID column. The compiled files are named after the hash
+of the jobfile content, so an edited jobfile is compiled again, and
+the tasks that run per image load the table memory-mapped and look up
+their entries in constant time.
+"""
+
+import os
+import glob
+import zlib
+import hashlib
+import numpy as np
+from astropy.table import Table
+
+
+__all__ = ['JobTable', 'load_job_table', 'compile_job_table']
+
+
+def content_hash(filename):
+    """Return the sha1 of the content of filename"""
+    h = hashlib.sha1()
+    with open(filename, 'rb') as fo:
+        for buf in iter(lambda: fo.read(1 << 20), b''):
+            h.update(buf)
+    return h.hexdigest()
+
+
+def get_compiled_names(jobfile, digest):
+    """Return the filenames of the compiled rows and index"""
+    prefix = "{}.{}".format(os.path.abspath(jobfile), digest[:16])
+    return prefix + '.npy', prefix + '.idx.npy'
+
+
+def _slot(key, mask):
+    return zlib.crc32(key.encode('utf-8')) & mask
+
+
+def build_index(keys):
+    """
+    Return the open addressing hash index of keys
+
+    The index has a size of power of two that is at least twice the
+    number of keys. Each slot holds the row number of the key, or -1 if
+    empty. Collisions are resolved by linear probing, and the first
+    occurrence of duplicated keys is kept.
+    """
+    size = 1
+    while size < 2 * max(len(keys), 1):
+        size *= 2
+    mask = size - 1
+    index = np.full(size, -1, dtype='i8')
+    for i, key in enumerate(keys):
+        key = str(key)
+        s = _slot(key, mask)
+        while index[s] >= 0:
+            if str(keys[index[s]]) == key:
+                break
+            s = (s + 1) & mask
+        else:
+            index[s] = i
+    return index
+
+
+def _to_array(tbl):
+    # columns with masked values are converted to strings, in which the
+    # masked values are empty
+    columns = []
+    for name in tbl.colnames:
+        col = tbl[name]
+        data = np.asarray(col)
+        if getattr(col, 'mask', None) is not None and np.any(col.mask):
+            data = np.where(col.mask, '', data.astype('U'))
+        if data.dtype.kind == 'S':
+            data = data.astype('U')
+        columns.append((name, data))
+    rows = np.empty(len(tbl), dtype=[(n, d.dtype) for n, d in columns])
+    for name, data in columns:
+        rows[name] = data
+    return rows
+
+
+def _save(filename, arr):
+    tmpname = "{}.{}.tmp.npy".format(filename[:-len('.npy')], os.getpid())
+    np.save(tmpname, arr)
+    os.rename(tmpname, filename)
+
+
+def compile_job_table(jobfile, digest=None):
+    """
+    Compile jobfile to the binary rows and OBSID index
+
+    The compiled files of the previous content of jobfile are removed.
+
+    Returns
+    -------
+    rowfile, idxfile: str
+        The compiled files.
+    """
+    if digest is None:
+        digest = content_hash(jobfile)
+    rowfile, idxfile = get_compiled_names(jobfile, digest)
+    tbl = Table.read(jobfile, format='ascii.commented_header')
+    rows = _to_array(tbl)
+    # rows first, the index marks the complete compilation
+    _save(rowfile, rows)
+    _save(idxfile, build_index(rows['OBSID']))
+    for f in glob.glob("{}.*.npy".format(glob.escape(
+            os.path.abspath(jobfile)))):
+        if f not in (rowfile, idxfile) and '.tmp.' not in f:
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+    return rowfile, idxfile
+
+
+class JobTable(object):
+    """
+    The job table rows with the OBSID index
+
+    Parameters
+    ----------
+    rows: structured array
+        The rows of the job table.
+    index: array, optional
+        The index built by `build_index`. It is built if not given.
+    """
+
+    def __init__(self, rows, index=None):
+        self.rows = rows
+        if index is None:
+            index = build_index(rows['OBSID'])
+        self.index = index
+        self._mask = len(index) - 1
+
+    @property
+    def colnames(self):
+        return list(self.rows.dtype.names)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __getitem__(self, item):
+        return self.rows[item]
+
+    def get(self, obsid, default=None):
+        """Return the row of obsid, or default if not found"""
+        obsid = str(obsid)
+        obsids = self.rows['OBSID']
+        s = _slot(obsid, self._mask)
+        while True:
+            i = self.index[s]
+            if i < 0:
+                return default
+            if str(obsids[i]) == obsid:
+                return self.rows[i]
+            s = (s + 1) & self._mask
+
+    def __contains__(self, obsid):
+        return self.get(obsid) is not None
+
+    def to_table(self):
+        """Return the rows as `~astropy.table.Table`"""
+        return Table(np.array(self.rows))
+
+
+def load_job_table(jobfile):
+    """
+    Return the `JobTable` of jobfile
+
+    The compiled files are used if they match the content of jobfile,
+    otherwise jobfile is compiled first.
+    """
+    digest = content_hash(jobfile)
+    rowfile, idxfile = get_compiled_names(jobfile, digest)
+    if not (os.path.exists(rowfile) and os.path.exists(idxfile)):
+        rowfile, idxfile = compile_job_table(jobfile, digest=digest)
+    return JobTable(
+            np.load(rowfile, mmap_mode='r'),
+            np.load(idxfile, mmap_mode='r'))
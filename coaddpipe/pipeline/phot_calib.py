@@ -48,6 +48,7 @@ import time
 from scipy.stats import sigmaclip
 from astropy.time import Time
 from astropy.io import fits
+from astropy.wcs import WCS
 from astropy.table import Table, Column, vstack
 # from functools import partial
 # import itertools
@@ -56,23 +57,16 @@ import subprocess
 # from multiprocessing import cpu_count, Pool
 
 # from scipy.ndimage import uniform_filter  # , gaussian_filter, median_filter
-# import pyregion
+import pyregion
 # from scipy import interpolate
 
 # from postcalib.utils import mp_traceback
 from ..instruments import get_layout
 from ..apus.common import get_log_func
+from ..utils import get_pyplot
+from ..qa_queue import submit
 # from postcalib import qa
-
-from cycler import cycler
-import matplotlib
-matplotlib.use("agg")
-# import matplotlib.image as mimg
-import matplotlib.pyplot as plt  # noqa: E402
-from matplotlib import cm  # noqa: E402
-from mpl_toolkits.axes_grid.inset_locator import inset_axes  # noqa: E402
-import matplotlib.colors as mc  # noqa: E402
-from matplotlib import rc  # noqa: E402
+# matplotlib is imported in the plotting functions on first use
 
 
 def main(*args, **kwargs):
@@ -104,13 +98,14 @@ def main(*args, **kwargs):
     # generate fluxscale header
     master.write("test_master.asc", format='ascii.commented_header')
     catind = np.unique(master['catind'])
+    image_index = index_images(image_files)
     for i in catind:
         subbulk = master[master['catind'] == i]
         catfile = subbulk['catfile'][0]
         log("processing catalog {}".format(catfile))
         airmass = subbulk[ck['airmass']][0]
         # figure out hdrfile name from catfile through indexing
-        hdrfile = look_up_images(image_files, catfile).rsplit(
+        hdrfile = look_up_images(image_files, catfile, image_index).rsplit(
                 '.fits', 1)[0] + '.' + hdr_suffix
         log("processing swarp header {0}".format(hdrfile))
         valid_s = []
@@ -148,7 +143,8 @@ def main(*args, **kwargs):
                 else:
                     fo.write(hdr)
     # create QA plots
-    qa_master(master, ck, master_file.rsplit(".cat", 1)[0] + ".png", kwargs)
+    savename = master_file.rsplit(".cat", 1)[0] + ".png"
+    submit(savename, qa_master, (master, ck, savename), kwargs)
 
     log("master calib file saved: {0}".format(master_file))
     master.write(master_file, format='ascii.commented_header')
@@ -329,39 +325,158 @@ def cleanup(*args, **kwargs):
 
 
 def get_regmask(xs, ys, exts, hdulist, regions, **kwargs):
-    # log = get_log_func(default_level='debug', **kwargs)
-    layout = get_layout(hdulist)
-    filters = {chip: [] for chip in layout.chips()}
-    for ext, chip, hdu in layout.enumerate(hdulist):
-        # create a fresh wcs from keys
-        tmp_hdu = fits.ImageHDU(data=hdu.data)
-        # add basic wcs
-        for key in ['CTYPE1', 'CTYPE2', 'CRPIX1', 'CRPIX2',
-                    'CRVAL1', 'CRVAL2', 'CUNIT1', 'CUNIT2', 'CD1_1', 'CD2_1',
-                    'CD1_2', 'CD2_2']:
-            tmp_hdu.header[key] = hdu.header[key]
-        # for region in regions:
-        #     try:
-        #         filter_ = pyregion.open(region).as_imagecoord(
-        #                 tmp_hdu.header).get_filter()
-        #         filters[chip].append(filter_)
-        #     except ValueError as e:
-        #         if "need more than 0 values to unpack" not in e.message:
-        #             log("unable to apply region mask {} due to '{}'"
-        #                 " please check the format of the file".format(
-        #                     region, e))
-    # loop over catalog
-    mask = np.ones_like(xs, dtype=bool)
-    for i in range(len(xs)):
-        chip = layout.ext(exts[i])['chip']
-        filter_list = filters[chip]
-        for filter_ in filter_list:
-            if filter_.inside1(xs[i], ys[i]):
-                mask[i] = False
-                break
+    """
+    Return the mask of catalog entries that are outside of any region.
+
+    The regions are converted to polygons once, and for each chip the
+    polygons are projected onto the image plane so that all sources
+    that belong to the chip are tested at once.
+    """
+    log = get_log_func(default_level='debug', **kwargs)
+    xs = np.asarray(xs, dtype='d')
+    ys = np.asarray(ys, dtype='d')
+    exts = np.asarray(exts)
+    mask = np.ones(len(xs), dtype=bool)
+    polygons = get_region_polygons(regions, log=log)
+    if not polygons or len(xs) == 0:
+        return mask
+    # group the catalog by extension
+    order = np.argsort(exts, kind='mergesort')
+    uexts, istart = np.unique(exts[order], return_index=True)
+    for ext, index in zip(uexts, np.split(order, istart[1:])):
+        if not 0 <= ext < len(hdulist):
+            log("warning", "no chip found for ext {}".format(ext))
+            continue
+        wcs = None
+        for frame, verts in polygons:
+            if frame == 'sky':
+                if wcs is None:
+                    wcs = get_chip_wcs(hdulist[ext].header)
+                verts = np.column_stack(wcs.all_world2pix(
+                    verts[:, 0], verts[:, 1], 1))
+            inside = points_in_polygon(xs[index], ys[index], verts)
+            mask[index[inside]] = False
     return mask
 
 
+def get_chip_wcs(header):
+    """Return the linear WCS of a chip"""
+    wcs_header = fits.Header()
+    for key in ['CTYPE1', 'CTYPE2', 'CRPIX1', 'CRPIX2',
+                'CRVAL1', 'CRVAL2', 'CUNIT1', 'CUNIT2', 'CD1_1', 'CD2_1',
+                'CD1_2', 'CD2_2']:
+        if key in header:
+            wcs_header[key] = header[key]
+    # the distortion terms are not needed to locate the regions
+    for i in (1, 2):
+        wcs_header['CTYPE{}'.format(i)] = wcs_header.get(
+                'CTYPE{}'.format(i), '')[:8].replace('TPV', 'TAN')
+    return WCS(wcs_header)
+
+
+_region_polygon_cache = {}
+
+
+def get_region_polygons(regions, log=None, nvert=32):
+    """
+    Return list of (frame, vertices) polygons converted from the DS9
+    region files.
+
+    frame is "sky" for shapes specified in celestial coordinates,
+    and "image" for shapes in image coordinates. The parsed polygons are
+    cached so the files are only read once.
+    """
+    polygons = []
+    for region in regions:
+        key = (os.path.abspath(region), os.path.getmtime(region), nvert)
+        if key not in _region_polygon_cache:
+            try:
+                shapes = pyregion.open(region)
+            except ValueError as e:
+                if log is not None:
+                    log("unable to apply region mask {} due to '{}',"
+                        " please check the format of the file".format(
+                            region, e))
+                shapes = []
+            _region_polygons = []
+            for shape in shapes:
+                if shape.exclude:
+                    continue
+                if shape.coord_format == 'image':
+                    frame = 'image'
+                elif shape.coord_format in ('fk5', 'fk4', 'icrs'):
+                    frame = 'sky'
+                else:
+                    if log is not None:
+                        log("skip shape {} in unsupported frame {}".format(
+                            shape.name, shape.coord_format))
+                    continue
+                verts = shape_to_polygon(
+                        shape.name, shape.coord_list, frame, nvert=nvert)
+                if verts is None:
+                    if log is not None:
+                        log("skip unsupported shape {}".format(shape.name))
+                    continue
+                _region_polygons.append((frame, verts))
+            _region_polygon_cache[key] = _region_polygons
+        polygons.extend(_region_polygon_cache[key])
+    return polygons
+
+
+def shape_to_polygon(name, coords, frame, nvert=32):
+    """
+    Return the (n, 2) vertices of the polygon that approximates the shape.
+
+    For sky frame shapes, the sizes are in degree and the position angle
+    is measured in the tangent plane with the west as the x axis,
+    same as the image of north-up and east-left.
+    """
+    if name == 'polygon':
+        return np.reshape(np.asarray(coords, dtype='d'), (-1, 2))
+    t = np.linspace(0., 2. * np.pi, nvert, endpoint=False)
+    if name == 'circle':
+        x0, y0, r = coords[:3]
+        u, v = r * np.cos(t), r * np.sin(t)
+        angle = 0.
+    elif name == 'ellipse':
+        x0, y0, a, b = coords[:4]
+        angle = coords[4] if len(coords) > 4 else 0.
+        u, v = a * np.cos(t), b * np.sin(t)
+    elif name == 'box':
+        x0, y0, w, h = coords[:4]
+        angle = coords[4] if len(coords) > 4 else 0.
+        u = np.array([-0.5, 0.5, 0.5, -0.5]) * w
+        v = np.array([-0.5, -0.5, 0.5, 0.5]) * h
+    else:
+        return None
+    ca, sa = np.cos(np.deg2rad(angle)), np.sin(np.deg2rad(angle))
+    u, v = u * ca - v * sa, u * sa + v * ca
+    if frame == 'sky':
+        cosdec = np.cos(np.deg2rad(y0))
+        return np.column_stack([x0 - u / cosdec, y0 + v])
+    return np.column_stack([x0 + u, y0 + v])
+
+
+def points_in_polygon(xs, ys, verts):
+    """Return the mask of points that are inside the polygon, or on its
+    edges"""
+    from matplotlib.path import Path
+    inside = np.zeros(len(xs), dtype=bool)
+    if len(xs) == 0 or len(verts) < 3:
+        return inside
+    (l, b), (r, t) = np.min(verts, axis=0), np.max(verts, axis=0)
+    bbox = (xs >= l) & (xs <= r) & (ys >= b) & (ys <= t)
+    if np.any(bbox):
+        # the path grown by a tiny radius to include the edges, of which
+        # the sign depends on the orientation of the vertices
+        path = Path(verts)
+        points = np.column_stack([xs[bbox], ys[bbox]])
+        eps = 1e-9 * max(r - l, t - b)
+        inside[bbox] = path.contains_points(points, radius=eps) | \
+            path.contains_points(points, radius=-eps)
+    return inside
+
+
 # def get_edgemask(xs, ys, e, wl):
 #     mask = np.zeros_like(xs, dtype=bool)
 #     for cj, ci in itertools.product(range(wl.NCX), range(wl.NCY)):
@@ -601,7 +716,20 @@ def self_calibrate(bulk, ck, model_flags=('color', 'chip', 'expo', 'airmass')):
     return parvals, paruncs, clipmask, np.std(residue), np.std(clipped)
 
 
-def look_up_images(images, cat):
+def index_images(images):
+    """Return dict of the image basename without .fits to image"""
+    return {os.path.basename(image).rsplit('.fits', 1)[0]: image
+            for image in images}
+
+
+def look_up_images(images, cat, index=None):
+    # the catalogs are named after the images with suffixes appended
+    if index is not None:
+        name = os.path.basename(cat)
+        while '.' in name:
+            name = name.rsplit('.', 1)[0]
+            if name in index:
+                return index[name]
     for image in images:
         if os.path.basename(image).rsplit('.fits', 1)[0] in cat:
             return image
@@ -613,6 +741,7 @@ def qa_master(master, ck, savename, kwargs):
     log = get_log_func(default_level='debug', **kwargs)
     # load table and compile to a master calib table
     log('create QA plots')
+    plt = get_pyplot()
     set_color()
     cband = ck['cband']
     fig = plt.figure(figsize=(18, 10))
@@ -628,6 +757,9 @@ def qa_master(master, ck, savename, kwargs):
 
 
 def plot_zp_color(ax, bulk, ck, kwargs):
+    from matplotlib import cm
+    from mpl_toolkits.axes_grid.inset_locator import inset_axes
+    plt = get_pyplot()
     log = get_log_func(default_level='debug', **kwargs)
     ax.set_xlim((-0.2, np.max(bulk['catind']) + 1))
     ax.set_ylim((-0.7, 1.))
@@ -782,6 +914,7 @@ def plot_zp_color(ax, bulk, ck, kwargs):
 
 def change_hsv(c, h=None, s=None, v=None, frac=False):
     '''Quickly change the color in hsv space'''
+    import matplotlib.colors as mc
     if isinstance(c, str):
         rgb = np.array([[mc.hex2color(c), ]])
     else:  # rgb
@@ -804,6 +937,8 @@ def change_hsv(c, h=None, s=None, v=None, frac=False):
 
 
 def set_color():
+    from cycler import cycler
+    from matplotlib import rc
     kelly = np.array([
         [255, 179, 0], [128, 62, 117], [255, 104, 0], [166, 189, 215],
         [193, 0, 32], [206, 162, 98], [129, 112, 102], [0, 125, 52],
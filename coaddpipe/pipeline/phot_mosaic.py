@@ -14,24 +14,18 @@ from __future__ import print_function, division
 import os
 import re
 import sys
-import glob
 import numpy as np
 from astropy.io import fits
 from ..apus.common import get_log_func
+from ..apus.registry import registry_glob
 import subprocess
 from astropy.table import Table
 
 
 from scipy.stats import sigmaclip
-from cycler import cycler
-import matplotlib
-matplotlib.use("agg")
-# import matplotlib.image as mimg
-import matplotlib.pyplot as plt  # noqa: E402
-# from matplotlib import cm  # noqa: E402
-# from mpl_toolkits.axes_grid.inset_locator import inset_axes  # noqa: E402
-import matplotlib.colors as mc  # noqa: E402
-from matplotlib import rc  # noqa: E402
+from ..utils import get_pyplot
+from ..qa_queue import submit
+# matplotlib is imported in the plotting functions on first use
 
 
 def get_header(*args, **kwargs):
@@ -42,8 +36,9 @@ def get_header(*args, **kwargs):
     log("link header for {}".format(image_file))
     parsed_filename = re.match(kwargs['reg_inputs'],
                                os.path.basename(image_file)).groupdict()
-    hdr = glob.glob(os.path.join(
-        jobdir, kwargs['phot_hdr_glob'].format(**parsed_filename)))
+    hdr = registry_glob(os.path.join(
+        jobdir, kwargs['phot_hdr_glob'].format(**parsed_filename)),
+        kwargs.get('registry', None), obsid=parsed_filename['obsid'])
     if len(hdr) == 0:
         log("no header found for {}".format(image_file))
         if os.path.exists(header_file):
@@ -168,12 +163,14 @@ def match_refcat(*args, **kwargs):
     # create plot for catalog and matched catalog
     cat_tbl = Table.read(cat_file, format='ascii.commented_header')
     savename = cat_file.rsplit(".cat", 1)[0] + ".png"
-    qa_catalog(cat_tbl, tbl, image_file, savename, ref, ref_band, kwargs)
+    submit(savename, qa_catalog,
+           (cat_tbl, tbl, image_file, savename, ref, ref_band), kwargs)
 
 
 def qa_catalog(cat_tbl, ref_tbl, image_file, savename, ref, ref_band, kwargs):
     log = get_log_func(default_level='debug', **kwargs)
     log('create QA plots')
+    plt = get_pyplot()
     set_color()
     fig = plt.figure(figsize=(8, 16))
 
@@ -312,6 +309,8 @@ def plot_depth_histo(ax, cat_tbl):
 
 
 def set_color():
+    from cycler import cycler
+    from matplotlib import rc
     kelly = np.array([
         [255, 179, 0], [128, 62, 117], [255, 104, 0], [166, 189, 215],
         [193, 0, 32], [206, 162, 98], [129, 112, 102], [0, 125, 52],
@@ -323,6 +322,7 @@ def set_color():
 
 def change_hsv(c, h=None, s=None, v=None, frac=False):
     '''Quickly change the color in hsv space'''
+    import matplotlib.colors as mc
     if isinstance(c, str):
         rgb = np.array([[mc.hex2color(c), ]])
     else:  # rgb
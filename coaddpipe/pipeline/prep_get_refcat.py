@@ -51,8 +51,6 @@ from astropy.coordinates import SkyCoord
 import subprocess
 import astropy.units as u
 import numpy as np
-from astroquery.sdss import SDSS
-from astroquery.gaia import Gaia
 from astropy.table import Table, vstack, unique
 import requests
 import concurrent.futures
@@ -141,6 +139,27 @@ def main(*args, **kwargs):
             "ifmt%N%=ascii in%N%={out_ps1} values%N%=ra~dec suffix%N%=_ps1 ")
         cats_in.append((ps1_cat, '_ps1'))
 
+    # the coadd catalogs in the catalog store as a secondary reference
+    if kwargs.get('catalog_store', None):
+        coadd_cat = query_catalog_store(
+                kwargs['catalog_store'],
+                min_ra=w, max_ra=e,
+                min_dec=s, max_dec=n,
+                cra=cra, cdec=cdec,
+                width=width, height=height,
+                **kwargs
+                )
+        if coadd_cat is not None and len(coadd_cat) > 0:
+            out_coadd = os.path.join(
+                    outdir, outbase.replace("refcat", 'coadd'))
+            log("save to coadd catalog {}".format(out_coadd))
+            coadd_cat.write(out_coadd, format='ascii.commented_header',
+                            overwrite=True)
+            stilts_in.append(
+                "ifmt%N%=ascii in%N%={out_coadd} values%N%=ra~dec "
+                "suffix%N%=_coadd ")
+            cats_in.append((coadd_cat, '_coadd'))
+
     nin = len(stilts_in)
     if nin == 0:
         raise RuntimeError("no reference catalog can be found")
@@ -216,6 +235,7 @@ def stack_cats(in_cats, out_cat, **kwargs):
 
 
 def query_sdss(**kwargs):
+    from astroquery.sdss import SDSS
     log = get_log_func(default_level='debug', **kwargs)
     sql_query = [
         "SELECT ra,dec,raErr,decErr,u,err_u,g,err_g,r,err_r,i,err_i,z,err_z",
@@ -241,6 +261,7 @@ def query_sdss(**kwargs):
 
 
 def query_gaia(**kwargs):
+    from astroquery.gaia import Gaia
     log = get_log_func(default_level='debug', **kwargs)
     sql_query = [
         "SELECT ra,dec,ra_error,dec_error,"
@@ -260,6 +281,28 @@ def query_gaia(**kwargs):
         return None
 
 
+def query_catalog_store(rootdir, **kwargs):
+    log = get_log_func(default_level='debug', **kwargs)
+    from ..catalog_store import CatalogStore
+    if not os.path.exists(rootdir):
+        log("no catalog store found in {}".format(rootdir))
+        return None
+    radius = np.hypot(kwargs['width'], kwargs['height']) / 2.
+    with CatalogStore(rootdir) as store:
+        cat = store.merged(kwargs['cra'], kwargs['cdec'], radius)
+        bands = store.bands
+    cat = cat[
+            (cat['ra'] >= kwargs['min_ra']) & (cat['ra'] <= kwargs['max_ra']) &
+            (cat['dec'] >= kwargs['min_dec']) &
+            (cat['dec'] <= kwargs['max_dec'])]
+    # use the naming of the SDSS catalog
+    for band in bands:
+        cat.rename_column('MAG_AUTO_{}'.format(band), band)
+        cat.rename_column('MAGERR_AUTO_{}'.format(band), 'err_{}'.format(band))
+    log("{} objects found in catalog store".format(len(cat)))
+    return cat
+
+
 def query_panstarrs_chunk(url, payload, ra, dec, rad, chunk):
     _payload = dict(payload, ra=ra, dec=dec, radius=rad)
     # from astropy.table import Column
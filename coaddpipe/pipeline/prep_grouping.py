@@ -63,17 +63,19 @@ jobdir: path
 Outputs
 -------
 checkfile: ASCII table
-    Save content as jobfile, serves as the checker for diff-ed updating.
+    Save content as jobfile, serves as the target of the task. The
+    diff-ed updating uses the job table snapshot managed by
+    `~coaddpipe.pipeline.prep_jobdiff.JobDiff`.
 """
 
 
 import os
 import re
 import sys
-import glob
-from astropy.table import Table
 # from postcalib.wiyn import get_layout
 from ..apus.common import get_log_func, touch_file
+from .jobtable import load_job_table
+from .prep_jobdiff import JobDiff, JobdirListing
 # from postcalib import qa
 
 
@@ -85,139 +87,113 @@ def main(*args, **kwargs):
     grpkey = kwargs['grpkey']
     grpcol = grpkey + '_group'
 
-    job_table = Table.read(jobfile, format='ascii.commented_header')
-    job_table.pprint(max_width=None, max_lines=-1)
-
-    # cases:
-    # no checker_table
-    #   purge all links first {prefix}_*_{obsid}_*
-    #   entries in job_table, add if >= 0
-    # has checker_table
-    #   entry is in checker, and group the same, skip
-    #   otherwise purge {prefix}_*_{obsid}_*
-    #   add if >= 0
-
-    if not os.path.exists(checkfile):
-        checker_table = []
-    else:
-        checker_table = Table.read(
-                checkfile, format='ascii.commented_header')
-
-    purge_glob = os.path.join(jobdir, grpkey + "[0-9]*_{obsid}_*")
-    # glob the images
+    job_table = load_job_table(jobfile)
+    job_table.to_table().pprint(max_width=None, max_lines=-1)
+
+    # the job table is diffed against the snapshot of this grouping key:
+    #   removed entries: purge {prefix}*_{obsid}_*
+    #   unchanged entries with existing link: skip
+    #   otherwise purge {prefix}*_{obsid}_* and add if >= 0
+    # the groups that lost members are dirty, and are triggered by
+    # touching one of the members, if no member is added
+    jobdiff = JobDiff(jobdir, job_table)
+    changes = jobdiff.changes(grpkey, [grpcol])
+    previous = jobdiff.previous(grpkey)
+    unchanged = set(changes.unchanged)
+
+    # list the jobdir once, and index the products by obsid
+    listing = JobdirListing(
+            jobdir, kwargs['reg_inputs'],
+            registry=kwargs.get('registry', None))
+    purge_pattern = grpkey + "[0-9]*_{obsid}_*"
+    purge_noid_pattern = grpkey + "_{obsid}_*"
+    reg_grpid = re.compile(re.escape(grpkey) + r'(\d+)_')
+
+    def purge(obsid):
+        grpids = set()
+        for pattern in [purge_pattern, purge_noid_pattern]:
+            for f in listing.match(obsid, pattern.format(obsid=obsid)):
+                m = re.match(reg_grpid, os.path.basename(f))
+                if m is not None:
+                    grpids.add(int(m.group(1)))
+                log("purge obsolete file {}".format(f))
+                listing.remove(f)
+        return grpids
+
     add_count = skip_count = rm_count = 0
-    images = glob.glob(os.path.join(jobdir, kwargs['sel_inputs']))
+    rm_grp = set()
+    for obsid in changes.removed:
+        grpids = purge(obsid)
+        if grpids:
+            rm_grp.update(grpids)
+            rm_count += 1
+
+    images = listing.select(kwargs['sel_inputs'])
     # process the images to merge with fallbacks
     fb_images = []
+    fb_listings = [
+            listing.select(fallback)
+            for _, fallback in kwargs.get('fallbacks', [])]
     for entry in job_table:
-        image = get_image(images, entry['OBSID'])
+        image = images.get(entry['OBSID'], None)
         if image is None:
             log("no images available for {}".format(entry['OBSID']))
-            if 'fallbacks' in kwargs:
-                for fkey, fallback in kwargs['fallbacks']:
-                    fb_image = get_image(
-                            glob.glob(os.path.join(jobdir, fallback)),
-                            entry['OBSID'])
-                    if fb_image is None:
-                        continue
-                    else:
-                        log("fallback to {}".format(fb_image))
-                        fb_images.append(fb_image)
-                        break
+            for fb in fb_listings:
+                fb_image = fb.get(entry['OBSID'], None)
+                if fb_image is None:
+                    continue
+                else:
+                    log("fallback to {}".format(fb_image))
+                    fb_images.append(fb_image)
+                    break
         else:
             pass
-    # if len(images) == 0:
-    #     log("no images available for selection, try using fallbacks")
-    #     if 'fallbacks' in kwargs:
-    #         for fkey, fallback in kwargs['fallbacks']:
-    #             fb_images = glob.glob(os.path.join(jobdir, fallback))
-    #             if len(fb_images) == 0:
-    #                 continue
-    #             else:
-    #                 log("fallback to {}".format(fkey))
-    #                 images = fb_images
-    #                 break
-    rm_grp = set()
     add_grp = set()
     skipped_grp = {}
-    for inname in images + fb_images:
+    for inname in sorted(images.values()) + fb_images:
         # parse image name
-        parsed_filename = re.match(
-                kwargs['reg_inputs'], os.path.basename(inname)
-                ).groupdict()
-        entry = get_entry(job_table, OBSID=parsed_filename['obsid'])
-        ppflag = "{}{}_".format(grpkey, entry[grpcol])
+        parsed_filename = listing.parse(inname)
+        obsid = parsed_filename['obsid']
+        entry = job_table.get(obsid)
+        if entry is None:
+            log("warning", "no job entry found for {}".format(inname))
+            continue
+        grpid = entry[grpcol]
+        ppflag = "{}{}_".format(grpkey, grpid)
         outname = os.path.join(jobdir, kwargs['fmt_selected'].format(
                 **dict(parsed_filename, ppflag=ppflag)
                 ))
-        # purge all but outname
-        skip_count_flag = True
-        rm_count_flag = True
-        for f in glob.glob(purge_glob.format(**parsed_filename)):
-            bf = os.path.basename(f)
-            if entry[grpcol] >= 0 and os.path.exists(outname) and \
-                    bf.startswith(ppflag):
-                if entry[grpcol] not in skipped_grp.keys():
-                    skipped_grp[entry[grpcol]] = inname
-                log("existing file {} for link {}".format(f, outname))
-                if skip_count_flag:
-                    skip_count += 1
-                    skip_count_flag = False
-                continue
-            else:
-                # query the checkfile for the old grpid
-                old_entry = [e for e in checker_table
-                             if e['OBSID'] == parsed_filename['obsid']]
-                if not old_entry:
-                    log("warning", "something wrong with the checker file")
-                rm_grp.add(old_entry[0][grpcol])
-                log("purge obsolete file {}".format(f))
-                os.remove(f)
-                if rm_count_flag:
-                    rm_count += 1
-                    rm_count_flag = False
-                # also purge no id product
-                for f in glob.glob(os.path.join(
-                        jobdir, grpkey + "_{obsid}_*".format(
-                            **parsed_filename))):
-                    log("purge obsolete file {}".format(f))
-                    os.remove(f)
-        # create link of >= 0
-        # print(inname, outname)
-        if not os.path.exists(outname) and entry[grpcol] >= 0:
-            add_grp.add(entry[grpcol])
+        if grpid >= 0 and obsid in unchanged and outname in listing:
+            skipped_grp.setdefault(grpid, inname)
+            log("existing link {}".format(outname))
+            skip_count += 1
+            continue
+        # the entry is new or its group changed, purge all but outname
+        grpids = purge(obsid)
+        if grpids:
+            rm_grp.update(grpids)
+            rm_count += 1
+        elif obsid in previous:
+            rm_grp.add(previous[obsid][grpcol])
+        if grpid >= 0:
+            add_grp.add(grpid)
             log("link for {} to {}".format(grpkey, outname))
-            os.symlink(os.path.basename(inname), outname)
+            listing.symlink(os.path.basename(inname), outname)
             add_count += 1
+    # groups left dirty by select images
+    rm_grp.update(jobdiff.pop_dirty(grpkey))
     # for grp that has rm but no add, touch one file to trigger update
-    touch_grp = rm_grp - add_grp
-    print(rm_grp, add_grp, touch_grp)
+    touch_grp = set(
+            int(g) for g in rm_grp if re.match(r'^\d+$', str(g))) - add_grp
     for grpid in touch_grp:
         if grpid in skipped_grp.keys():
             touch_file(skipped_grp[grpid])
             log("touch group {} of {} for triggering update".format(
                 grpid, skipped_grp[grpid]))
+    listing.flush()
+    jobdiff.commit(grpkey, [grpcol])
 
     log("{} entries + {}, - {}, skipped {}".format(
         grpkey, add_count, rm_count, skip_count))
-    job_table.write(checkfile, format='ascii.commented_header')
-
-
-def get_entry(tbl, **kwargs):
-    k, v = list(kwargs.items())[0]
-    if tbl is None:
-        return None
-    else:
-        entry = [e for e in tbl if e[k] == v]
-        if len(entry) > 0:
-            return entry[0]
-        else:
-            return None
-
+    job_table.to_table().write(checkfile, format='ascii.commented_header')
 
-def get_image(images, obsid):
-    image = [i for i in images if obsid in os.path.basename(i)]
-    if len(image) > 0:
-        return image[0]
-    else:
-        return None
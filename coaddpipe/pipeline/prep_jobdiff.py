@@ -0,0 +1,254 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 14:10
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+prep_jobdiff.py
+
+The diff engine of the job table.
+
+The job table rows last applied by each consumer ("select" for
+select images, and the grouping keys) are kept in a snapshot file in the
+jobdir. The per-OBSID change set of a consumer is computed against its
+snapshot, so only the changed entries need filesystem work.
+
+The snapshot also records the dirty groups, i.e., the groups that lost
+members, so the grouping tasks know which groups need to be triggered
+for an update.
+"""
+
+import os
+import re
+import json
+import fcntl
+import fnmatch
+from collections import namedtuple
+from contextlib import contextmanager
+import numpy as np
+
+
+GROUP_KEYS = ['fcomb', 'fsub', 'phot', 'mosaic']
+
+Changes = namedtuple('Changes', ['added', 'removed', 'changed', 'unchanged'])
+
+
+def get_rows(job_table):
+    """Return dict of OBSID to dict of the values as strings"""
+    rows = {}
+    for e in job_table:
+        row = {}
+        for c in job_table.colnames:
+            v = e[c]
+            row[c] = "" if v is np.ma.masked else str(v)
+        rows.setdefault(row['OBSID'], row)
+    return rows
+
+
+class JobDiff(object):
+    """
+    The job table diff engine
+
+    Parameters
+    ----------
+    jobdir: str
+        The jobdir in which the snapshot is stored.
+    job_table: `~astropy.table.Table` or dict
+        The current job table, or the rows returned by `get_rows`.
+    """
+
+    snapshot_name = 'jobtable.snapshot.json'
+
+    def __init__(self, jobdir, job_table):
+        self.jobdir = jobdir
+        self.filename = os.path.join(jobdir, self.snapshot_name)
+        if isinstance(job_table, dict):
+            self.rows = job_table
+        else:
+            self.rows = get_rows(job_table)
+
+    @contextmanager
+    def _locked(self):
+        # serialize the snapshot updates of concurrent tasks
+        with open(self.filename + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield self._load()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load(self):
+        if not os.path.exists(self.filename):
+            return {'consumers': {}, 'dirty': {}}
+        with open(self.filename, 'r') as fo:
+            return json.load(fo)
+
+    def _save(self, snapshot):
+        tmpname = self.filename + '.tmp'
+        with open(tmpname, 'w') as fo:
+            json.dump(snapshot, fo)
+        os.rename(tmpname, self.filename)
+
+    def previous(self, consumer):
+        """Return the rows last committed by consumer"""
+        snapshot = self._load()['consumers'].get(consumer, None)
+        if snapshot is None:
+            return {}
+        columns = snapshot['columns']
+        return {k: dict(zip(columns, v))
+                for k, v in snapshot['rows'].items()}
+
+    def changes(self, consumer, columns):
+        """
+        Return the `Changes` of the job table since the last commit of
+        consumer, in which only the given columns are compared
+        """
+        previous = self.previous(consumer)
+        added, changed, unchanged = [], [], []
+        for obsid, row in self.rows.items():
+            old = previous.get(obsid, None)
+            if old is None:
+                added.append(obsid)
+            elif all(old.get(c, None) == row.get(c, None) for c in columns):
+                unchanged.append(obsid)
+            else:
+                changed.append(obsid)
+        removed = [k for k in previous.keys() if k not in self.rows]
+        return Changes(added, removed, changed, unchanged)
+
+    def commit(self, consumer, columns):
+        """Record the current job table as applied by consumer"""
+        with self._locked() as snapshot:
+            snapshot['consumers'][consumer] = {
+                    'columns': list(columns),
+                    'rows': {k: [r.get(c, "") for c in columns]
+                             for k, r in self.rows.items()},
+                    }
+            self._save(snapshot)
+
+    def mark_dirty(self, grpkey, grpids):
+        """Record that the groups grpids of grpkey need update"""
+        grpids = set(
+                int(g) for g in grpids if re.match(r'^\d+$', str(g)))
+        if not grpids:
+            return
+        with self._locked() as snapshot:
+            dirty = set(snapshot['dirty'].get(grpkey, []))
+            snapshot['dirty'][grpkey] = sorted(dirty | grpids)
+            self._save(snapshot)
+
+    def pop_dirty(self, grpkey):
+        """Return and clear the dirty groups of grpkey"""
+        with self._locked() as snapshot:
+            dirty = snapshot['dirty'].pop(grpkey, [])
+            if dirty:
+                self._save(snapshot)
+        return set(dirty)
+
+
+class JobdirListing(object):
+    """
+    The content of the jobdir, listed once and indexed by obsid
+
+    The files are parsed with reg_inputs; files that do not match
+    are not indexed. If registry is given, the links created and the
+    files removed are recorded in the products registry when `flush` is
+    called.
+    """
+
+    def __init__(self, jobdir, reg_inputs, registry=None):
+        self.jobdir = jobdir
+        self.reg_inputs = re.compile(reg_inputs)
+        self.registry = registry
+        self._touched = set()
+        self.parsed = {}
+        self.by_obsid = {}
+        with os.scandir(jobdir) as it:
+            for d in it:
+                self._add(d.name)
+
+    def _add(self, name):
+        m = re.match(self.reg_inputs, name)
+        if m is None:
+            return
+        parsed = m.groupdict()
+        self.parsed[name] = parsed
+        self.by_obsid.setdefault(parsed['obsid'], set()).add(name)
+
+    def __contains__(self, filename):
+        return os.path.basename(filename) in self.parsed
+
+    def parse(self, filename):
+        """Return the parsed filename"""
+        name = os.path.basename(filename)
+        if name not in self.parsed:
+            return re.match(self.reg_inputs, name).groupdict()
+        return self.parsed[name]
+
+    def select(self, pattern):
+        """Return dict of obsid to the first (sorted) file that matches the
+        glob pattern"""
+        result = {}
+        for name in sorted(self.parsed.keys()):
+            if fnmatch.fnmatchcase(name, pattern):
+                result.setdefault(
+                        self.parsed[name]['obsid'],
+                        os.path.join(self.jobdir, name))
+        return result
+
+    def match(self, obsid, pattern):
+        """Return the files of obsid that match the glob pattern"""
+        return [os.path.join(self.jobdir, name)
+                for name in sorted(self.by_obsid.get(obsid, ()))
+                if fnmatch.fnmatchcase(name, pattern)]
+
+    def remove(self, filename):
+        if os.path.islink(filename):
+            os.unlink(filename)
+        else:
+            os.remove(filename)
+        name = os.path.basename(filename)
+        parsed = self.parsed.pop(name, None)
+        if parsed is not None:
+            self.by_obsid[parsed['obsid']].discard(name)
+        self._touched.add(filename)
+
+    def symlink(self, src, filename):
+        os.symlink(src, filename)
+        self._add(os.path.basename(filename))
+        self._touched.add(filename)
+
+    def flush(self):
+        """Record the changed files in the registry"""
+        if self.registry is not None and self._touched:
+            # vanished files are removed from the registry
+            self.registry.register(sorted(self._touched))
+        self._touched = set()
+
+
+def purge_groups(jobdiff, listing, log, grpkeys=GROUP_KEYS):
+    """
+    Purge the grouped products of the entries whose group changed or are
+    removed from the job table, for all grpkeys in one pass over the
+    listing. The old groups are marked dirty.
+
+    Returns
+    -------
+    count: int
+        The number of files purged.
+    """
+    count = 0
+    for grpkey in grpkeys:
+        grpcol = grpkey + '_group'
+        changes = jobdiff.changes(grpkey, [grpcol])
+        previous = jobdiff.previous(grpkey)
+        dirty = set()
+        for obsid in changes.changed + changes.removed:
+            for pattern in [grpkey + "[0-9]*_{}_*", grpkey + "_{}_*"]:
+                for f in listing.match(obsid, pattern.format(obsid)):
+                    log("purge obsolete file {}".format(f))
+                    listing.remove(f)
+                    count += 1
+            dirty.add(previous[obsid][grpcol])
+        jobdiff.mark_dirty(grpkey, dirty)
+    return count
@@ -40,10 +40,12 @@ import os
 import re
 import sys
 import glob
+import json
+import fnmatch
+import hashlib
 
 import numpy as np
 from astropy.io import fits
-from astropy.table import Table
 # from functools import partial
 import itertools
 # from multiprocessing import Pool, cpu_count
@@ -56,7 +58,12 @@ import subprocess
 
 from ..instruments import get_layout
 from ..apus.common import get_log_func, touch_file
+from .jobtable import load_job_table
+from .prep_jobdiff import (
+        JobDiff, JobdirListing, purge_groups, GROUP_KEYS)
 from .. import qa
+from ..sidecar import write_sidecar, get_sidecar_name
+from ..jobdir_layout import side_product_path, side_product_dirs
 # from postcalib.utils import mp_traceback
 
 
@@ -66,17 +73,19 @@ def main(*args, **kwargs):
         args = sys.argv[1:]
     image, jobfile, outname = args
 
-    job_table = Table.read(jobfile, format='ascii.commented_header')
-    # job_table.pprint(max_width=None, max_lines=-1)
+    job_table = load_job_table(jobfile)
 
     # locate the image entry
-    entry = [e for e in job_table if e['OBSID'] in image]
+    parsed_filename = re.match(
+            kwargs['reg_inputs'], os.path.basename(image))
+    entry = None
+    if parsed_filename is not None:
+        entry = job_table.get(parsed_filename.groupdict()['obsid'])
 
-    if len(entry) != 1:
+    if entry is None:
         raise RuntimeError(
                 "inconsistent job table and jobdir content."
                 " Re-run `select images` task to clean up the jobdir")
-    entry = entry[0]
 
     logid = "#{} {}".format(entry['numid'], image)
     log("masking {}".format(logid))
@@ -155,13 +164,19 @@ def main(*args, **kwargs):
                 asslist.append(hdu)
         scilist = fits.HDUList(scilist)
         scilist.writeto(outname, overwrite=True)
-        out_assoc = outname.rsplit(".fits", 1)[0] + ".assoc"
+        log("write stats sidecar {}".format(get_sidecar_name(outname)))
+        # from the written file, of which the extensions are the sci
+        # ones only
+        stats = write_sidecar(outname)
+        out_assoc = side_product_path(
+                outname.rsplit(".fits", 1)[0] + ".assoc", 'assoc',
+                create=True)
         log("write associate extentions {}".format(out_assoc))
         asslist = fits.HDUList(asslist)
         asslist.writeto(out_assoc, overwrite=True)
-        pr = qa.create_preview(
-                hdulist=hdulist, filename=outname, delete_data=True)
-        pr.save()
+        qa.submit_preview(
+                kwargs, filename=outname, delete_data=True, stats=stats)
+        qa.submit_pyramid(kwargs, outname)
         del scilist
         del asslist
     if whtfile is not None:
@@ -189,143 +204,153 @@ def main(*args, **kwargs):
                     asslist.append(hdu)
             scilist = fits.HDUList(scilist)
             scilist.writeto(outname, overwrite=True)
-            out_assoc = outname.rsplit(".fits", 1)[0] + ".assoc"
+            out_assoc = side_product_path(
+                    outname.rsplit(".fits", 1)[0] + ".assoc", 'assoc',
+                    create=True)
             log("write associate extentions {}".format(out_assoc))
             asslist = fits.HDUList(asslist)
             asslist.writeto(out_assoc, overwrite=True)
-            pr = qa.create_preview(
-                    hdulist=hdulist, filename=outname, delete_data=True)
-            pr.save()
+            qa.submit_preview(
+                    kwargs, hdulist=hdulist, filename=outname,
+                    delete_data=True)
             del scilist
             del asslist
 
 
-def select_images(jobfile, jobdir, checkfile, **kwargs):
-    log = get_log_func(default_level='debug', **kwargs)
+def entry_digest(in_files, extras, reg_inputs=None, **kwargs):
+    """
+    Return the digest of the job table entry of the image
 
-    job_table = Table.read(jobfile, format='ascii.commented_header')
-    job_table.pprint(max_width=None, max_lines=-1)
+    This is the ``extras_digest`` of the masking task, so that only the
+    edit of the entry of the image, not the other rows of the jobfile,
+    makes the job out of date.
+    """
+    image, jobfile = in_files[0], extras[0]
+    job_table = load_job_table(jobfile)
+    parsed_filename = re.match(reg_inputs, os.path.basename(image))
+    entry = None
+    if parsed_filename is not None:
+        entry = job_table.get(parsed_filename.groupdict()['obsid'])
+    if entry is None:
+        return 'missing'
+    entry = json.dumps(
+            {c: str(entry[c]) for c in entry.dtype.names}, sort_keys=True)
+    return hashlib.sha1(entry.encode('utf-8')).hexdigest()
 
-    # cases:
-    # no checker_table
-    #   entries in job_table, add/remove depending on otas
-    # has checker_table
-    #   entries add could be skip if the otas are the same
-    #   entries remove should always be done
-    #   may have additional entries to be removed
 
-    if not os.path.exists(checkfile):
-        checker_table = []
-    else:
-        checker_table = Table.read(
-                checkfile, format='ascii.commented_header')
-
-    def rm_entry(outname, outglob):
-        if os.path.islink(outname):
-            log("unlink {}".format(outname))
-            os.unlink(outname)
-            success = True
-        else:
-            success = False
-        # purge any existing data
-        for f in glob.glob(outglob):
+def select_images(jobfile, jobdir, checkfile, **kwargs):
+    log = get_log_func(default_level='debug', **kwargs)
+
+    job_table = load_job_table(jobfile)
+    job_table.to_table().pprint(max_width=None, max_lines=-1)
+
+    # the job table is diffed against the snapshot of select images:
+    #   entries with all chips masked are removed
+    #   unchanged entries with existing link are skipped
+    #   changed entries with existing link are touched
+    #   otherwise the entries are linked, together with the companions
+    #   entries removed from the job table are purged
+    # the grouped products of all grouping keys are then purged in one
+    # pass, and the affected groups are left dirty to the grouping tasks
+    columns = ['filename', 'mask_chips']
+    jobdiff = JobDiff(jobdir, job_table)
+    changes = jobdiff.changes('select', columns)
+    previous = jobdiff.previous('select')
+    unchanged = set(changes.unchanged)
+    listing = JobdirListing(
+            jobdir, kwargs['reg_inputs'],
+            registry=kwargs.get('registry', None))
+    # the job-in dirs are listed once each for the companions
+    jobin_listings = {}
+
+    def get_jobin_listing(dirname):
+        if dirname not in jobin_listings:
+            jobin_listings[dirname] = JobdirListing(
+                    dirname, kwargs['reg_orig'])
+        return jobin_listings[dirname]
+
+    def rm_entry(obsid, outname):
+        success = outname in listing
+        # purge any existing data, the groups of which become dirty
+        for f in listing.match(obsid, "*_{}_*".format(obsid)):
+            m = re.match(r'^([a-z]+)(\d+)_$', listing.parse(f)['ppflag'] or '')
+            if m is not None and m.group(1) in GROUP_KEYS:
+                jobdiff.mark_dirty(m.group(1), [m.group(2)])
             log("purged {}".format(f))
-            if os.path.islink(f):
-                os.unlink(f)
-            else:
-                os.remove(f)
+            listing.remove(f)
+        # and the side products in the sharded layout
+        for d in side_product_dirs(jobdir, obsid):
+            for f in os.listdir(d):
+                if fnmatch.fnmatchcase(f, "*_{}_*".format(obsid)):
+                    log("purged {}".format(os.path.join(d, f)))
+                    os.remove(os.path.join(d, f))
         return success
 
+    def link(linksrc, outname):
+        if outname in listing or os.path.islink(outname):
+            listing.remove(outname)
+        listing.symlink(linksrc, outname)
+
     add_count = skip_count = rm_count = touch_count = 0
     for entry in job_table:
         # naming
         inname = entry['filename']
-        # print(inname, kwargs['reg_orig'])
         parsed_filename = re.match(
                 kwargs['reg_orig'], os.path.basename(inname)
                 ).groupdict()
-        assglob = os.path.join(os.path.dirname(inname), "*_{obsid}_*".format(
-            **parsed_filename))
+        obsid = parsed_filename['obsid']
         outname = os.path.join(
-            jobdir, kwargs['fmt_inputs'].format(
-                # featgrp=entry['feature_group'],
-                # photgrp=entry['phot_group'],
-                # mscgrp=entry['mosaic_group'],
-                **parsed_filename))
-        outglob = os.path.join(jobdir, "*_{obsid}_*".format(**parsed_filename))
-        # linksrc = os.path.relpath(inname, jobdir)
-        # linksrc = os.path.relpath(os.path.realpath(inname),
-        #                           os.path.realpath(jobdir))
+            jobdir, kwargs['fmt_inputs'].format(**parsed_filename))
         # otas
         layout = get_layout(instru=entry['INSTRUME'].lower())
         chips = get_mask_chips(str(entry['mask_chips']), layout=layout)
         # handle remove of outname and purge related files
         if len(chips) == layout.NC:
-            success = rm_entry(outname, outglob)
+            success = rm_entry(obsid, outname)
             if success:
                 rm_count += 1
-        else:  # adding
-            checker_entry = [e for e in checker_table
-                             if e['filename'] == entry['filename']]
-            if os.path.exists(outname) and len(checker_entry) > 0 and \
-                    set(chips) == set(get_mask_chips(
-                        str(checker_entry[0]['mask_chips']), layout=layout)):
+        elif outname in listing:
+            if obsid in unchanged:
                 log("skip {}".format(outname))
                 skip_count += 1
                 continue
-            if os.path.exists(outname):
-                log("touch target exist {}".format(outname))
-                touch_file(outname)
-                touch_count += 1
-            else:
-                for name in glob.glob(assglob):
-                    linksrc = os.path.abspath(os.path.realpath(name))
-                    if name == inname:
-                        log("link {} -> {}".format(linksrc, outname))
-                        if os.path.islink(outname):
-                            os.unlink(outname)
-                        os.symlink(linksrc, outname)
-                    else:
-                        print(name)
-                        print(kwargs['reg_orig'])
-                        pname = re.match(
-                                kwargs['reg_orig'], os.path.basename(name)
-                                )
-                        if pname is None:
-                            continue
-                        else:
-                            pname = pname.groupdict()
-                        oname = os.path.join(
-                            jobdir, kwargs['fmt_inputs'].replace(
-                                'orig_', '{imflag}_').format(
-                                # featgrp=entry['feature_group'],
-                                # photgrp=entry['phot_group'],
-                                # mscgrp=entry['mosaic_group'],
-                                **pname))
-                        log("link assoc {} -> {}".format(linksrc, oname))
-                        if os.path.islink(oname):
-                            os.unlink(oname)
-                        os.symlink(linksrc, oname)
-                add_count += 1
+            log("touch target exist {}".format(outname))
+            touch_file(outname)
+            touch_count += 1
+        else:  # adding
+            jobin = get_jobin_listing(os.path.dirname(inname))
+            for name in jobin.match(obsid, "*_{}_*".format(obsid)):
+                linksrc = os.path.abspath(os.path.realpath(name))
+                if os.path.basename(name) == os.path.basename(inname):
+                    log("link {} -> {}".format(linksrc, outname))
+                    link(linksrc, outname)
+                else:
+                    pname = jobin.parse(name)
+                    oname = os.path.join(
+                        jobdir, kwargs['fmt_inputs'].replace(
+                            'orig_', '{imflag}_').format(**pname))
+                    log("link assoc {} -> {}".format(linksrc, oname))
+                    link(linksrc, oname)
+            add_count += 1
     # remove addition non existing files
-    for entry in checker_table:
-        inname = entry['filename']
+    for obsid in changes.removed:
+        inname = previous[obsid]['filename']
         parsed_filename = re.match(
                 kwargs['reg_orig'], os.path.basename(inname)
                 ).groupdict()
         outname = os.path.join(
             jobdir, kwargs['fmt_inputs'].format(**parsed_filename))
-        outglob = os.path.join(jobdir, "*_{obsid}_*".format(**parsed_filename))
-        job_entry = [e for e in job_table
-                     if e['filename'] == entry['filename']]
-        if len(job_entry) == 0:
-            success = rm_entry(outname, outglob)
-            if success:
-                rm_count += 1
-    log("entries + {}, - {}, touched {}, skipped {}".format(
-        add_count, rm_count, touch_count, skip_count))
+        success = rm_entry(obsid, outname)
+        if success:
+            rm_count += 1
+    purge_count = purge_groups(jobdiff, listing, log)
+    listing.flush()
+    jobdiff.commit('select', columns)
+    log("entries + {}, - {}, touched {}, skipped {}, "
+        "grouped products purged {}".format(
+            add_count, rm_count, touch_count, skip_count, purge_count))
 
-    job_table.write(checkfile, format='ascii.commented_header')
+    job_table.to_table().write(checkfile, format='ascii.commented_header')
 
 
 def apply_mask(hdulist, layout, mask_chips, bpmdir=None, bpmfile=None):
@@ -446,7 +471,7 @@ if __name__ == "__main__":
 #     pool.map_async(
 #             partial(mp_worker, jobdir=jobdir, kwargs=kwargs),
 #             diff).get(9999999)
-#     job_table.write(checkfile, format='ascii.commented_header')
+#     job_table.to_table().write(checkfile, format='ascii.commented_header')
 
 
 # def main(*args, **kwargs):
@@ -35,7 +35,7 @@ from astropy.io import fits
 from functools import partial
 import itertools
 
-from multiprocessing import cpu_count, Pool
+from multiprocessing import Pool
 
 from scipy.ndimage import uniform_filter  # , gaussian_filter, median_filter
 # from scipy.stats import sigmaclip
@@ -45,7 +45,10 @@ from scipy import interpolate
 from ..utils import mp_traceback
 from ..instruments import get_layout
 from ..apus.common import get_log_func
+from ..apus.resources import granted_cpus
 from .. import qa
+from .. import stats
+from ..sidecar import read_sidecar
 from ..qr.podi_cython import sigma_clip_median
 
 
@@ -71,7 +74,7 @@ def main(*args, **kwargs):
 
     memory_limit = 4  # G
     _cpu_count = int(memory_limit / (len(images) * 0.1))
-    _cpu_count = min(cpu_count(), _cpu_count)
+    _cpu_count = min(granted_cpus(kwargs), _cpu_count)
     if _cpu_count == 0:
         _cpu_count = 1
     log("using {} CPUs".format(_cpu_count))
@@ -85,9 +88,8 @@ def main(*args, **kwargs):
         log("write to ext {} OTA {}".format(ext, ota))
         hdulist[ext].data = data_dict[ota]
     hdulist.writeto(out_file, overwrite=True)
-    pr = qa.create_preview(
-            hdulist=hdulist, filename=out_file, delete_data=True)
-    pr.save()
+    qa.submit_preview(
+            kwargs, hdulist=hdulist, filename=out_file, delete_data=True)
 
 
 def smooth(*args, **kwargs):
@@ -100,7 +102,7 @@ def smooth(*args, **kwargs):
     layout = get_layout(hdulist)
     otas = layout.ota_order
 
-    pool = Pool(cpu_count())
+    pool = Pool(granted_cpus(kwargs))
     data_dict = dict(pool.map_async(
             partial(smooth_tile,
                     image=in_file, layout=layout,
@@ -111,9 +113,8 @@ def smooth(*args, **kwargs):
         log("write to ext {} OTA {}".format(ext, ota))
         hdulist[ext].data = data_dict[ota]
     hdulist.writeto(out_file, overwrite=True)
-    pr = qa.create_preview(
-            hdulist=hdulist, filename=out_file, delete_data=True)
-    pr.save()
+    qa.submit_preview(
+            kwargs, hdulist=hdulist, filename=out_file, delete_data=True)
 
 
 @mp_traceback
@@ -182,8 +183,14 @@ def mp_worker(ota, images, layout, kwargs):
 
     # scale
     data = []
-    for hdulist in hdulists:
-        data.append(scale_to_bkg(hdulist[ext].data, mask))
+    for image, hdulist in zip(images, hdulists):
+        mode = None
+        if mask is None:
+            # use the sky mode from the sidecar if possible
+            sidecar = read_sidecar(image)
+            if sidecar is not None:
+                mode = sidecar.get(ext, 'mode')
+        data.append(scale_to_bkg(hdulist[ext].data, mask, mode=mode))
     data = np.dstack(data).astype('d')
     # free some memory
     for hdulist in hdulists:
@@ -196,12 +203,9 @@ def mp_worker(ota, images, layout, kwargs):
     return ota, combined.reshape(data.shape[:2])
 
 
-def scale_to_bkg(data, bkgmask):
-    if bkgmask is not None:
-        _data = data[bkgmask]
-    else:
-        _data = data
-    mode = np.nanmedian(_data) * 3. - np.nanmean(_data) * 2
+def scale_to_bkg(data, bkgmask, mode=None):
+    if mode is None:
+        mode = stats.sky_stats(data, mask=bkgmask).mode
     data /= mode
     return data
 
@@ -210,27 +214,14 @@ def fix_data(data, wl, log):
     """generate a LF interpolation of data for nan data"""
     # bin each cell by nbin
     nbin = 16
-    bw = wl.CW / nbin
-    bh = wl.CH / nbin
     # bs = np.hypot(bw, bh) * 0.5
-    samp_v = np.empty((wl.NCY * nbin, wl.NCX * nbin))
+    samp_v = stats.cell_stats(data, wl, nbin)
     samp_i = []
     samp_j = []
-    for cj, ci in itertools.product(range(wl.NCX), range(wl.NCY)):
-        (cl, cr), (cb, ct) = wl.get_cell_rect(0, 0, cj, ci)
-        for bj, bi in itertools.product(range(nbin), repeat=2):
-            bl = cl + bj * bw
-            br = bl + bw
-            bb = cb + bi * bh
-            bt = bb + bh
-            bx = 0.5 * (bl + br)
-            by = 0.5 * (bb + bt)
-            bb, bt, bl, br = map(int, (bb, bt, bl, br))
-            v = np.nanmedian(data[bb:bt, bl:br])
-            samp_v[ci * nbin + bi, cj * nbin + bj] = v
-            if cj == ci and bj == bi:
-                samp_j.append(bx)
-                samp_i.append(by)
+    for (cj, ci, bj, bi), _, (bx, by) in stats.iter_cell_bins(wl, nbin):
+        if cj == ci and bj == bi:
+            samp_j.append(bx)
+            samp_i.append(by)
     # pad value to handle edges
     samp_i.insert(0, 2 * samp_i[0] - samp_i[1] - 50)
     samp_i.append(2 * samp_i[-1] - samp_i[-2] + 50)
@@ -239,7 +230,7 @@ def fix_data(data, wl, log):
     # sigma clip the samp_v for the padding value
     # _samp_v, _, _ = sigmaclip(samp_v[~np.isnan(samp_v)], 2, 2)
     _samp_v = samp_v
-    padval = np.nanmedian(_samp_v)
+    padval = stats.nanmedian(_samp_v)
     if np.isnan(padval):
         log("warning", "not able to get an estimate of the padval")
     samp_v[np.isnan(samp_v)] = padval
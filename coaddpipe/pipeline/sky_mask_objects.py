@@ -48,6 +48,8 @@ from astropy.io import fits
 
 from ..instruments import get_layout
 from .. import qa
+from .. import stats
+from ..sidecar import read_sidecar, write_sidecar
 from ..apus.common import get_log_func
 
 
@@ -87,10 +89,15 @@ def main(*args, **kwargs):
             pass
         log("use DS9 region masks\n{}".format('\n'.join(regions)))
 
+        # per chip statistics computed at masking time
+        sidecar = read_sidecar(image_file)
         with fits.open(segment_file, memmap=True) as segment:
             layout = get_layout(image)
             for ext, hdu in layout.enumerate(image):
                 otaxy = layout.get_ext_ota(ext)
+                if sidecar is not None and sidecar.get(ext, 'valid') == 0:
+                    log("skip all NAN OTA {0}".format(otaxy))
+                    continue
                 log("working on OTA {0}".format(otaxy))
                 apply_segment_mask(
                         hdu, segment[ext].data,
@@ -100,9 +107,10 @@ def main(*args, **kwargs):
                 # image[ext].data = data
         log("save to sky image {}".format(out_file))
         image.writeto(out_file, overwrite=True)
-        pr = qa.create_preview(
-                hdulist=image, filename=out_file, delete_data=True)
-        pr.save()
+        sidecar = write_sidecar(out_file, hdulist=image)
+        qa.submit_preview(
+                kwargs, hdulist=image, filename=out_file, delete_data=True,
+                stats=sidecar)
 
 
 def apply_segment_mask(hdu, segdata, **kwargs):
@@ -114,8 +122,9 @@ def apply_segment_mask(hdu, segdata, **kwargs):
     with warnings.catch_warnings():
         warnings.filterwarnings(
                 'ignore', ".+", RuntimeWarning)
-        # also mask out the low value edges
-        bkg = np.nanmedian(data) * 3 - np.nanmean(data) * 2
+        # also mask out the low value edges, from the statistics of the
+        # object masked data, which the sidecar of the image does not have
+        bkg = stats.nanmedian(data) * 3 - np.nanmean(data) * 2
         std = np.nanstd(data)
         hdu.data[np.isnan(data) | (data < bkg - 10 * std)] = np.nan
 
@@ -43,14 +43,14 @@ from __future__ import (absolute_import, division, print_function)
 import os
 import sys
 from astropy.io import fits
-from astropy.stats import sigma_clipped_stats
-import itertools
 import numpy as np
 import pyregion
 
 from ..instruments import get_layout
 from ..apus.common import get_log_func
 from .. import qa
+from .. import stats
+from ..sidecar import read_sidecar
 
 
 def main(*args, **kwargs):
@@ -65,9 +65,9 @@ def main(*args, **kwargs):
 
     log("write to {}".format(out_file))
     hdulist.writeto(out_file, overwrite=True)
-    pr = qa.create_preview(
-            hdulist=hdulist, filename=out_file, delete_data=True)
-    pr.save()
+    qa.submit_preview(
+            kwargs, hdulist=hdulist, filename=out_file, delete_data=True)
+    qa.submit_pyramid(kwargs, out_file)
 
 
 def subtract_fringe(image, template, kwargs):
@@ -76,8 +76,12 @@ def subtract_fringe(image, template, kwargs):
     fringe = fits.open(template, memmap=True)
     hdulist = fits.open(image, memmap=True)
     layout = get_layout(hdulist)
+    sidecar = read_sidecar(image)
     for ext, hdu in layout.enumerate(hdulist):
         ota = layout.get_ext_ota(ext)
+        if sidecar is not None and sidecar.get(ext, 'valid') == 0:
+            log("skip all NAN OTA {}".format(ota))
+            continue
         log("work on ext {} OTA {}".format(ext, ota))
         # get pupilmask
         regmask_file = os.path.join(
@@ -94,69 +98,89 @@ def subtract_fringe(image, template, kwargs):
         fmask = mask_fringe(fringe[ext].data, layout, thresh=0.8)
         fmask[~pmask] = np.nan  # inside pupil is nan
         hdulist[ext].data = de_fringe(
-                hdu.data, fringe[ext].data, fmask, ota, log)
+                hdu.data, fringe[ext].data, fmask, ota, layout, log)
     return hdulist
 
 
-def mask_fringe(data, wl, thresh=0.8):
+def get_fringe_bins(wl, nbin=2):
+    """Yield the (bottom, top, left, right) slices of the cell bins"""
+    for _, edges, _ in stats.iter_cell_bins(wl, nbin):
+        yield edges
+
+
+def mask_fringe(data, wl, thresh=0.8, nbin=2):
     # bin each cell by nbin
     mask = np.empty_like(data) * np.nan
-    nbin = 2
-    bw = wl.CW / nbin
-    bh = wl.CH / nbin
-    for cj, ci in itertools.product(range(wl.NCX), range(wl.NCY)):
-        (cl, cr), (cb, ct) = wl.get_cell_rect(0, 0, cj, ci)
-        for bj, bi in itertools.product(range(nbin), repeat=2):
-            bl = cl + bj * bw
-            br = bl + bw
-            bb = cb + bi * bh
-            bt = bb + bh
-            # bx = 0.5 * (bl + br)
-            # by = 0.5 * (bb + bt)
-            bb, bt, bl, br = map(int, (bb, bt, bl, br))
-            grid = data[bb:bt, bl:br]
-            mask[bb:bt, bl:br][grid > np.nanpercentile(
-                grid, thresh * 100)] = 1
-            mask[bb:bt, bl:br][grid < np.nanpercentile(
-                grid, 100 - thresh * 100)] = 0
+    for bb, bt, bl, br in get_fringe_bins(wl, nbin=nbin):
+        grid = data[bb:bt, bl:br]
+        lo, hi = stats.nanpercentile(
+                grid, (100 - thresh * 100, thresh * 100))
+        mask[bb:bt, bl:br][grid > hi] = 1
+        mask[bb:bt, bl:br][grid < lo] = 0
     return mask
 
 
-def de_fringe(data, fringe, fringemask, ota, log):
+def de_fringe(data, fringe, fringemask, ota, wl, log, nbin=2):
     # skip all nan extension
     if np.all(np.isnan(data)):
         log("skip all NAN OTA {}".format(ota))
         return data
-    # measure amplitude by sampling from the mask
-    sample_size = int(1e5)
-    hi_index = np.where(fringemask == 1)
-    hi_samp_index = np.random.choice(len(hi_index[0]), size=sample_size)
-    hi_samp = (hi_index[0][hi_samp_index],
-               hi_index[1][hi_samp_index])
-    lo_index = np.where(fringemask == 0)
-    lo_samp_index = np.random.choice(len(lo_index[0]), size=sample_size)
-    lo_samp = (lo_index[0][lo_samp_index],
-               lo_index[1][lo_samp_index])
-    # with open("fringesample{}.reg".format(otaxy), 'w') as fo:
-    #     fo.write("image\n")
-    #     for i in range(len(hi_samp[0])):
-    #         fo.write("line({},{},{},{})\n".format(
-    #             hi_samp[1][i], hi_samp[0][i], lo_samp[1][i], lo_samp[0][i]))
-    scale = (data[hi_samp[0], hi_samp[1]] - data[lo_samp[0], lo_samp[1]]) / (
-             fringe[hi_samp[0], hi_samp[1]] - fringe[lo_samp[0], lo_samp[1]])
-    # sigmaclip
-    scale = scale[(~np.isnan(scale)) & (~np.isinf(scale))]
-    mean, med, stdev = sigma_clipped_stats(scale, sigma=2, iters=10)
-
-    # import matplotlib.pyplot as plt
-    # plt.hist(scale, np.linspace(
-    #     med - stdev * 5, med + stdev * 5, 100))
-    # plt.axvline(med)
-    # # plt.imshow(fringemask)
-    # plt.show()
-
-    # print("scaling stats:", mean, med, stdev)
-    # _, med, std = sigma_clipped_stats(scale, sigma=3.0)
-    log("scaling factor: {0} +/- {1}".format(med, stdev))
-    data -= fringe * med
+    # measure the hi - lo fringe contrast of data and template in each bin
+    contrast = []
+    for bb, bt, bl, br in get_fringe_bins(wl, nbin=nbin):
+        fm = fringemask[bb:bt, bl:br]
+        hi = fm == 1
+        lo = fm == 0
+        if not (np.any(hi) and np.any(lo)):
+            continue
+        d = data[bb:bt, bl:br]
+        f = fringe[bb:bt, bl:br]
+        contrast.append((
+            stats.nanmedian(f[hi]) - stats.nanmedian(f[lo]),
+            stats.nanmedian(d[hi]) - stats.nanmedian(d[lo])))
+    contrast = np.array(contrast, dtype='d').reshape((-1, 2))
+    contrast = contrast[np.all(np.isfinite(contrast), axis=1)]
+    amp, stdev, nused = fit_fringe_amplitude(contrast[:, 0], contrast[:, 1])
+    if amp is None:
+        log("warning", "unable to measure fringe amplitude of OTA {}".format(
+            ota))
+        return data
+    log("scaling factor: {0} +/- {1} ({2}/{3} bins)".format(
+        amp, stdev, nused, len(contrast)))
+    data -= fringe * amp
     return data
+
+
+def fit_fringe_amplitude(x, y, sigma=3., iters=10):
+    """
+    Fit y = amp * x with iterative MAD clipping.
+
+    Return the amplitude, its uncertainty and the number of
+    points used; the amplitude is None when there is no usable point.
+    """
+    good = x != 0
+    if not np.any(good):
+        return None, None, 0
+    amp = np.median(y[good] / x[good])
+    for _ in range(iters):
+        resid = y - amp * x
+        mad = 1.4826 * np.median(np.abs(resid[good] - np.median(resid[good])))
+        if mad > 0:
+            keep = good & (np.abs(resid) <= sigma * mad)
+        else:
+            # most points fit exactly, no meaningful clipping
+            keep = good
+        if not np.any(keep):
+            break
+        _amp = np.sum(x[keep] * y[keep]) / np.sum(x[keep] ** 2)
+        converged = np.array_equal(keep, good) and _amp == amp
+        good, amp = keep, _amp
+        if converged:
+            break
+    resid = y[good] - amp * x[good]
+    if np.sum(good) > 1:
+        stdev = np.sqrt(np.sum(resid ** 2) / (np.sum(good) - 1)
+                        / np.sum(x[good] ** 2))
+    else:
+        stdev = np.nan
+    return amp, stdev, np.sum(good)
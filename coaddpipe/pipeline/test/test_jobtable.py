@@ -0,0 +1,66 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 15:20
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+test_jobtable.py
+"""
+
+import os
+
+
+def test_load_job_table(tmpdir):
+    from ..jobtable import load_job_table, get_compiled_names, content_hash
+    jobfile = str(tmpdir.join('test.job'))
+
+    def write(nrows):
+        with open(jobfile, 'w') as fo:
+            fo.write("# numid OBSID mask_chips phot_group\n")
+            for i in range(nrows):
+                fo.write('{0} obs{0:04d} "{1}" {2}\n'.format(
+                    i, '' if i % 2 else '33', i % 3 - 1))
+
+    write(100)
+    job_table = load_job_table(jobfile)
+    assert len(job_table) == 100
+    assert all(os.path.exists(f) for f in get_compiled_names(
+        jobfile, content_hash(jobfile)))
+    entry = job_table.get('obs0042')
+    assert entry['numid'] == 42
+    assert entry['phot_group'] == -1
+    assert str(entry['mask_chips']) == '33'
+    assert str(job_table.get('obs0043')['mask_chips']) == ''
+    assert 'obs0100' not in job_table
+    assert job_table.get('obs') is None
+
+    # edited jobfile is compiled again
+    old = get_compiled_names(jobfile, content_hash(jobfile))
+    write(101)
+    job_table = load_job_table(jobfile)
+    assert job_table.get('obs0100')['numid'] == 100
+    assert not any(os.path.exists(f) for f in old)
+
+
+def test_entry_digest(tmpdir):
+    from ..prep_masking import entry_digest
+    jobfile = str(tmpdir.join('test.job'))
+
+    def write(chips):
+        with open(jobfile, 'w') as fo:
+            fo.write("# numid OBSID mask_chips\n")
+            for i, c in enumerate(chips):
+                fo.write('{0} obs{0:04d} "{1}"\n'.format(i, c))
+
+    def digest(image):
+        return entry_digest(
+                [str(tmpdir.join(image))], [jobfile],
+                reg_inputs=r'orig_(?P<obsid>obs\d+)\.fits')
+    write(['33', '22', ''])
+    d1 = digest('orig_obs0001.fits')
+    # the edit of the other rows does not change the digest
+    write(['11', '22', '44'])
+    assert digest('orig_obs0001.fits') == d1
+    write(['11', '23', '44'])
+    assert digest('orig_obs0001.fits') != d1
+    assert digest('orig_obs0009.fits') == 'missing'
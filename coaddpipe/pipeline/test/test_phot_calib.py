@@ -0,0 +1,133 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 23:50
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+test_phot_calib.py
+
+The region masks are checked against the per-point filters of pyregion.
+"""
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+
+def _chip_hdulist(rotation=0.):
+    header = fits.Header()
+    scale = 0.25 / 3600.
+    c, s = np.cos(np.deg2rad(rotation)), np.sin(np.deg2rad(rotation))
+    for key, value in [
+            ('NAXIS', 2), ('NAXIS1', 1000), ('NAXIS2', 1000),
+            ('CTYPE1', 'RA---TAN'), ('CTYPE2', 'DEC--TAN'),
+            ('CRPIX1', 500.), ('CRPIX2', 500.),
+            ('CRVAL1', 150.), ('CRVAL2', 30.),
+            ('CUNIT1', 'deg'), ('CUNIT2', 'deg'),
+            ('CD1_1', -scale * c), ('CD1_2', scale * s),
+            ('CD2_1', scale * s), ('CD2_2', scale * c)]:
+        header[key] = value
+    return fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(
+        data=np.zeros((1000, 1000), dtype='u1'), header=header)])
+
+
+def _edge_distance(xs, ys, shape):
+    # distance of the points to the edges of the pyregion image shape
+    if shape.name == 'circle':
+        x0, y0, r = shape.coord_list[:3]
+        return np.abs(np.hypot(xs - x0, ys - y0) - r)
+    if shape.name == 'ellipse':
+        x0, y0, a, b, angle = shape.coord_list[:5]
+        ca, sa = np.cos(np.deg2rad(angle)), np.sin(np.deg2rad(angle))
+        u = (xs - x0) * ca + (ys - y0) * sa
+        v = (ys - y0) * ca - (xs - x0) * sa
+        return np.abs(np.hypot(u / a, v / b) - 1.) * min(a, b)
+    if shape.name == 'box':
+        x0, y0, w, h, angle = shape.coord_list[:5]
+        ca, sa = np.cos(np.deg2rad(angle)), np.sin(np.deg2rad(angle))
+        u = np.array([-0.5, 0.5, 0.5, -0.5]) * w
+        v = np.array([-0.5, -0.5, 0.5, 0.5]) * h
+        verts = np.column_stack([x0 + u * ca - v * sa, y0 + u * sa + v * ca])
+    else:
+        verts = np.reshape(shape.coord_list, (-1, 2))
+    a = verts
+    d = np.roll(verts, -1, axis=0) - a
+    px = xs[:, None] - a[:, 0]
+    py = ys[:, None] - a[:, 1]
+    t = np.clip((px * d[:, 0] + py * d[:, 1]) / (d ** 2).sum(axis=1), 0, 1)
+    return np.hypot(px - t * d[:, 0], py - t * d[:, 1]).min(axis=1)
+
+
+def _check_regmask(tmpdir, region, hdulist, tol):
+    import pyregion
+    from ..phot_calib import get_regmask
+    region_file = tmpdir.join('test.reg')
+    region_file.write(region)
+    xs, ys = np.random.RandomState(0).uniform(1., 1000., (2, 5000))
+    exts = np.ones(len(xs), dtype=int)
+    mask = get_regmask(xs, ys, exts, hdulist, [str(region_file)])
+    # the previous per-point results. The filters of pyregion take the
+    # zero-based pixel coordinates, while the catalog and the regions are
+    # one-based
+    shapes = pyregion.open(str(region_file)).as_imagecoord(
+            hdulist[1].header)
+    filter_ = shapes.get_filter()
+    expected = np.array([
+        not filter_.inside1(x - 1., y - 1.) for x, y in zip(xs, ys)])
+    # the curved edges are approximated by the polygons
+    far = np.all([_edge_distance(xs, ys, s) > tol for s in shapes], axis=0)
+    assert (~expected).sum() > 100
+    assert np.array_equal(mask[far], expected[far])
+    return shapes
+
+
+def test_regmask_image(tmpdir):
+    pytest.importorskip('pyregion')
+    _check_regmask(tmpdir, "\n".join([
+        'image',
+        'polygon(100,100,300,120,250,300,120,250)',
+        'circle(600,600,80)',
+        'box(300,700,100,60,30)',
+        'ellipse(750,250,100,50,45)',
+        ]), _chip_hdulist(), 0.5)
+
+
+@pytest.mark.parametrize('rotation', [0., 20.])
+def test_regmask_sky(tmpdir, rotation):
+    pytest.importorskip('pyregion')
+    # the pixel scale is 0.25 arcsec, the image is centered at (150, 30)
+    shapes = [
+        'polygon(150.016,29.984,149.996,29.986,150.001,30.004,150.014,'
+        '29.999)',
+        'circle(149.99,30.01,20")',
+        ]
+    # pyregion takes the parity of the image from CDELT, which is not
+    # set with the CD matrix, so the angles of the shapes are only right
+    # for the north-up images
+    if rotation == 0.:
+        shapes.append('box(150.0,29.99,25",15",30)')
+    _check_regmask(tmpdir, "\n".join(['fk5'] + shapes),
+                   _chip_hdulist(rotation), 1.)
+
+
+def test_regmask_boundary(tmpdir):
+    pytest.importorskip('pyregion')
+    from ..phot_calib import get_regmask, shape_to_polygon
+    region_file = tmpdir.join('test.reg')
+    region_file.write("image\npolygon(100,100,300,100,200,300)\n"
+                      "box(600,600,100,60,0)\ncircle(300,700,50)\n")
+    circle = shape_to_polygon('circle', [300, 700, 50], 'image')
+    # the vertices and the points on the edges are masked
+    xs = np.r_[100, 200, 300, 150, 250, 550, 600, 650, 650, circle[:, 0]]
+    ys = np.r_[100, 100, 100, 200, 200, 600, 570, 630, 600, circle[:, 1]]
+    mask = get_regmask(
+            xs, ys, np.ones(len(xs), dtype=int), _chip_hdulist(),
+            [str(region_file)])
+    assert not mask.any()
+    # the points just outside are not
+    xs = np.r_[99.99, 200, 149.99, 549.99, 600, 300]
+    ys = np.r_[100, 99.99, 200, 600, 630.01, 750.01]
+    mask = get_regmask(
+            xs, ys, np.ones(len(xs), dtype=int), _chip_hdulist(),
+            [str(region_file)])
+    assert mask.all()
@@ -0,0 +1,36 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 14:40
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+test_prep_jobdiff.py
+"""
+
+
+def test_jobdiff(tmpdir):
+    from ..prep_jobdiff import JobDiff
+
+    def rows(groups):
+        return {obsid: {'OBSID': obsid, 'phot_group': str(g)}
+                for obsid, g in groups.items()}
+
+    jobdir = str(tmpdir)
+    jobdiff = JobDiff(jobdir, rows({'a': 0, 'b': 0, 'c': 1}))
+    assert sorted(jobdiff.changes('phot', ['phot_group']).added) == [
+            'a', 'b', 'c']
+    jobdiff.commit('phot', ['phot_group'])
+
+    jobdiff = JobDiff(jobdir, rows({'a': 0, 'b': 1, 'd': 1}))
+    changes = jobdiff.changes('phot', ['phot_group'])
+    assert changes.added == ['d']
+    assert changes.removed == ['c']
+    assert changes.changed == ['b']
+    assert changes.unchanged == ['a']
+    assert jobdiff.previous('phot')['b']['phot_group'] == '0'
+    # other consumers are independent
+    assert jobdiff.changes('fsub', ['fsub_group']).added
+
+    jobdiff.mark_dirty('phot', ['0', '-1', 1])
+    assert jobdiff.pop_dirty('phot') == {0, 1}
+    assert jobdiff.pop_dirty('phot') == set()
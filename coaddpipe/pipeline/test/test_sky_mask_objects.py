@@ -0,0 +1,46 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 23:30
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+test_sky_mask_objects.py
+"""
+
+import warnings
+
+import numpy as np
+from astropy.io import fits
+
+
+def _baseline_apply_segment_mask(hdu, segdata):
+    from scipy.ndimage import binary_dilation
+    mask = binary_dilation(segdata, iterations=10)
+    hdu.data[mask] = np.nan
+    data = hdu.data
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore', ".+", RuntimeWarning)
+        bkg = np.nanmedian(data) * 3 - np.nanmean(data) * 2
+        std = np.nanstd(data)
+        hdu.data[np.isnan(data) | (data < bkg - 10 * std)] = np.nan
+
+
+def test_apply_segment_mask():
+    from ..sky_mask_objects import apply_segment_mask
+    rng = np.random.RandomState(0)
+    data = rng.normal(1000., 20., (300, 200)).astype('f4')
+    segdata = np.zeros(data.shape, dtype='i4')
+    # objects
+    for y, x in rng.randint(20, 180, (15, 2)):
+        data[y - 3:y + 3, x - 3:x + 3] += 5000.
+        segdata[y - 3:y + 3, x - 3:x + 3] = 1
+    # the low value edges and bad pixels
+    data[:, :6] = rng.uniform(0., 900., (300, 6))
+    data[-4:] = 200.
+    data[::17, ::13] = np.nan
+    hdu = fits.ImageHDU(data=data.copy())
+    expected = fits.ImageHDU(data=data.copy())
+    apply_segment_mask(hdu, segdata)
+    _baseline_apply_segment_mask(expected, segdata)
+    assert np.isnan(hdu.data).any()
+    assert np.array_equal(np.isnan(hdu.data), np.isnan(expected.data))
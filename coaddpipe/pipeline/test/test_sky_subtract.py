@@ -0,0 +1,27 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 10:02
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+test_sky_subtract.py
+"""
+
+
+def test_fit_fringe_amplitude():
+    import numpy as np
+    from ..sky_subtract import fit_fringe_amplitude
+    x = np.linspace(-1, 1, 101)
+    y = 2.0 * x + np.random.RandomState(0).normal(0, 0.01, len(x))
+    y[1::10] += 5.  # outliers
+    amp, stdev, nused = fit_fringe_amplitude(x, y)
+    assert abs(amp - 2.0) < 3 * stdev
+    assert nused == 101 - 11
+    assert fit_fringe_amplitude(x, y) == (amp, stdev, nused)
+    assert fit_fringe_amplitude(np.zeros(3), np.ones(3))[0] is None
+    # zero MAD does not clip all the points off the median
+    y = 2.0 * x
+    y[x > 0.6] += 0.01
+    y[x < -0.6] -= 0.01
+    amp, _, nused = fit_fringe_amplitude(x, y)
+    assert nused == 100 and abs(amp - 2.0) < 0.01
@@ -0,0 +1,172 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 18:20
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+png.py
+
+A minimal PNG writer with a bitmap font for the labels.
+
+The previews are 8-bit grayscale images encoded with zlib directly,
+which is much cheaper than drawing them with matplotlib.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+import os
+import zlib
+import struct
+import numpy as np
+
+
+__all__ = ['encode_png', 'write_png', 'gray_from_normalized', 'draw_text',
+           'text_size']
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# 3x5 glyphs, one row of pixels per group
+_FONT_TABLE = """
+0 111 101 101 101 111
+1 010 110 010 010 111
+2 111 001 111 100 111
+3 111 001 111 001 111
+4 101 101 111 001 001
+5 111 100 111 001 111
+6 111 100 111 101 111
+7 111 001 001 001 001
+8 111 101 111 101 111
+9 111 101 111 001 111
+A 010 101 111 101 101
+B 110 101 110 101 110
+C 011 100 100 100 011
+D 110 101 101 101 110
+E 111 100 110 100 111
+F 111 100 110 100 100
+G 011 100 101 101 011
+H 101 101 111 101 101
+I 111 010 010 010 111
+J 001 001 001 101 010
+K 101 101 110 101 101
+L 100 100 100 100 111
+M 101 111 111 101 101
+N 110 101 101 101 101
+O 010 101 101 101 010
+P 110 101 110 100 100
+Q 010 101 101 110 011
+R 110 101 110 101 101
+S 011 100 010 001 110
+T 111 010 010 010 010
+U 101 101 101 101 111
+V 101 101 101 101 010
+W 101 101 111 111 101
+X 101 101 010 101 101
+Y 101 101 010 010 010
+Z 111 001 010 100 111
+_ 000 000 000 000 111
+. 000 000 000 000 010
+- 000 000 111 000 000
+: 000 010 000 010 000
++ 000 010 111 010 000
+? 111 001 010 000 010
+"""
+
+FONT = {
+        line[0]: np.array([[c == '1' for c in row]
+                           for row in line[1:].split()])
+        for line in _FONT_TABLE.strip().split('\n')}
+FONT[' '] = np.zeros((5, 3), dtype=bool)
+
+
+def encode_png(image, level=3):
+    """
+    Return the PNG bytes of image
+
+    Parameters
+    ----------
+    image: array
+        The uint8 array of shape (h, w) for grayscale or (h, w, 3) for
+        RGB. The first row is the top of the image.
+    level: int
+        The zlib compression level.
+    """
+    image = np.ascontiguousarray(image, dtype='u1')
+    h, w = image.shape[:2]
+    if image.ndim == 2:
+        color_type = 0
+    elif image.ndim == 3 and image.shape[2] == 3:
+        color_type = 2
+    else:
+        raise ValueError("unsupported image shape {}".format(image.shape))
+    # each row is prefixed with the filter type 0
+    raw = np.zeros((h, 1 + image[0].size), dtype='u1')
+    raw[:, 1:] = image.reshape((h, -1))
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack(
+                '>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    return b''.join([
+        PNG_SIGNATURE,
+        chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8, color_type, 0, 0, 0)),
+        chunk(b'IDAT', zlib.compress(raw.tobytes(), level)),
+        chunk(b'IEND', b''),
+        ])
+
+
+def write_png(filename, image, **kwargs):
+    """Write image to filename as PNG, see `encode_png`"""
+    tmpname = "{}.{}.tmp".format(filename, os.getpid())
+    with open(tmpname, 'wb') as fo:
+        fo.write(encode_png(image, **kwargs))
+    os.rename(tmpname, filename)
+
+
+def gray_from_normalized(data):
+    """Return the uint8 grayscale of data normalized to [0, 1], in which
+    the values are mapped to black to white, and NaN to white"""
+    with np.errstate(invalid='ignore'):
+        gray = np.clip(data, 0., 1.) * 254.
+    return np.where(np.isfinite(gray), gray, 255.).astype('u1')
+
+
+def text_size(text, scale=1):
+    """Return the (height, width) of the text drawn by `draw_text`"""
+    return 5 * scale, max(4 * len(text) - 1, 0) * scale
+
+
+def draw_text(image, text, top, left, scale=1, value=0):
+    """
+    Draw text to image in place with the 3x5 bitmap font
+
+    Lower case letters are drawn as upper case, and the characters not
+    in the font as "?". The text is clipped at the image edges.
+
+    Parameters
+    ----------
+    image: array
+        The 2-d or 3-d uint8 image.
+    text: str
+        The text.
+    top, left: int
+        The position of the top left corner of the text.
+    scale: int
+        The size in pixels of the font pixels.
+    value: int or tuple
+        The value of the text pixels.
+    """
+    h, w = image.shape[:2]
+    block = np.ones((scale, scale), dtype=bool)
+    for i, c in enumerate(text):
+        glyph = np.kron(FONT.get(c.upper(), FONT['?']), block).astype(bool)
+        y0, x0 = int(top), int(left + 4 * i * scale)
+        y1, x1 = y0 + glyph.shape[0], x0 + glyph.shape[1]
+        # clip at the edges
+        gy0, gx0 = max(0, -y0), max(0, -x0)
+        gy1 = glyph.shape[0] - max(0, y1 - h)
+        gx1 = glyph.shape[1] - max(0, x1 - w)
+        if gy1 <= gy0 or gx1 <= gx0:
+            continue
+        image[y0 + gy0:y0 + gy1, x0 + gx0:x0 + gx1][
+                glyph[gy0:gy1, gx0:gx1]] = value
+    return image
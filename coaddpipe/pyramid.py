@@ -0,0 +1,226 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 18:50
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+pyramid.py
+
+The tiled multi-resolution preview of the images.
+
+Each 2-d extension is cut to PNG tiles at several binnings, e.g.,
+1, 4, 16 and 64. The extensions are read once in strips of rows, and
+each level is binned from the rows of the finer level, so only a few
+strips per level are held in memory.
+
+The pyramid of a product is a directory with the tiles at
+``<binning>/<extname>/<ty>_<tx>.png`` and the manifest ``pyramid.json``,
+which is written last. The tile indices start from the lower left of
+the extension, and the tiles are flipped so they display with the
+origin at the lower left.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+import os
+import json
+import numpy as np
+
+from .stats import bin_image, zscale
+from .png import write_png, gray_from_normalized
+
+
+__all__ = ['build_pyramid', 'read_pyramid', 'get_tile_path',
+           'PYRAMID_MANIFEST', 'DEFAULT_LEVELS']
+
+
+PYRAMID_MANIFEST = 'pyramid.json'
+
+DEFAULT_LEVELS = (1, 4, 16, 64)
+
+
+def get_tile_path(dirname, binning, extname, ty, tx):
+    """Return the path of the tile"""
+    return os.path.join(
+            dirname, str(binning), extname, "{}_{}.png".format(ty, tx))
+
+
+def _ceil_div(a, b):
+    return -(-a // b)
+
+
+class PyramidWriter(object):
+    """
+    Cut the rows of an extension, fed from bottom to top, to the tiles
+    of all levels
+
+    Parameters
+    ----------
+    dirname: str
+        The pyramid directory.
+    extname: str
+        The name of the extension.
+    width: int
+        The number of columns of the extension.
+    levels: list
+        The binnings, each a multiple of the previous one.
+    tile_size: int
+        The size of the tiles.
+    limits: tuple
+        The (vmin, vmax) mapped to black and white.
+    """
+
+    def __init__(self, dirname, extname, width, levels, tile_size, limits):
+        self.dirname = dirname
+        self.extname = extname
+        self.levels = list(levels)
+        self.tile_size = tile_size
+        self.limits = limits
+        self.factors = [self.levels[0]] + [
+                b // a for a, b in zip(self.levels[:-1], self.levels[1:])]
+        # the widths of the input rows and the levels
+        self.widths = [width] + [_ceil_div(width, b) for b in self.levels]
+        self.pending = [None] * len(self.levels)
+        self.rows = [None] * len(self.levels)
+        self.ntiles = [[0, _ceil_div(w, tile_size)] for w in self.widths[1:]]
+        for binning in self.levels:
+            d = os.path.dirname(get_tile_path(
+                dirname, binning, extname, 0, 0))
+            if not os.path.isdir(d):
+                os.makedirs(d, exist_ok=True)
+
+    def _concat(self, buf, rows):
+        if buf is None or len(buf) == 0:
+            return rows
+        return np.concatenate([buf, rows])
+
+    def feed(self, rows, k=0, final=False):
+        """Feed the rows to level k, and the binned rows to the next
+        levels"""
+        if k == len(self.levels):
+            return
+        rows = self._concat(self.pending[k], rows)
+        f = self.factors[k]
+        n = len(rows) if final else len(rows) // f * f
+        self.pending[k] = rows[n:]
+        if n == 0:
+            return
+        if f == 1:
+            binned = rows[:n]
+        else:
+            binned = bin_image(
+                    rows[:n], (_ceil_div(n, f), self.widths[k + 1]), f)
+        self._write_rows(k, binned)
+        self.feed(binned, k=k + 1)
+
+    def _write_rows(self, k, rows, final=False):
+        rows = self._concat(self.rows[k], rows)
+        size = self.tile_size
+        n = len(rows) if final else len(rows) // size * size
+        for y0 in range(0, n, size):
+            self._write_tile_row(k, rows[y0:min(y0 + size, n)])
+        self.rows[k] = rows[n:]
+
+    def _write_tile_row(self, k, rows):
+        vmin, vmax = self.limits
+        with np.errstate(invalid='ignore', divide='ignore'):
+            gray = gray_from_normalized((rows - vmin) / (vmax - vmin))
+        ty = self.ntiles[k][0]
+        for tx in range(self.ntiles[k][1]):
+            tile = gray[::-1, tx * self.tile_size:(tx + 1) * self.tile_size]
+            write_png(get_tile_path(
+                self.dirname, self.levels[k], self.extname, ty, tx), tile)
+        self.ntiles[k][0] += 1
+
+    def close(self):
+        """Write the remaining rows as partial tiles"""
+        for k in range(len(self.levels)):
+            self.feed(
+                    np.empty((0, self.widths[k]), dtype='f4'), k=k,
+                    final=True)
+            self._write_rows(
+                    k, np.empty((0, self.widths[k + 1]), dtype='f4'),
+                    final=True)
+        return self.ntiles
+
+
+def _get_extname(ext, hdu):
+    extname = hdu.header.get('EXTNAME', None)
+    if not extname:
+        return 'ext{}'.format(ext)
+    return str(extname).strip().replace(os.sep, '_')
+
+
+def build_pyramid(hdulist, dirname, levels=DEFAULT_LEVELS, tile_size=256,
+                  limits=None, strip_size=1024):
+    """
+    Build the tiled pyramid of the 2-d extensions of hdulist
+
+    Parameters
+    ----------
+    hdulist: `~astropy.io.fits.HDUList`
+        The image, preferably opened with memmap.
+    dirname: str
+        The pyramid directory.
+    levels: list
+        The binnings of the levels, each a multiple of the previous one.
+    tile_size: int
+        The size of the tiles.
+    limits: dict, optional
+        The (vmin, vmax) of the extensions, keyed by the extension
+        index. The zscale limits of a sparse sample of the data are used
+        for the extensions not in limits.
+    strip_size: int
+        The number of rows read at a time.
+
+    Returns
+    -------
+    manifest: dict
+        The content of the manifest.
+    """
+    levels = sorted(int(b) for b in levels)
+    if any(b % a for a, b in zip(levels[:-1], levels[1:])):
+        raise ValueError(
+                "pyramid levels {} are not multiples of each other".format(
+                    levels))
+    if limits is None:
+        limits = {}
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname, exist_ok=True)
+    extensions = []
+    for ext, hdu in enumerate(hdulist):
+        if hdu.header.get('NAXIS', 0) != 2:
+            continue
+        data = hdu.data
+        ny, nx = data.shape
+        if ext in limits:
+            vmin, vmax = limits[ext]
+        else:
+            step = max(1, int(np.sqrt(data.size / 1e6)))
+            vmin, vmax = zscale(data[::step, ::step])
+        extname = _get_extname(ext, hdu)
+        writer = PyramidWriter(
+                dirname, extname, nx, levels, tile_size, (vmin, vmax))
+        for y0 in range(0, ny, strip_size):
+            writer.feed(np.asarray(data[y0:y0 + strip_size], dtype='f4'))
+        ntiles = writer.close()
+        extensions.append(dict(
+            ext=ext, extname=extname, shape=[ny, nx],
+            vmin=float(vmin), vmax=float(vmax), ntiles=ntiles))
+    manifest = dict(
+            tile_size=tile_size, levels=levels, origin='lower',
+            extensions=extensions)
+    filename = os.path.join(dirname, PYRAMID_MANIFEST)
+    tmpname = filename + '.tmp'
+    with open(tmpname, 'w') as fo:
+        json.dump(manifest, fo)
+    os.rename(tmpname, filename)
+    return manifest
+
+
+def read_pyramid(dirname):
+    """Return the manifest of the pyramid, None if it is incomplete"""
+    filename = os.path.join(dirname, PYRAMID_MANIFEST)
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'r') as fo:
+        return json.load(fo)
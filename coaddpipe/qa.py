@@ -9,20 +9,21 @@ qa.py
 
 
 from .instruments import get_layout
+from .stats import bin_image, zscale
+from .png import write_png, gray_from_normalized, draw_text, text_size
+from .jobdir_layout import side_product_path
+from .utils import get_pyplot
+from .apus.common import get_log_func
+from .qa_queue import get_qa_mode, submit
+from .pyramid import build_pyramid
+from .sidecar import read_sidecar
 import os
 import logging
-import warnings
-from astropy.visualization import ZScaleInterval  # , PercentileInterval
-from astropy.visualization.mpl_normalize import ImageNormalize
 import numpy as np
 from astropy.io import fits
 # from astropy.stats import sigma_clip  # , mad_std
 # import itertools
-
-import matplotlib
-matplotlib.use("agg")
-# import matplotlib.image as mimg
-import matplotlib.pyplot as plt  # noqa: E402
+# matplotlib is imported in plot_preview on first use
 
 
 class Preview(object):
@@ -50,8 +51,148 @@ class Preview(object):
         raise NotImplementedError()
 
 
-def create_preview(hdulist=None, binning=8, filename=None, delete_data=True):
+def create_preview(hdulist=None, binning=8, filename=None, delete_data=True,
+                   stats=None):
+    """Create preview of the image.
+
+    If `stats` (a `~coaddpipe.sidecar.Sidecar`) is given and has the
+    same binning, the thumbnails and limits in it are used instead of
+    binning the data.
+    """
     logger = logging.getLogger("qa.preview")
+    data, binned_data, layout = bin_preview(
+            hdulist=hdulist, binning=binning, filename=filename,
+            delete_data=delete_data, stats=stats)
+    default_savename = data.pop('savename')
+    fig, ax = plot_preview(**data)
+    pr = Preview(
+            fig=fig, ax=ax, logger=logger, default_savename=default_savename,
+            binning=binning, binned_data=binned_data,
+            mask_chips=(),
+            preview_data=data['preview_data'],
+            layout=layout)
+    return pr
+
+
+def submit_preview(kwargs, **preview_kwargs):
+    """Bin the image and submit the preview to render per the QA mode in
+    kwargs, see `~coaddpipe.qa_queue.submit`.
+
+    preview_kwargs are passed to `bin_preview`.
+    """
+    if get_qa_mode(kwargs) == 'off':
+        return
+    data, _, _ = bin_preview(**preview_kwargs)
+    submit(data['savename'], render_preview, (data, ), kwargs)
+
+
+def render_preview(data, kwargs):
+    """Render and save the preview from the data returned by
+    `bin_preview`, without matplotlib"""
+    log = get_log_func(default_level='debug', **kwargs)
+    image = preview_image(**{k: data[k] for k in [
+        'preview_data', 'tick_x', 'tick_y', 'ticklabel_x', 'ticklabel_y',
+        'title']})
+    write_png(data['savename'], image)
+    log('save preview to {0}'.format(data['savename']))
+
+
+def preview_image(preview_data, tick_x, tick_y, ticklabel_x, ticklabel_y,
+                  title, scale=None):
+    """Return the grayscale preview image with the labels drawn aside.
+
+    NaN are white, and the normalized values in [0, 1] are mapped to
+    black to white.
+    """
+    ny, nx = preview_data.shape
+    if scale is None:
+        scale = max(2, min(nx, ny) // 200)
+    pad = 2 * scale
+    label_h, label_w = text_size(
+            max(ticklabel_y, key=len) if ticklabel_y else '', scale)
+    title_h, _ = text_size(title, scale)
+    top = title_h + 2 * pad
+    left = label_w + 2 * pad
+    image = np.full(
+            (top + ny + label_h + 2 * pad, left + nx + pad), 255, dtype='u1')
+    # origin at lower left
+    image[top:top + ny, left:left + nx] = gray_from_normalized(
+            preview_data)[::-1]
+    for x, label in zip(tick_x, ticklabel_x):
+        _, w = text_size(label, scale)
+        draw_text(image, label, top + ny + pad, left + x - w // 2, scale)
+    for y, label in zip(tick_y, ticklabel_y):
+        h, w = text_size(label, scale)
+        draw_text(image, label, top + ny - 1 - y - h // 2, left - pad - w,
+                  scale)
+    _, w = text_size(title, scale)
+    draw_text(image, title, pad, max(left + (nx - w) // 2, 0), scale)
+    return image
+
+
+def get_pyramid_dir(filename):
+    """Return the pyramid directory of the image, see
+    `~coaddpipe.pyramid`"""
+    filenamebase = os.path.basename(filename).rsplit(".fz", 1)[0].rsplit(
+            ".fits", 1)[0]
+    return side_product_path(
+            os.path.join(os.path.dirname(filename),
+                         filenamebase + '.pyramid'),
+            'preview', create=True)
+
+
+def render_pyramid(filename, dirname, levels, kwargs):
+    """Build the pyramid of the image in dirname. The zscale limits in
+    the sidecar are used if present."""
+    log = get_log_func(default_level='debug', **kwargs)
+    sidecar = read_sidecar(filename)
+    limits = None
+    if sidecar is not None:
+        limits = {int(e): (sidecar.get(e, 'vmin'), sidecar.get(e, 'vmax'))
+                  for e in sidecar.data['ext']}
+    with fits.open(filename, memmap=True) as hdulist:
+        manifest = build_pyramid(hdulist, dirname, levels=levels,
+                                 limits=limits)
+    log("save pyramid of {} extensions to {}".format(
+        len(manifest['extensions']), dirname))
+
+
+def submit_pyramid(kwargs, filename):
+    """Submit the pyramid of the image to render per the QA mode in
+    kwargs, if the ``qa_pyramid`` levels are set"""
+    levels = kwargs.get('qa_pyramid', None)
+    if not levels or get_qa_mode(kwargs) == 'off':
+        return
+    dirname = get_pyramid_dir(filename)
+    submit(dirname, render_pyramid,
+           (os.path.abspath(filename), dirname, list(levels)), kwargs)
+
+
+def pyramid_task(*args, **kwargs):
+    """Build the pyramid of the first input image in the directory of the
+    output manifest"""
+    in_file, out_file = args[0], args[-1]
+    render_pyramid(in_file, os.path.dirname(out_file), kwargs['qa_pyramid'],
+                   kwargs)
+
+
+def bin_preview(hdulist=None, binning=8, filename=None, delete_data=True,
+                stats=None):
+    """Bin the image to the preview mosaic.
+
+    Returns
+    -------
+    data: dict
+        The normalized mosaic, the ticks, the title and the default
+        savename of the preview, to be rendered by `render_preview`.
+    binned_data: ndarray
+        The stacked binned chips.
+    layout: Layout
+        The layout of the image.
+    """
+    logger = logging.getLogger("qa.preview")
+    if stats is not None and stats.binning != binning:
+        stats = None
 
     if hdulist is None and filename is not None:
         hdulist = fits.open(filename, memmap=True)
@@ -75,74 +216,66 @@ def create_preview(hdulist=None, binning=8, filename=None, delete_data=True):
     (_, size_x), (_, size_y) = layout.tile_rect(
             layout.NCX - 1, layout.NCY - 1)
     size_x, size_y = map(int, (size_x, size_y))
-    preview_data = np.empty((size_y, size_x), dtype='f') * np.nan
+    preview_data = np.full((size_y, size_x), np.nan, dtype='f')
     binned_data = []
     l0, b0 = layout.xy_from_txy(
             layout.CX[0], layout.CY[0],
             0, 0)  # offset to left bottom corner
-    for _, chip, hdu in layout.enumerate(hdulist):
-        bin_shape = tuple(map(int, (layout.CH, binning, layout.CW, binning)))
-        data_shape = (
-                int(bin_shape[0] * bin_shape[1]),
-                int(bin_shape[1] * bin_shape[2]))
-        data = np.empty(data_shape) * np.nan
-        copy_shape = (
-                min(data.shape[0], hdu.data.shape[0]),
-                min(data.shape[1], hdu.data.shape[1]))
-        data[:copy_shape[0], :copy_shape[1]] = hdu.data[
-                :copy_shape[0], :copy_shape[1]]
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore", category=RuntimeWarning)
-            binned = np.nanmean(
-                    np.nanmean(
-                        np.reshape(data, bin_shape), axis=-1), axis=1)
-        # binned[0:100, 0:100] = np.nan
-        interval = ZScaleInterval()
-        # interval = PercentileInterval(99)
-        try:
-            vmin, vmax = interval.get_limits(binned)
-        except IndexError:
-            vmin, vmax = np.min(binned), np.max(binned)
-        norm = ImageNormalize(vmin=vmin, vmax=vmax)
-
+    for ext, chip, hdu in layout.enumerate(hdulist):
+        if stats is not None and ext in stats:
+            entry = stats.get(ext)
+            binned = entry['thumbnail']
+            vmin, vmax = entry['vmin'], entry['vmax']
+        else:
+            binned = bin_image(hdu.data, (layout.CH, layout.CW), binning)
+            vmin, vmax = zscale(binned)
         l, b = layout.xy_from_chip(chip, 0, 0)
         l = int(l - l0)  # noqa: E741
         b = int(b - b0)
-        preview_data[b:b + binned.shape[0], l:l + binned.shape[1]] = norm(
-                binned)
+        # linear stretch
+        with np.errstate(invalid='ignore', divide='ignore'):
+            preview_data[b:b + binned.shape[0], l:l + binned.shape[1]] = (
+                    binned - vmin) / (vmax - vmin)
         binned_data.append(binned)
-        if hdulist._file.memmap and delete_data:
+        if stats is None and hdulist._file.memmap and delete_data:
             del hdu.data  # possibly free some memory
     binned_data = np.dstack(binned_data)
 
     # guide_otas = find_guide_otas(
     #         binned_data, layout, thresh=10, logger=logger)
 
-    # preview figure
-    fig = plt.figure(figsize=(2 * layout.NCX, 2 * layout.NCY))
-    ax = fig.add_subplot(1, 1, 1)
-    ax.imshow(preview_data, vmin=0, vmax=1, origin='lower', aspect=1)
     tick_x, tick_y = layout.tile_bins()
-    tick_x = [(x[0] + x[1]) * 0.5 for x in tick_x][:layout.NCX]
-    tick_y = [(y[0] + y[1]) * 0.5 for y in tick_y][:layout.NCY]
-    ax.yaxis.set_ticks(tick_y)
-    ax.yaxis.set_ticklabels(['Y{0}'.format(j) for j
-                             in range(*layout.CY)])
-    ax.xaxis.set_ticks(tick_x)
-    ax.xaxis.set_ticklabels(['X{0}'.format(j) for j
-                             in range(*layout.CX)])
-    ax.set_title(filenamebase)
-
-    default_savename = os.path.join(dirname, filenamebase + '.png')
-    pr = Preview(
-            fig=fig, ax=ax, logger=logger, default_savename=default_savename,
-            binning=binning, binned_data=binned_data,
-            mask_chips=(),
+    default_savename = side_product_path(
+            os.path.join(dirname, filenamebase + '.png'), 'preview',
+            create=True)
+    data = dict(
             preview_data=preview_data,
-            layout=layout)
+            figsize=(2 * layout.NCX, 2 * layout.NCY),
+            tick_x=[(x[0] + x[1]) * 0.5 for x in tick_x][:layout.NCX],
+            tick_y=[(y[0] + y[1]) * 0.5 for y in tick_y][:layout.NCY],
+            ticklabel_x=['X{0}'.format(j) for j in range(*layout.CX)],
+            ticklabel_y=['Y{0}'.format(j) for j in range(*layout.CY)],
+            title=filenamebase,
+            savename=default_savename,
+            )
     if close_after:
         hdulist.close()
-    return pr
+    return data, binned_data, layout
+
+
+def plot_preview(preview_data, figsize, tick_x, tick_y,
+                 ticklabel_x, ticklabel_y, title):
+    """Return the figure and axes of the preview"""
+    plt = get_pyplot()
+    fig = plt.figure(figsize=figsize)
+    ax = fig.add_subplot(1, 1, 1)
+    ax.imshow(preview_data, vmin=0, vmax=1, origin='lower', aspect=1)
+    ax.yaxis.set_ticks(tick_y)
+    ax.yaxis.set_ticklabels(ticklabel_y)
+    ax.xaxis.set_ticks(tick_x)
+    ax.xaxis.set_ticklabels(ticklabel_x)
+    ax.set_title(title)
+    return fig, ax
 
 
 # if __name__ == "__main__":
@@ -0,0 +1,176 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 17:40
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+qa_queue.py
+
+The QA rendering queue.
+
+The stages hand the data of the QA plots, e.g., the binned preview
+mosaic or the matched catalogs, to `submit`, which acts per the QA mode
+passed to the stages as ``qa_mode``:
+
+- ``inline``: render in the stage. This is the default for stages that
+  are run outside of the pipeline.
+- ``deferred``: write a job to the queue dir ``qa_queue``, which is
+  drained by the final task of the pipeline with `render_qa`.
+- ``off``: skip.
+
+A job is the plotting function, referenced by name, and its arguments.
+The plotting functions take the logging kwargs as the last argument.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+import os
+import pickle
+import hashlib
+import importlib
+
+from .apus.common import get_log_func
+
+
+QA_QUEUE_DIR = 'qa_queue'
+
+QA_MODES = ('inline', 'deferred', 'off')
+
+
+def get_queue_dir(jobdir):
+    """Return the QA queue dir of jobdir"""
+    return os.path.join(jobdir, QA_QUEUE_DIR)
+
+
+def get_qa_mode(kwargs):
+    """Return the QA mode in the task kwargs"""
+    mode = kwargs.get('qa_mode', None) or 'inline'
+    if mode not in QA_MODES:
+        raise ValueError("unknown QA mode {}".format(mode))
+    return mode
+
+
+def submit(key, func, args, kwargs):
+    """
+    Render the QA plot ``func(*args, kwargs)`` per the QA mode in kwargs
+
+    Parameters
+    ----------
+    key: str
+        The key of the QA plot, typically the savename. A pending job of
+        the same key is replaced.
+    func: callable
+        The module level plotting function.
+    args: tuple
+        The arguments to func. They have to be picklable when deferred.
+    kwargs: dict
+        The task kwargs, which provide the QA mode, the queue dir and the
+        logger.
+    """
+    log = get_log_func(default_level='debug', **kwargs)
+    mode = get_qa_mode(kwargs)
+    if mode == 'off':
+        log("skip QA {}".format(key))
+    elif mode == 'inline':
+        func(*args, kwargs)
+    else:
+        jobfile = enqueue(kwargs['qa_queue'], key, func, args)
+        log("defer QA {} to {}".format(key, jobfile))
+
+
+def _get_jobfile(queue_dir, key):
+    return os.path.join(queue_dir, "{}.pkl".format(
+        hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]))
+
+
+def enqueue(queue_dir, key, func, args):
+    """Write the job to queue_dir and return the job file"""
+    if not os.path.isdir(queue_dir):
+        os.makedirs(queue_dir, exist_ok=True)
+    jobfile = _get_jobfile(queue_dir, key)
+    tmpname = "{}.{}.tmp".format(jobfile, os.getpid())
+    with open(tmpname, 'wb') as fo:
+        pickle.dump({
+            'key': key,
+            'module': func.__module__,
+            'name': func.__name__,
+            'args': tuple(args),
+            }, fo, protocol=pickle.HIGHEST_PROTOCOL)
+    os.rename(tmpname, jobfile)
+    return jobfile
+
+
+def pending(queue_dir):
+    """Return the job files in queue_dir, oldest first"""
+    if not os.path.isdir(queue_dir):
+        return []
+    jobfiles = []
+    with os.scandir(queue_dir) as it:
+        for d in it:
+            if d.name.endswith('.pkl'):
+                jobfiles.append((d.stat().st_mtime_ns, d.path))
+    return [f for _, f in sorted(jobfiles)]
+
+
+def drain(queue_dir, kwargs):
+    """
+    Render the pending jobs in queue_dir
+
+    Failed jobs are logged and dropped, so that they do not block the
+    pipeline.
+
+    Returns
+    -------
+    rendered, failed: list
+        The keys of the rendered and failed jobs.
+    """
+    log = get_log_func(default_level='debug', **kwargs)
+    rendered = []
+    failed = []
+    for jobfile in pending(queue_dir):
+        try:
+            st = os.stat(jobfile)
+            with open(jobfile, 'rb') as fo:
+                job = pickle.load(fo)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            log('warning', "unable to load QA job {}".format(jobfile))
+            continue
+        try:
+            func = getattr(
+                    importlib.import_module(job['module']), job['name'])
+            func(*job['args'], kwargs)
+        except Exception as e:
+            log('warning', "failed to render QA {}: {}".format(
+                job['key'], e))
+            failed.append(job['key'])
+        else:
+            rendered.append(job['key'])
+        # keep the job if it is replaced during rendering
+        try:
+            if os.stat(jobfile).st_mtime_ns == st.st_mtime_ns:
+                os.remove(jobfile)
+        except OSError:
+            pass
+    return rendered, failed
+
+
+def render_qa(out_file, **kwargs):
+    """Render the pending QA plots and write the list of them to out_file"""
+    log = get_log_func(default_level='debug', **kwargs)
+    rendered, failed = drain(kwargs['qa_queue'], kwargs)
+    log("{} QA plots rendered, {} failed".format(len(rendered), len(failed)))
+    with open(out_file, 'w') as fo:
+        for key in rendered:
+            fo.write("{}\n".format(key))
+
+
+def check_qa_queue(*args, **kwargs):
+    """Return whether the render task is out of date, i.e., the queue has
+    pending jobs"""
+    out_file, context = args[-2:]
+    queue_dir = context['task']['kwargs']['qa_queue']
+    njobs = len(pending(queue_dir))
+    if njobs > 0:
+        return True, "{} pending QA jobs".format(njobs)
+    if not os.path.exists(out_file):
+        return True, "missing file {}".format(out_file)
+    return False, "no pending QA jobs"
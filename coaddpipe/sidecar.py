@@ -0,0 +1,180 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 11:10
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+sidecar.py
+
+Per-exposure statistics stored aside the fits products.
+
+The sidecar ``<product>.stats.npz`` holds for each chip the sky mode,
+robust sigma, valid fraction, zscale limits and a binned thumbnail. It
+is keyed by a hash of the product so stale sidecars are ignored.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+import os
+import hashlib
+import numpy as np
+from astropy.io import fits
+
+from .instruments import get_layout
+from . import stats
+from .jobdir_layout import side_product_path
+
+
+SIDECAR_SUFFIX = '.stats.npz'
+
+
+def get_sidecar_name(filename, create=False):
+    """Return the sidecar filename of the product
+
+    The sidecar is placed according to the layout of the directory of the
+    product, see `~coaddpipe.jobdir_layout`.
+    """
+    return side_product_path(
+            os.path.realpath(filename) + SIDECAR_SUFFIX, 'stats',
+            create=create)
+
+
+def product_hash(filename):
+    """
+    Return the hash of the product
+
+    The hash is computed from the size, mtime and the first header block
+    of the file that filename resolves to.
+    """
+    filename = os.path.realpath(filename)
+    st = os.stat(filename)
+    h = hashlib.sha1("{}:{}".format(st.st_size, st.st_mtime_ns).encode())
+    with open(filename, 'rb') as fo:
+        h.update(fo.read(2880))
+    return h.hexdigest()
+
+
+class Sidecar(object):
+    """
+    A thin wrapper of the sidecar content
+    """
+    def __init__(self, data):
+        self.data = data
+        self._index = {int(e): i for i, e in enumerate(data['ext'])}
+
+    def __contains__(self, ext):
+        return int(ext) in self._index
+
+    def get(self, ext, key=None):
+        """Return the entry of ext as dict, or the value of key; None if
+        ext is not in the sidecar"""
+        i = self._index.get(int(ext), None)
+        if i is None:
+            return None
+        if key is not None:
+            return self.data[key][i]
+        return {k: v[i] for k, v in self.data.items()
+                if k not in ('hash', 'binning')}
+
+    @property
+    def binning(self):
+        return int(self.data['binning'])
+
+
+def sky_level(data, max_size=int(1e6)):
+    """
+    Return the sky mode and robust sigma of the chip data, as recorded in
+    the sidecar
+
+    Parameters
+    ----------
+    data: array
+        The chip data. Non-finite values are ignored.
+    max_size: int
+        The number of values sampled to compute the statistics.
+    """
+    sky = stats.sky_stats(data, max_size=max_size)
+    return sky.mode, sky.mad
+
+
+def compute_sidecar(hdulist, binning=8, max_size=int(1e6)):
+    """
+    Compute the sidecar content of hdulist
+
+    Parameters
+    ----------
+    hdulist: `~astropy.io.fits.HDUList`
+        The product to compute the statistics.
+    binning: int
+        The binning of the thumbnails.
+    max_size: int
+        The number of values sampled to compute the statistics of each chip.
+
+    Returns
+    -------
+    data: dict
+        The arrays to be saved in the sidecar.
+    """
+    layout = get_layout(hdulist, binning=binning)
+    shape = (layout.CH, layout.CW)
+    rows = []
+    for ext, chip, hdu in layout.enumerate(hdulist):
+        data = hdu.data
+        valid = stats.finite_values(data)
+        frac = len(valid) / data.size if data.size > 0 else 0.
+        mode, sigma = sky_level(valid, max_size=max_size)
+        thumb = stats.bin_image(data, shape, binning)
+        vmin, vmax = stats.zscale(thumb)
+        rows.append((ext, chip, mode, sigma, frac, vmin, vmax, thumb))
+    ext, chip, mode, sigma, frac, vmin, vmax, thumb = zip(*rows)
+    return dict(
+            ext=np.array(ext, dtype='i4'),
+            chip=np.array(chip, dtype='U16'),
+            mode=np.array(mode, dtype='d'),
+            sigma=np.array(sigma, dtype='d'),
+            valid=np.array(frac, dtype='d'),
+            vmin=np.array(vmin, dtype='d'),
+            vmax=np.array(vmax, dtype='d'),
+            thumbnail=np.array(thumb, dtype='f4'),
+            binning=np.array(binning, dtype='i4'),
+            )
+
+
+def write_sidecar(filename, hdulist=None, **kwargs):
+    """
+    Compute and write the sidecar of product filename
+
+    The product has to be written to disk before calling this, since the
+    hash is computed from the file.
+    """
+    close_after = hdulist is None
+    if hdulist is None:
+        hdulist = fits.open(filename, memmap=True)
+    try:
+        data = compute_sidecar(hdulist, **kwargs)
+    finally:
+        if close_after:
+            hdulist.close()
+    data['hash'] = np.array(product_hash(filename))
+    outname = get_sidecar_name(filename, create=True)
+    tmpname = outname + '.tmp.npz'
+    np.savez(tmpname, **data)
+    os.rename(tmpname, outname)
+    return Sidecar(data)
+
+
+def read_sidecar(filename):
+    """
+    Return the `Sidecar` of product filename
+
+    None is returned if the sidecar does not exist or is outdated.
+    Symbolic links are resolved so the sidecar of the linked product is
+    used.
+    """
+    sidecar_name = get_sidecar_name(filename)
+    if not os.path.exists(sidecar_name):
+        return None
+    with np.load(sidecar_name) as fo:
+        data = {k: fo[k] for k in fo.files}
+    if str(data.get('hash', '')) != product_hash(filename):
+        return None
+    return Sidecar(data)
@@ -0,0 +1,445 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 10:20
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+stats.py
+
+Fast robust statistics of sky levels.
+
+The estimators work on the finite values of the data, read in one pass
+into a fixed size histogram, so that the median, MAD and mode of a full
+extension do not need a sort of the pixel values.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+import itertools
+from collections import namedtuple
+import numpy as np
+
+
+__all__ = ['SkyStats', 'sky_stats', 'finite_values', 'subsample',
+           'nanmedian', 'nanmedian_rows', 'nanpercentile', 'iter_cell_bins',
+           'cell_stats', 'bin_image', 'zscale']
+
+
+SkyStats = namedtuple(
+        'SkyStats', ['mean', 'median', 'mode', 'std', 'mad', 'n'])
+"""The statistics returned by `sky_stats`.
+
+mode is the Pearson estimate ``3 * median - 2 * mean``, and mad is
+the median absolute deviation scaled to be the equivalent of the standard
+deviation for normal distribution.
+"""
+
+MAD_TO_STD = 1.4826
+
+
+def finite_values(data, mask=None):
+    """
+    Return the finite values of data as a flat array
+
+    Parameters
+    ----------
+    data: array
+        The input array.
+    mask: bool array, optional
+        If given, only the values where mask is True are used.
+
+    Returns
+    -------
+    values: array
+        The flat array of finite values. This is a view of data
+        when no value is rejected.
+    """
+    data = np.asanyarray(data)
+    if mask is not None:
+        data = data[mask]
+    data = data.ravel()
+    # fast path: the sum is nan/inf only if there is non-finite value
+    with np.errstate(all='ignore'):
+        total = np.add.reduce(data, dtype='d')
+    if np.isfinite(total):
+        return data
+    return data[np.isfinite(data)]
+
+
+def subsample(values, max_size):
+    """
+    Return a deterministic subsample of values with at most max_size items
+
+    The subsample is taken with a constant stride so that the result is
+    reproducible and spread over the full array.
+    """
+    if max_size is None or len(values) <= max_size:
+        return values
+    step = int(np.ceil(len(values) / max_size))
+    return values[::step]
+
+
+def nanmedian(data):
+    """Median of the finite values of data, nan if there is none"""
+    values = finite_values(data)
+    if len(values) == 0:
+        return np.nan
+    return np.median(values)
+
+
+def nanmedian_rows(stack):
+    """
+    Median of the finite values of each row of the 2-d stack, nan for the
+    rows of no finite value
+
+    The rows are sorted in place in one call. The infinite values are
+    replaced by NaN first, so that all the non-finite values are sorted to
+    the end.
+    """
+    nrows, ncols = stack.shape
+    if ncols == 0:
+        return np.full(nrows, np.nan)
+    if stack.dtype.kind == 'f':
+        stack[~np.isfinite(stack)] = np.nan
+    stack.sort(axis=1)
+    n = np.count_nonzero(np.isfinite(stack), axis=1)
+    rows = np.arange(nrows)
+    lo = stack[rows, np.maximum((n - 1) // 2, 0)].astype('d')
+    hi = stack[rows, n // 2].astype('d')
+    with np.errstate(invalid='ignore'):
+        return np.where(n > 0, 0.5 * (lo + hi), np.nan)
+
+
+def nanpercentile(data, q):
+    """Percentiles of the finite values of data, computed in one
+    partition for all the q"""
+    values = finite_values(data)
+    if len(values) == 0:
+        return np.full(np.shape(q), np.nan)
+    return np.percentile(values, q)
+
+
+def sky_stats(data, mask=None, nbins=4096, max_size=None, range_size=10000,
+              range_sigma=10.):
+    """
+    Compute the robust statistics of data
+
+    The values are binned in a histogram whose range is determined from the
+    median and MAD of a sparse subsample of the data. The median and MAD
+    are interpolated from the cumulative distribution, and the mean and
+    standard deviation are computed from the exact sums. When the
+    subsample has fewer distinct values than nbins, e.g., for the integer
+    valued or near constant data, of which the bin edges fall between the
+    discrete values and bias the interpolation, the values are counted by
+    the discrete levels instead, and the median and MAD are exact.
+
+    Parameters
+    ----------
+    data: array
+        The input array. Non-finite values are ignored.
+    mask: bool array, optional
+        If given, only the values where mask is True are used.
+    nbins: int
+        The number of bins of the histogram.
+    max_size: int, optional
+        If given, the data are subsampled to at most this number of values
+        before computing the statistics.
+    range_size: int
+        The size of the subsample used to determine the histogram range.
+    range_sigma: float
+        The half width of the histogram range in unit of the MAD of the
+        subsample. Values outside of the range are still counted.
+
+    Returns
+    -------
+    stats: SkyStats
+        The statistics. All entries are nan if there is no finite value.
+    """
+    values = subsample(finite_values(data, mask=mask), max_size)
+    n = len(values)
+    if n == 0:
+        return SkyStats(*([np.nan] * 5 + [0]))
+    total = np.add.reduce(values, dtype='d')
+    mean = total / n
+    std = np.sqrt(max(
+        np.add.reduce(np.square(values, dtype='d')) / n - mean ** 2, 0.))
+    # histogram range from the sparse subsample
+    samp = subsample(values, range_size)
+    uniq = np.unique(samp)
+    if len(uniq) < nbins:
+        levels = _level_counts(values, uniq)
+        if levels is None:
+            median = np.median(values)
+            mad = np.median(np.abs(values - median))
+        else:
+            levels, counts = levels
+            median = _counts_median(levels, counts, n)
+            dev = np.abs(levels - median)
+            order = np.argsort(dev, kind='mergesort')
+            mad = _counts_median(dev[order], counts[order], n)
+        return SkyStats(
+                mean, median, 3. * median - 2. * mean, std,
+                MAD_TO_STD * mad, n)
+    samp_med = np.median(samp)
+    samp_mad = MAD_TO_STD * np.median(np.abs(samp - samp_med))
+    lo = samp_med - range_sigma * samp_mad
+    hi = samp_med + range_sigma * samp_mad
+    if not hi > lo:
+        lo, hi = np.min(values), np.max(values)
+    if not hi > lo:
+        return SkyStats(mean, lo, lo, std, 0., n)
+    width = (hi - lo) / nbins
+    index = np.floor((values - lo) / width)
+    np.clip(index, -1, nbins, out=index)
+    # the first and last bins are the under and overflow
+    counts = np.bincount((index + 1).astype('i8'), minlength=nbins + 2)
+    edges = lo + width * np.arange(-1, nbins + 1)
+    cdf = np.cumsum(counts)
+
+    def quantile(frac):
+        return _interp_quantile(frac * n, cdf, counts, edges, width)
+
+    median = quantile(0.5)
+    mad = _hist_mad(median, n, cdf, edges, width)
+    mode = 3. * median - 2. * mean
+    return SkyStats(mean, median, mode, std, MAD_TO_STD * mad, n)
+
+
+def _level_counts(values, uniq, max_levels=1 << 20):
+    # the sorted distinct levels and the counts of the discrete values,
+    # which are assumed on the grid of the smallest step between the
+    # levels of the subsample, or on the integers. None if they are not.
+    vmin, vmax = np.min(values), np.max(values)
+    if values.dtype.kind in 'iu':
+        step = 1.
+    else:
+        step = float(np.min(np.diff(uniq))) if len(uniq) > 1 else 1.
+    if not (float(vmax) - float(vmin)) / step < max_levels:
+        return None
+    if values.dtype.kind in 'iu':
+        index = np.subtract(values, vmin, dtype='i8')
+        counts = np.bincount(index)
+        levels = float(vmin) + np.arange(len(counts), dtype='d')
+    else:
+        offset = values - vmin
+        offset /= step
+        index = np.rint(offset, out=offset).astype('i4')
+        counts = np.bincount(index)
+        # the values of each level have to be the same
+        levels = np.zeros(len(counts), dtype=values.dtype)
+        levels[index] = values
+        if not np.array_equal(levels[index], values):
+            return None
+    keep = counts > 0
+    return levels[keep].astype('d'), counts[keep]
+
+
+def _counts_median(levels, counts, n):
+    # the median of n values of the sorted levels of counts
+    cdf = np.cumsum(counts)
+    lo = levels[np.searchsorted(cdf, (n - 1) // 2, side='right')]
+    hi = levels[np.searchsorted(cdf, n // 2, side='right')]
+    return 0.5 * (lo + hi)
+
+
+def _interp_quantile(k, cdf, counts, edges, width):
+    i = np.searchsorted(cdf, k)
+    i = min(i, len(cdf) - 1)
+    below = cdf[i] - counts[i]
+    frac = (k - below) / counts[i] if counts[i] > 0 else 0.5
+    return edges[i] + width * frac
+
+
+def _hist_cdf(x, cdf, edges, width):
+    # piecewise linear cdf evaluated at x
+    pos = (x - edges[0]) / width
+    i = int(np.clip(np.floor(pos), 0, len(cdf) - 1))
+    prev = cdf[i - 1] if i > 0 else 0
+    frac = np.clip(pos - i, 0., 1.)
+    return prev + (cdf[i] - prev) * frac
+
+
+def _hist_mad(median, n, cdf, edges, width, iters=40):
+    # solve cdf(median + t) - cdf(median - t) = n / 2 by bisection
+    lo, hi = 0., max(median - edges[0], edges[-1] + width - median)
+    for _ in range(iters):
+        t = 0.5 * (lo + hi)
+        frac = _hist_cdf(median + t, cdf, edges, width) - _hist_cdf(
+                median - t, cdf, edges, width)
+        if frac < 0.5 * n:
+            lo = t
+        else:
+            hi = t
+        if hi - lo < 1e-3 * width:
+            break
+    return 0.5 * (lo + hi)
+
+
+def iter_cell_bins(wl, nbin):
+    """
+    Yield the bins that divide each cell of the layout into nbin x nbin
+
+    Parameters
+    ----------
+    wl: layout
+        The layout that provides NCX, NCY, CW, CH and get_cell_rect.
+    nbin: int
+        The number of bins along each side of a cell.
+
+    Yields
+    ------
+    (cj, ci, bj, bi): tuple
+        The cell and bin indices along x and y.
+    (bb, bt, bl, br): tuple
+        The integer bottom, top, left and right edges of the bin.
+    (bx, by): tuple
+        The center of the bin.
+    """
+    bw = wl.CW / nbin
+    bh = wl.CH / nbin
+    for cj, ci in itertools.product(range(wl.NCX), range(wl.NCY)):
+        (cl, cr), (cb, ct) = wl.get_cell_rect(0, 0, cj, ci)
+        for bj, bi in itertools.product(range(nbin), repeat=2):
+            bl = cl + bj * bw
+            br = bl + bw
+            bb = cb + bi * bh
+            bt = bb + bh
+            bx = 0.5 * (bl + br)
+            by = 0.5 * (bb + bt)
+            yield ((cj, ci, bj, bi), tuple(map(int, (bb, bt, bl, br))),
+                   (bx, by))
+
+
+def cell_stats(data, wl, nbin, func=None):
+    """
+    Compute the medians, or func, of each cell bin of data
+
+    The medians of the finite values are computed in batch per cell: the
+    bins of the cell of the same shape are copied to one buffer, and the
+    medians computed by `nanmedian_rows` in one call, so only one cell of
+    data is copied at a time. If func is given, it is called on each bin
+    instead.
+
+    Returns
+    -------
+    stats: array
+        The array of shape ``(NCY * nbin, NCX * nbin)``, in which the
+        bin (bi, bj) of cell (ci, cj) is at
+        ``[ci * nbin + bi, cj * nbin + bj]``.
+    """
+    result = np.empty((wl.NCY * nbin, wl.NCX * nbin))
+    for _, cell in itertools.groupby(
+            iter_cell_bins(wl, nbin), key=lambda b: b[0][:2]):
+        groups = {}
+        for (cj, ci, bj, bi), (bb, bt, bl, br), _ in cell:
+            grid = data[bb:bt, bl:br]
+            index = (ci * nbin + bi, cj * nbin + bj)
+            if func is not None:
+                result[index] = func(grid)
+            else:
+                groups.setdefault(grid.shape, []).append((index, grid))
+        for shape, bins in groups.items():
+            stack = np.empty(
+                    (len(bins), shape[0] * shape[1]), dtype=data.dtype)
+            for i, (_, grid) in enumerate(bins):
+                stack[i].reshape(shape)[...] = grid
+            iy, ix = zip(*(index for index, _ in bins))
+            result[iy, ix] = nanmedian_rows(stack)
+    return result
+
+
+def bin_image(data, shape, binning, strip_size=64):
+    """
+    Return the NaN-aware block mean of data
+
+    The blocks are summed with `numpy.add.reduceat` in strips of block
+    rows, so data, e.g., a memmap, is read sequentially without being
+    copied to a padded buffer. Partial blocks at the edges are averaged
+    over the pixels they cover.
+
+    Parameters
+    ----------
+    data: array
+        The 2-d input array.
+    shape: tuple
+        The (ny, nx) shape of the binned image. The data are cropped to
+        ``(ny * binning, nx * binning)``, and the blocks not covered by
+        data are NaN.
+    binning: int
+        The size of the blocks.
+    strip_size: int
+        The number of block rows summed at a time.
+    """
+    ny, nx = map(int, shape)
+    binning = int(binning)
+    binned = np.full((ny, nx), np.nan)
+    cy = min(ny * binning, data.shape[0])
+    cx = min(nx * binning, data.shape[1])
+    if cy <= 0 or cx <= 0:
+        return binned
+    xedges = np.arange(0, cx, binning)
+    bx = len(xedges)
+    for y0 in range(0, cy, binning * strip_size):
+        y1 = min(y0 + binning * strip_size, cy)
+        strip = data[y0:y1, :cx]
+        finite = np.isfinite(strip)
+        yedges = np.arange(0, y1 - y0, binning)
+        total = np.add.reduceat(np.add.reduceat(
+            np.where(finite, strip, 0.), xedges, axis=1, dtype='d'),
+            yedges, axis=0)
+        count = np.add.reduceat(np.add.reduceat(
+            finite, xedges, axis=1, dtype='i8'), yedges, axis=0)
+        by0 = y0 // binning
+        with np.errstate(invalid='ignore', divide='ignore'):
+            binned[by0:by0 + len(yedges), :bx] = np.where(
+                    count > 0, total / count, np.nan)
+    return binned
+
+
+def zscale(data, nsamples=1000, contrast=0.25, max_reject=0.5,
+           min_npixels=5, krej=2.5, max_iterations=5):
+    """
+    Return the IRAF zscale limits of data
+
+    The limits are computed from at most nsamples finite values taken
+    with a constant stride, in the same way as
+    `~astropy.visualization.ZScaleInterval`, which is not used because
+    it imports matplotlib.
+
+    Returns
+    -------
+    vmin, vmax: float
+        The limits, nan if there is no finite value.
+    """
+    values = finite_values(data)
+    stride = int(max(1., len(values) / nsamples))
+    values = np.sort(values[::stride][:nsamples])
+    npix = len(values)
+    if npix == 0:
+        return np.nan, np.nan
+    vmin, vmax = values[0], values[-1]
+    minpix = max(min_npixels, int(npix * max_reject))
+    x = np.arange(npix)
+    badpix = np.zeros(npix, dtype=bool)
+    kernel = np.ones(max(1, int(npix * 0.01)), dtype=bool)
+    ngood = npix
+    last_ngood = npix + 1
+    slope = None
+    for _ in range(max_iterations):
+        if ngood >= last_ngood or ngood < minpix:
+            break
+        slope, intercept = np.polyfit(
+                x, values, deg=1, w=(~badpix).astype('d'))
+        flat = values - (slope * x + intercept)
+        threshold = krej * flat[~badpix].std()
+        badpix |= (flat < -threshold) | (flat > threshold)
+        badpix = np.convolve(badpix, kernel, mode='same') > 0
+        last_ngood = ngood
+        ngood = np.count_nonzero(~badpix)
+    if ngood >= minpix and slope is not None:
+        if contrast > 0:
+            slope = slope / contrast
+        center = (npix - 1) // 2
+        median = np.median(values)
+        vmin = max(vmin, median - (center - 1) * slope)
+        vmax = min(vmax, median + (npix - center) * slope)
+    return vmin, vmax
@@ -0,0 +1,48 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 13:30
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+test_archive_index.py
+"""
+
+import os
+import numpy as np
+from astropy.io import fits
+
+
+REG_ARCH = (r'(?P<imflag>[^_/]+_)?'
+            r'(?P<obsid>[^_/]*20\d{6}[Tt]\d{6}(?:\.\d)?)'
+            r'_(?P<object>.+?)'
+            r'_(?P<instru>odi|decam)_(?P<band>[ugrizY])(?:_.+)?\.'
+            r'(?P<ext>fits|fits\.fz)$')
+
+
+def test_parse_query():
+    from ..archive_index import parse_query
+    assert parse_query(['band=r', 'cone=10,-5,0.5', 'mjd=57000,']) == {
+            'band': 'r', 'cone': (10., -5., 0.5), 'mjd': (57000., None)}
+
+
+def test_archive_index(tmpdir):
+    from ..archive_index import ArchiveIndex
+    for imflag, obsid, band, ra in [
+            ('image', 'c4d20140101T000001', 'g', 10.),
+            ('instcaldqmask', 'c4d20140101T000001', 'g', 10.),
+            ('image', 'c4d20140101T000002', 'g', 50.)]:
+        header = fits.Header()
+        header['MJD-OBS'] = 57000.
+        header['CRVAL1'] = ra
+        header['CRVAL2'] = 0.
+        filename = str(tmpdir.mkdir(obsid + imflag).join(
+            '{}_{}_field_decam_{}.fits'.format(imflag, obsid, band)))
+        fits.HDUList([
+            fits.PrimaryHDU(header=header),
+            fits.ImageHDU(np.ones((3, 3)))]).writeto(filename)
+    with ArchiveIndex(str(tmpdir.join('index.sqlite'))) as index:
+        assert index.update([str(tmpdir)], REG_ARCH) == (3, 0)
+        assert index.update([str(tmpdir)], REG_ARCH) == (0, 0)
+        paths = index.query(band='g', cone=(10.5, 0., 1.))
+        assert [os.path.basename(p).split('_')[0] for p in paths] == [
+                'image', 'instcaldqmask']
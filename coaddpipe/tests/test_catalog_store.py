@@ -0,0 +1,64 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 20:40
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+test_catalog_store.py
+"""
+
+import numpy as np
+
+
+REG_MOSAIC = (r'(?P<ppflag>[a-z]+)(?P<grpid>\d+)_(?P<imflag>[^_/]+)'
+              r'_(?P<instru>odi|decam)_(?P<band>[ugrizY])'
+              r'\.(?P<ext>[^/]+)$')
+
+
+def test_ang2pix_nest():
+    from ..catalog_store import ang2pix_nest
+    assert list(ang2pix_nest(0, [0., 0., 0.], [90., 0., -90.])) == [0, 4, 8]
+    rng = np.random.RandomState(0)
+    ra = rng.uniform(0., 360., 100000)
+    dec = np.degrees(np.arcsin(rng.uniform(-1., 1., 100000)))
+    pix = ang2pix_nest(2, ra, dec)
+    assert (pix >> 2 == ang2pix_nest(1, ra, dec)).all()
+    counts = np.bincount(pix, minlength=192)
+    assert len(counts) == 192 and counts.min() > 0.8 * counts.mean()
+
+
+def test_catalog_store(tmpdir):
+    from astropy.table import Table
+    from ..catalog_store import CatalogStore
+    jobdir = tmpdir.mkdir('testjob')
+    # two fields across ra 0, and a shifted r band detection
+    ra = np.array([359.5, 359.9, 0.1, 0.4, 120.])
+    dec = np.array([0., 0.1, -0.1, 0., 30.])
+    cat_files = []
+    for band, dra in [('g', 0.), ('r', 0.3 / 3600.)]:
+        tbl = Table()
+        tbl['NUMBER'] = np.arange(len(ra))
+        tbl['ALPHA_J2000'] = (ra + dra) % 360.
+        tbl['DELTA_J2000'] = dec
+        tbl['MAG_AUTO'] = 20. + np.arange(len(ra))
+        tbl['MAGERR_AUTO'] = np.full(len(ra), 0.01)
+        if band == 'r':
+            tbl = tbl[1:]
+        filename = str(jobdir.join('coadd1_fsub_odi_{}.cat'.format(band)))
+        tbl.write(filename, format='ascii.commented_header')
+        cat_files.append(filename)
+    with CatalogStore(str(tmpdir.join('store')), order=4) as store:
+        assert store.ingest(cat_files, REG_MOSAIC) == [
+                'testjob/coadd1_fsub_odi_g', 'testjob/coadd1_fsub_odi_r']
+        assert store.ingest(cat_files, REG_MOSAIC) == []
+        assert len(store) == 9 and store.bands == ['g', 'r']
+        cat = store.cone(0., 0., 0.2, bands=['g'], columns=['MAG_AUTO'])
+        assert sorted(cat['MAG_AUTO']) == [21., 22.]
+        assert cat.colnames == ['ra', 'dec', 'band', 'catalog', 'MAG_AUTO']
+        cat = store.box(359.7, 0.2, -0.2, 0.2, bands=['g'])
+        assert sorted(cat['NUMBER']) == [1, 2]
+        cat = store.merged(0., 0., 1.)
+        cat.sort('MAG_AUTO_g')
+        assert len(cat) == 4
+        assert np.isnan(cat['MAG_AUTO_r'][0])
+        assert (cat['MAG_AUTO_r'][1:] == cat['MAG_AUTO_g'][1:]).all()
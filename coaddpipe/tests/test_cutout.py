@@ -0,0 +1,92 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 19:40
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+test_cutout.py
+"""
+
+import io
+import threading
+import numpy as np
+from urllib.request import urlopen
+from urllib.error import HTTPError
+
+
+REG_MOSAIC_FITS = r'(?P<ppflag>[a-z]+)(?P<grpid>\d+)_(?P<imflag>[^_/]+)' \
+                  r'_(?P<instru>odi)_(?P<band>[ugriz])\.fits$'
+REG_INPUTS = r'(?P<ppflag>[^_/]+_)?(?P<imflag>[^_/]+)' \
+             r'_(?P<obsid>20\d{6}T\d{6})_(?P<object>.+?)_(?P<instru>odi)_(?P<band>[ugriz])' \
+             r'\.(?P<ext>[^/]+)$'
+
+
+def make_coadd(filename, shape=(600, 500)):
+    from astropy.io import fits
+    ny, nx = shape
+    header = fits.Header()
+    header['CTYPE1'] = 'RA---TAN'
+    header['CTYPE2'] = 'DEC--TAN'
+    header['CRVAL1'] = 150.
+    header['CRVAL2'] = 2.
+    header['CRPIX1'] = nx / 2. + 0.5
+    header['CRPIX2'] = ny / 2. + 0.5
+    header['CD1_1'] = -1. / 3600.
+    header['CD2_2'] = 1. / 3600.
+    data = np.arange(ny * nx, dtype='f4').reshape(shape)
+    fits.PrimaryHDU(data=data, header=header).writeto(filename)
+    return data
+
+
+def test_cutout(tmpdir):
+    from astropy.io import fits
+    from ..cutout import (
+            scan_products, ProductIndex, TileCache, CutoutService,
+            CutoutServer)
+    data = make_coadd(str(tmpdir.join('coadd1_fsub_odi_g.fits')))
+    tmpdir.join('other.fits').write('')
+    products = scan_products(
+            [str(tmpdir)], REG_MOSAIC_FITS, REG_INPUTS)
+    assert [p.kind for p in products] == ['coadd']
+    index = ProductIndex(products)
+    assert index.locate(150., 10.) == []
+    (p, x, y), = index.locate(150., 2.)
+    assert np.isclose(x, 249.5) and np.isclose(y, 299.5)
+
+    cache = TileCache(maxsize=6, tile_size=64)
+    service = CutoutService(index, cache=cache)
+    # the cutout at the lower left corner is padded with NaN
+    product, hdu = service.cutout(*p.wcs.all_pix2world([[0, 0]], 0)[0], 20)
+    assert hdu.data.shape == (20, 20)
+    assert np.isnan(hdu.data[:10]).all() and np.isnan(hdu.data[:, :10]).all()
+    assert (hdu.data[10:, 10:] == data[:10, :10]).all()
+    assert hdu.header['CRPIX1'] == p.wcs.wcs.crpix[0] + 10
+    assert cache.misses == 1
+    ra, dec = p.wcs.all_pix2world([[250, 300]], 0)[0]
+    product, hdu = service.cutout(ra, dec, 100)
+    assert (hdu.data == data[250:350, 200:300]).all()
+    assert cache.misses == 7
+    service.cutout(ra, dec, 100)
+    assert cache.hits == 6 and len(cache._tiles) == 6
+
+    server = CutoutServer(('127.0.0.1', 0), service)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        with urlopen(url + '/cutout?ra={}&dec={}&size=10'.format(
+                ra, dec)) as r:
+            hdu = fits.open(io.BytesIO(r.read()))[0]
+        assert (hdu.data == data[295:305, 245:255]).all()
+        for query, code in [('ra=150&dec=10&size=10', 404),
+                            ('ra=150&dec=2', 400)]:
+            try:
+                urlopen(url + '/cutout?' + query)
+            except HTTPError as e:
+                assert e.code == code
+            else:
+                assert False
+    finally:
+        server.shutdown()
+        server.server_close()
+        cache.close()
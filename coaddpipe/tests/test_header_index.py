@@ -0,0 +1,58 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 12:30
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+test_header_index.py
+"""
+
+import gzip
+import shutil
+import numpy as np
+from astropy.io import fits
+
+
+def test_read_headers(tmpdir):
+    from ..header_index import read_headers, HeaderIndex
+    header = fits.Header()
+    header['INSTRUME'] = 'DECam'
+    header['OBJECT'] = "it's a field"
+    header['MJD-OBS'] = 57000.123456789
+    header['EXPTIME'] = 90
+    header['PHOTOMET'] = True
+    header['LONGSTR'] = 'x' * 100
+    ext = fits.ImageHDU(np.ones((10, 10), dtype='f4'))
+    ext.header['FILTER'] = 'g DECam SDSS c0001 4720.0 1520.0'
+    filename = str(tmpdir.join('image.fits.fz'))
+    fits.HDUList([
+        fits.PrimaryHDU(header=header),
+        fits.CompImageHDU(ext.data, header=ext.header),
+        fits.ImageHDU(np.ones(3))]).writeto(filename)
+    headers = read_headers(filename)
+    assert len(headers) == 2
+    for key in ['INSTRUME', 'OBJECT', 'MJD-OBS', 'EXPTIME', 'PHOTOMET',
+                'LONGSTR']:
+        assert headers[0][key] == header[key]
+    assert headers[1]['FILTER'] == ext.header['FILTER']
+    with HeaderIndex(str(tmpdir.join('index.sqlite'))) as index:
+        assert index.get_headers([filename]) == [headers]
+        # cached
+        assert index.get_headers([filename]) == [headers]
+
+
+def test_astropy_fallback(tmpdir):
+    from ..header_index import read_headers, HeaderIndex
+    header = fits.Header()
+    header['UNDEF'] = None
+    header['NPFLOAT'] = np.float32(1.5)
+    header['COMPLEX'] = 1 + 2j
+    filename = str(tmpdir.join('image.fits'))
+    fits.PrimaryHDU(header=header).writeto(filename)
+    gzname = filename + '.gz'
+    with open(filename, 'rb') as fi, gzip.open(gzname, 'wb') as fo:
+        shutil.copyfileobj(fi, fo)
+    with HeaderIndex(str(tmpdir.join('index.sqlite'))) as index:
+        assert index.get_headers([gzname]) == [read_headers(filename)]
+        # cached
+        assert index.get_headers([gzname]) == [read_headers(filename)]
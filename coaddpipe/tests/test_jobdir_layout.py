@@ -0,0 +1,33 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 16:50
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+test_jobdir_layout.py
+"""
+
+import os
+
+
+def test_side_product_path(tmpdir):
+    from ..jobdir_layout import (
+            write_jobdir_layout, side_product_path, side_product_dirs)
+    reg = r'(?P<imflag>[^_/]+)_(?P<obsid>obs\d+)_.+$'
+    jobdir = str(tmpdir)
+    flat = os.path.join(jobdir, 'masked_obs1_a.png')
+    write_jobdir_layout(jobdir, sharded=False, reg=reg)
+    assert side_product_path(flat, 'preview') == flat
+    assert side_product_dirs(jobdir, 'obs1') == []
+
+    write_jobdir_layout(jobdir, sharded=True, nshards=16, reg=reg)
+    sharded = side_product_path(flat, 'preview', create=True)
+    shard_dir = os.path.dirname(sharded)
+    assert os.path.basename(sharded) == os.path.basename(flat)
+    assert os.path.dirname(shard_dir) == os.path.join(jobdir, 'preview')
+    assert len(os.path.basename(shard_dir)) == 1
+    # products of the same obsid share the shard
+    assert os.path.dirname(side_product_path(
+        os.path.join(jobdir, 'fsub_obs1_a.fits.stats.npz'), 'stats')
+        ) == os.path.join(jobdir, 'stats', os.path.basename(shard_dir))
+    assert side_product_dirs(jobdir, 'obs1') == [shard_dir]
@@ -0,0 +1,39 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 18:40
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+test_png.py
+"""
+
+import zlib
+import struct
+import numpy as np
+
+
+def test_encode_png():
+    from ..png import encode_png, draw_text, text_size, PNG_SIGNATURE
+    image = np.full((10, 20), 255, dtype='u1')
+    draw_text(image, 'x1?', 2, 1)
+    assert text_size('x1?') == (5, 11)
+    assert image[2:7, 1:12].min() == 0
+    assert (image[:2] == 255).all()
+    # clipped at the edges
+    draw_text(image, 'TOO LONG', 8, 15, scale=2)
+
+    buf = encode_png(image)
+    assert buf.startswith(PNG_SIGNATURE)
+    pos = len(PNG_SIGNATURE)
+    chunks = {}
+    while pos < len(buf):
+        size, = struct.unpack('>I', buf[pos:pos + 4])
+        tag = buf[pos + 4:pos + 8]
+        chunks[tag] = buf[pos + 8:pos + 8 + size]
+        pos += 12 + size
+    w, h = struct.unpack('>II', chunks[b'IHDR'][:8])
+    assert (h, w) == image.shape
+    raw = np.frombuffer(
+            zlib.decompress(chunks[b'IDAT']), dtype='u1').reshape((h, -1))
+    assert (raw[:, 0] == 0).all()
+    assert (raw[:, 1:] == image).all()
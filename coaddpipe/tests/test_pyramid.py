@@ -0,0 +1,57 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 19:10
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+test_pyramid.py
+"""
+
+import os
+import zlib
+import struct
+import numpy as np
+
+
+def read_png(filename):
+    with open(filename, 'rb') as fo:
+        buf = fo.read()
+    pos = 8
+    chunks = {}
+    while pos < len(buf):
+        size, = struct.unpack('>I', buf[pos:pos + 4])
+        chunks[buf[pos + 4:pos + 8]] = buf[pos + 8:pos + 8 + size]
+        pos += 12 + size
+    w, h = struct.unpack('>II', chunks[b'IHDR'][:8])
+    raw = np.frombuffer(
+            zlib.decompress(chunks[b'IDAT']), dtype='u1').reshape((h, -1))
+    return raw[:, 1:]
+
+
+def test_build_pyramid(tmpdir):
+    from astropy.io import fits
+    from ..pyramid import build_pyramid, read_pyramid, get_tile_path
+    ny, nx = 600, 500
+    data = np.tile(np.linspace(0., 1., nx, dtype='f4'), (ny, 1))
+    data[:100] = 0.
+    hdulist = fits.HDUList([
+        fits.PrimaryHDU(), fits.ImageHDU(data, name='chip1')])
+    dirname = str(tmpdir.join('a.pyramid'))
+    manifest = build_pyramid(
+            hdulist, dirname, levels=[4, 1, 16], tile_size=128,
+            limits={1: (0., 1.)}, strip_size=70)
+    assert read_pyramid(dirname) == manifest
+    ext, = manifest['extensions']
+    assert ext['extname'] == 'CHIP1'
+    assert manifest['levels'] == [1, 4, 16]
+    assert ext['ntiles'] == [[5, 4], [2, 1], [1, 1]]
+    # the partial tiles at the top right
+    tile = read_png(get_tile_path(dirname, 1, 'CHIP1', 4, 3))
+    assert tile.shape == (88, 116)
+    # the tiles are flipped, the bottom rows of the data are zero
+    tile = read_png(get_tile_path(dirname, 4, 'CHIP1', 0, 0))
+    assert tile.shape == (128, 125)
+    assert (tile[-25:] == 0).all()
+    assert (tile[0, 1:] > tile[0, :-1]).all()
+    assert os.path.exists(get_tile_path(dirname, 16, 'CHIP1', 0, 0))
+    assert read_pyramid(str(tmpdir)) is None
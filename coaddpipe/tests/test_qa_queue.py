@@ -0,0 +1,42 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 18:00
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+test_qa_queue.py
+"""
+
+import os
+
+
+def write_plot(savename, content, kwargs):
+    with open(savename, 'w') as fo:
+        fo.write(content)
+
+
+def test_submit(tmpdir):
+    from ..qa_queue import submit, pending, render_qa
+    queue_dir = str(tmpdir.join('qa_queue'))
+    savename = str(tmpdir.join('a.png'))
+
+    submit(savename, write_plot, (savename, 'off'), {'qa_mode': 'off'})
+    assert not os.path.exists(savename)
+    submit(savename, write_plot, (savename, 'inline'), {})
+    with open(savename) as fo:
+        assert fo.read() == 'inline'
+
+    kwargs = {'qa_mode': 'deferred', 'qa_queue': queue_dir}
+    submit(savename, write_plot, (savename, 'old'), kwargs)
+    # the pending job of the same plot is replaced
+    submit(savename, write_plot, (savename, 'deferred'), kwargs)
+    submit('b', write_plot, (str(tmpdir), 'fail'), kwargs)
+    assert len(pending(queue_dir)) == 2
+
+    out_file = str(tmpdir.join('job.qa_rendered'))
+    render_qa(out_file, **kwargs)
+    assert pending(queue_dir) == []
+    with open(savename) as fo:
+        assert fo.read() == 'deferred'
+    with open(out_file) as fo:
+        assert fo.read().split() == [savename]
@@ -0,0 +1,46 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 11:40
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+test_sidecar.py
+"""
+
+import os
+import numpy as np
+from astropy.io import fits
+
+
+def test_sidecar(tmpdir):
+    from ..sidecar import write_sidecar, read_sidecar, sky_level
+    from ..instruments import get_layout
+    layout = get_layout(instru='decam', binning=32)
+    hdulist = fits.HDUList([fits.PrimaryHDU()])
+    hdulist[0].header['INSTRUME'] = 'DECam'
+    rng = np.random.RandomState(0)
+    for ext in range(1, max(layout.CL['ext']) + 1):
+        data = rng.normal(100. * ext, 2., (128, 64))
+        hdulist.append(fits.ImageHDU(data=data))
+    hdulist[2].data[:] = np.nan
+    filename = str(tmpdir.join('image.fits'))
+    hdulist.writeto(filename)
+    write_sidecar(filename, binning=32)
+    link = str(tmpdir.join('link.fits'))
+    os.symlink(filename, link)
+    stats = read_sidecar(link)
+    assert stats is not None
+    assert abs(stats.get(1, 'mode') - 100.) < 1.
+    assert abs(stats.get(1, 'sigma') - 2.) < 0.2
+    assert stats.get(1, 'valid') == 1.
+    # the same sky level is computed without the sidecar
+    assert sky_level(hdulist[1].data) == (
+            stats.get(1, 'mode'), stats.get(1, 'sigma'))
+    assert stats.get(2, 'valid') == 0.
+    assert stats.get(1, 'thumbnail').shape == (
+            int(layout.CH), int(layout.CW))
+    assert np.allclose(stats.get(1, 'thumbnail')[:4, :2], 100., atol=1.)
+    # outdated sidecar is ignored
+    with fits.open(filename, mode='update') as hdul:
+        hdul[0].header['FOO'] = 1
+    assert read_sidecar(link) is None
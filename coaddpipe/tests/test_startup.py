@@ -0,0 +1,102 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 17:20
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+test_startup.py
+
+The command line interface and the task listing should not import the
+heavy dependencies, which are only needed by the tasks.
+"""
+
+import os
+import re
+import sys
+import builtins
+import subprocess
+import pytest
+
+
+HEAVY_MODULES = [
+        'matplotlib', 'ruffus', 'astroquery', 'scipy', 'lmfit', 'pyregion',
+        'astropy.table', 'coaddpipe.qa', 'coaddpipe.pipeline.phot_calib']
+
+STARTUP_BUDGET = 2.  # seconds
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_isolated(code):
+    """Run code in a fresh interpreter, return the elapsed time and the
+    heavy modules imported"""
+    script = "\n".join([
+        "import builtins, sys, time",
+        # import the package the same way as this test session
+        "builtins._ASTROPY_SETUP_ = {!r}".format(
+            getattr(builtins, '_ASTROPY_SETUP_', False)),
+        "t0 = time.time()",
+        code,
+        "print()",
+        "print(time.time() - t0)",
+        "print(','.join(m for m in {!r} if m in sys.modules))".format(
+            HEAVY_MODULES),
+        ])
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(PACKAGE_DIR))
+    out = subprocess.check_output(
+            [sys.executable, '-c', script], env=env).decode().splitlines()
+    return float(out[-2]), [m for m in out[-1].split(',') if m]
+
+
+def test_help_startup():
+    elapsed, heavy = run_isolated("\n".join([
+        "from coaddpipe import main_cli",
+        "try:",
+        "    main_cli.main(['--help'])",
+        "except SystemExit:",
+        "    pass",
+        ]))
+    assert heavy == []
+    assert elapsed < STARTUP_BUDGET
+
+
+def test_task_list_startup():
+    elapsed, heavy = run_isolated("\n".join([
+        "import collections",
+        "from coaddpipe import pipeline",
+        "config = collections.defaultdict(str, jobfile='test.job')",
+        "tlist = pipeline.get_tlist(config)",
+        "print([t['name'] for t in tlist])",
+        ]))
+    assert heavy == []
+    assert elapsed < STARTUP_BUDGET
+
+
+def test_run_list_startup(tmpdir):
+    # the config of empty entries, except for those set by run_pipeline
+    with open(os.path.join(PACKAGE_DIR, 'pipeline', '__init__.py')) as fo:
+        keys = set(re.findall(r"config\['(\w+)'\]", fo.read()))
+    with open(os.path.join(PACKAGE_DIR, 'core.py')) as fo:
+        keys -= {a or b for a, b in re.findall(
+            r"config(?:\['(\w+)'\] =|\.setdefault\('(\w+)')", fo.read())}
+    config = dict.fromkeys(keys, '')
+    config.update(workdir=str(tmpdir), logdir=str(tmpdir))
+    config_file = tmpdir.join('coaddpipe.yaml')
+    config_file.write("\n".join(
+        "{}: '{}'".format(k, v) for k, v in sorted(config.items())))
+    jobfile = tmpdir.join('testjob.txt')
+    jobfile.write('')
+    elapsed, heavy = run_isolated("\n".join([
+        "from coaddpipe import main_cli",
+        "main_cli.main(['run', {!r}, '-c', {!r}, '-a', '-l'])".format(
+            str(jobfile), str(config_file)),
+        ]))
+    assert heavy == []
+    assert elapsed < STARTUP_BUDGET
+
+
+def test_stage_import():
+    # the catalog services are imported by the queries
+    pytest.importorskip('requests')
+    _, heavy = run_isolated("import coaddpipe.pipeline.prep_get_refcat")
+    assert 'astroquery' not in heavy
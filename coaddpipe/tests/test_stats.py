@@ -0,0 +1,108 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Create Date    :  2026-10-19 10:48
+# Git Repo       :  https://github.com/Jerry-Ma
+# Email Address  :  jerry.ma.nk@gmail.com
+"""
+test_stats.py
+"""
+
+import numpy as np
+
+
+def test_sky_stats():
+    from ..stats import sky_stats
+    data = np.random.RandomState(0).normal(100., 5., (512, 512))
+    data[::7, ::3] = np.nan
+    data[:4] += 1e5  # saturated rows
+    values = data[np.isfinite(data)]
+    s = sky_stats(data)
+    assert s.n == len(values)
+    assert abs(s.median - np.median(values)) < 0.01
+    assert abs(s.mad - 5.) < 0.1
+    assert np.isclose(s.mean, np.mean(values))
+    assert np.isclose(s.std, np.std(values))
+    assert np.isclose(s.mode, 3 * s.median - 2 * s.mean)
+    assert sky_stats(np.full(4, np.nan)).n == 0
+    # exact for discrete values
+    counts = np.random.RandomState(1).poisson(20., 100000).astype('f4')
+    s = sky_stats(counts)
+    assert s.median == np.median(counts)
+    assert np.isclose(
+            s.mad, 1.4826 * np.median(np.abs(counts - s.median)))
+    # integer images, and the half integer levels
+    rng = np.random.RandomState(2)
+    for counts in [rng.poisson(1000., 100001).astype('i2'),
+                   rng.poisson(20., 100000) * 0.5 - 3.25]:
+        counts[:10] = 30000
+        s = sky_stats(counts)
+        assert s.median == np.median(counts)
+        assert np.isclose(
+                s.mad, 1.4826 * np.median(np.abs(counts - s.median)))
+    # levels that are not on the grid of the subsample
+    counts = rng.poisson(20., 100000).astype('f4')
+    counts[1::1000] += 0.3
+    s = sky_stats(counts)
+    assert s.median == np.median(counts)
+
+
+def test_cell_stats():
+    from ..stats import cell_stats, iter_cell_bins, nanmedian
+    from ..instruments.wiyn import ODILayout
+    wl = ODILayout(binning=2)
+    data = np.zeros((wl.NCY * 300, wl.NCX * 300))
+    for (cj, ci, bj, bi), (bb, bt, bl, br), _ in iter_cell_bins(wl, 2):
+        data[bb:bt, bl:br] = cj * 100 + ci
+    result = cell_stats(data, wl, 2)
+    assert result.shape == (wl.NCY * 2, wl.NCX * 2)
+    assert result[5, 2] == 1 * 100 + 2
+    # the batched medians are those of the bins
+    data += np.random.RandomState(0).normal(0., 1., data.shape)
+    data[::3, ::5] = np.nan
+    data[:300, :300] = np.nan
+    result = cell_stats(data, wl, 2)
+    assert np.isnan(result[0, 0])
+    assert np.allclose(
+            result, cell_stats(data, wl, 2, func=nanmedian), equal_nan=True)
+    # the infinite values are ignored
+    data[300:600:3, :300] = -np.inf
+    data[:300, :300] = -np.inf
+    result = cell_stats(data, wl, 2)
+    assert np.isnan(result[0, 0]) and not np.isinf(result).any()
+    assert np.allclose(
+            result, cell_stats(data, wl, 2, func=nanmedian), equal_nan=True)
+    # integer images
+    data = np.random.RandomState(1).poisson(
+            1000., data.shape).astype('i2')
+    assert np.array_equal(
+            cell_stats(data, wl, 2), cell_stats(data, wl, 2, func=np.median))
+
+
+def test_nanmedian_rows():
+    from ..stats import nanmedian_rows
+    stack = np.array([
+        [1., -np.inf, 2., 3., np.nan],
+        [-np.inf, -np.inf, np.inf, 5., np.nan],
+        [np.nan, -np.inf, np.nan, np.inf, np.nan],
+        ])
+    assert np.array_equal(
+            nanmedian_rows(stack), [2., 5., np.nan], equal_nan=True)
+    stack = np.array([[3, 1, 2, 4], [7, 5, 6, 5]], dtype='i4')
+    assert np.array_equal(nanmedian_rows(stack), [2.5, 5.5])
+
+
+def test_bin_image():
+    from ..stats import bin_image, zscale
+    data = np.arange(20 * 18, dtype='f4').reshape((20, 18))
+    data[:4, :4] = np.nan
+    data[4, 4] = np.nan
+    binned = bin_image(data, (6, 4), 4, strip_size=2)
+    assert binned.shape == (6, 4)
+    assert np.isnan(binned[0, 0])
+    assert np.isnan(binned[5]).all()
+    assert np.isclose(binned[1, 1], np.nanmean(data[4:8, 4:8]))
+    # partial blocks at the edge
+    assert np.isclose(binned[1, 3], np.mean(data[4:8, 12:16]))
+    vmin, vmax = zscale(np.random.RandomState(0).normal(0., 1., 10000))
+    assert -4 < vmin < -1 and 1 < vmax < 4
+    assert np.isnan(zscale(np.full(4, np.nan))).all()
@@ -120,6 +120,14 @@ class RecursiveHelpAction(argparse._HelpAction):
         parser.exit()
 
 
+def get_pyplot():
+    """Return pyplot with the agg backend, imported on first use"""
+    import matplotlib
+    matplotlib.use("agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+
 def mp_traceback(func):
     @functools.wraps(func)
     def wrapper(*args, **kwargs):